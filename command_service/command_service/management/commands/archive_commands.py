@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.utils import timezone
+from datetime import timedelta
+from commands.archive import CommandArchiver
+
+class Command(BaseCommand):
+    help = 'Move finished commands older than the archive age to compressed cold storage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older_than_days', type=int, default=settings.COMMAND_ARCHIVE_AFTER_DAYS,
+                            help='Archive commands created more than this many days ago')
+        parser.add_argument('--chunk_size', type=int, default=1000, help='Rows fetched/deleted per query')
+        parser.add_argument('--dry_run', action='store_true', help='Only count commands that would be archived')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['older_than_days'])
+        archiver = CommandArchiver(chunk_size=options['chunk_size'])
+
+        stats = archiver.archive_before(cutoff, dry_run=options['dry_run'])
+
+        if options['dry_run']:
+            self.stdout.write(f"Would archive {stats['requests']} commands created before {cutoff.isoformat()}")
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {stats['requests']} commands and {stats['executions']} executions "
+            f"in {stats['segments']} segments (before {cutoff.isoformat()})"
+        ))
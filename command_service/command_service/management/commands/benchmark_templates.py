@@ -0,0 +1,166 @@
+from django.core.management.base import BaseCommand
+import json
+import re
+import time
+import uuid
+from datetime import datetime
+from commands.protocol_handlers.template_renderer import TemplateRenderer
+
+# Command templates từ vendor_service/demo.py
+DEMO_TEMPLATES = [
+    {
+        'command_type': 'get_status',
+        'url_template': 'devices/{device_id}',
+        'body_template': {},
+        'params': {'device_id': 'TL-001'},
+    },
+    {
+        'command_type': 'turn_on_green',
+        'url_template': 'devices/{device_id}/control',
+        'body_template': {'command': 'turn_on', 'intensity': 100},
+        'params': {'device_id': 'TL-001'},
+    },
+    {
+        'command_type': 'turn_on_red',
+        'url_template': 'devices/{device_id}/control',
+        'body_template': {'command': 'turn_off', 'intensity': 0},
+        'params': {'device_id': 'TL-001'},
+    },
+    {
+        'command_type': 'set_yellow',
+        'url_template': 'devices/{device_id}/control',
+        'body_template': {'command': 'set_yellow', 'intensity': 90},
+        'params': {'device_id': 'TL-001'},
+    },
+    {
+        'command_type': 'update_message',
+        'url_template': 'control/{device_id}',
+        'body_template': {'action': 'update_message', 'message': '{message}'},
+        'params': {'device_id': 'LED-001', 'message': 'Traffic ahead, reduce speed'},
+    },
+    {
+        'command_type': 'turn_on',
+        'url_template': 'control/{device_id}',
+        'body_template': {'action': 'turn_on'},
+        'params': {'device_id': 'LED-001'},
+    },
+    {
+        'command_type': 'start_recording',
+        'url_template': 'api/v2/cameras/{device_id}/start_recording',
+        'body_template': {},
+        'params': {'device_id': 'CAM-001'},
+    },
+    {
+        'command_type': 'zoom',
+        'url_template': 'api/v2/cameras/{device_id}/zoom',
+        'body_template': {'level': '{zoom_level}'},
+        'params': {'device_id': 'CAM-001', 'zoom_level': 3},
+    },
+]
+
+class RegexTemplateRenderer:
+    """
+    Baseline: TemplateRenderer trước khi compile templates - re.sub và
+    parse từng placeholder mỗi lần render, không cache
+    """
+
+    PLACEHOLDER = r'\{([^}]+)\}'
+
+    def __init__(self):
+        self.builtin_functions = {
+            'now': lambda: datetime.now().isoformat(),
+            'timestamp': lambda: int(datetime.now().timestamp()),
+            'uuid': lambda: str(uuid.uuid4()),
+        }
+
+    def render_template(self, template, params):
+        if isinstance(template, str):
+            return re.sub(self.PLACEHOLDER, lambda match: self._resolve_placeholder(match.group(1), params), template)
+        elif isinstance(template, dict):
+            return {k: self.render_template(v, params) for k, v in template.items()}
+        elif isinstance(template, list):
+            return [self.render_template(item, params) for item in template]
+        return template
+
+    def _resolve_placeholder(self, placeholder, params):
+        try:
+            if ':' in placeholder:
+                key, type_hint = placeholder.split(':', 1)
+                return self._convert_type(self._get_value(key.strip(), params), type_hint)
+            elif '|' in placeholder:
+                key, default = placeholder.split('|', 1)
+                try:
+                    return str(self._get_value(key.strip(), params))
+                except (KeyError, AttributeError):
+                    return default
+            elif placeholder.endswith('()'):
+                func_name = placeholder[:-2].strip()
+                if func_name in self.builtin_functions:
+                    return str(self.builtin_functions[func_name]())
+                raise ValueError(f"Unknown function: {func_name}")
+            return str(self._get_value(placeholder.strip(), params))
+        except Exception:
+            return f"{{{placeholder}}}"
+
+    def _get_value(self, key, params):
+        if '.' not in key:
+            return params[key]
+        value = params
+        for part in key.split('.'):
+            if isinstance(value, list):
+                value = value[int(part)]
+            elif isinstance(value, dict):
+                value = value[part]
+            else:
+                value = getattr(value, part)
+        return value
+
+    def _convert_type(self, value, type_hint):
+        if type_hint == 'int':
+            if isinstance(value, str) and '.' in value:
+                return str(int(float(value)))
+            return str(int(value))
+        elif type_hint == 'float':
+            return str(float(value))
+        elif type_hint == 'bool':
+            return str(bool(value)).lower()
+        elif type_hint == 'json':
+            return json.dumps(value)
+        return str(value)
+
+class Command(BaseCommand):
+    help = 'Benchmark compiled TemplateRenderer against the re.sub baseline on the demo command templates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20000, help='Renders per template')
+
+    def render_all(self, renderer_factory, iterations):
+        """Render url + body của mọi template; trả về thời gian trung bình mỗi command (µs)"""
+        start = time.perf_counter()
+        for _ in range(iterations):
+            for template in DEMO_TEMPLATES:
+                renderer = renderer_factory()
+                renderer.render_template(template['url_template'], template['params'])
+                renderer.render_template(template['body_template'], template['params'])
+        elapsed = time.perf_counter() - start
+        return elapsed / (iterations * len(DEMO_TEMPLATES)) * 1e6
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+
+        # Baseline: renderer cũ (re.sub mỗi lần render)
+        baseline_renderer = RegexTemplateRenderer()
+        baseline = self.render_all(lambda: baseline_renderer, iterations)
+
+        # Compiled templates được cache trong một renderer dùng chung
+        shared = TemplateRenderer()
+        compiled = self.render_all(lambda: shared, iterations)
+
+        for template in DEMO_TEMPLATES:
+            body = shared.render_template(template['body_template'], template['params'])
+            self.stdout.write(f"{template['command_type']:<16} {body}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"re.sub baseline: {baseline:.2f} µs/command, "
+            f"compiled: {compiled:.2f} µs/command, speedup {baseline / compiled:.1f}x"
+        ))
@@ -0,0 +1,109 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from datetime import datetime, timedelta, timezone as dt_timezone
+import json
+from commands.models import CommandRequest, CommandExecution
+from commands.idempotency import idempotency_store
+from commands.partitioning import (
+    PARTITIONED_TABLES, add_months, create_partition, default_partition_name, drop_partition,
+    expired_partitions, is_partitioned, list_partitions, month_start, partition_name, plan_relations
+)
+
+class Command(BaseCommand):
+    help = 'Pre-create monthly command table partitions and drop partitions past retention'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months_ahead', type=int, default=settings.PARTITION_PREMAKE_MONTHS,
+                            help='Create partitions up to this many months ahead')
+        parser.add_argument('--retention_days', type=int, default=settings.COMMAND_RETENTION_DAYS,
+                            help='Drop partitions whose whole range is older than this (0 = keep all)')
+        parser.add_argument('--dry_run', action='store_true', help='Only print what would change')
+        parser.add_argument('--verify_pruning', action='store_true',
+                            help='EXPLAIN time-bounded queries and check only one partition is scanned')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitioning requires PostgreSQL')
+
+        now = timezone.now()
+        current = month_start(now)
+        cutoff = now - timedelta(days=options['retention_days']) if options['retention_days'] else None
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            for table, column in PARTITIONED_TABLES.items():
+                if not is_partitioned(cursor, table):
+                    raise CommandError(f'{table} is not partitioned, run migrations first')
+
+                existing = {name for name, _ in list_partitions(cursor, table)}
+                for offset in range(options['months_ahead'] + 1):
+                    start = add_months(current, offset)
+                    if options['dry_run']:
+                        if partition_name(table, start) not in existing:
+                            self.stdout.write(f'Would create {partition_name(table, start)}')
+                    elif create_partition(cursor, table, column, start):
+                        self.stdout.write(self.style.SUCCESS(f'Created {partition_name(table, start)}'))
+
+                if cutoff is None:
+                    continue
+                for name, _ in expired_partitions(cursor, table, cutoff):
+                    if options['dry_run']:
+                        self.stdout.write(f'Would drop {name}')
+                    else:
+                        drop_partition(cursor, table, name)
+                        self.stdout.write(self.style.WARNING(f'Dropped {name}'))
+
+                # Rows cũ lọt vào default partition (ngoài các monthly ranges)
+                if not options['dry_run']:
+                    cursor.execute(
+                        f'DELETE FROM "{default_partition_name(table)}" WHERE "{column}" < %s', [cutoff]
+                    )
+                    if cursor.rowcount:
+                        self.stdout.write(self.style.WARNING(
+                            f'Deleted {cursor.rowcount} expired rows from {default_partition_name(table)}'
+                        ))
+
+        # Idempotency keys quá COMMAND_IDEMPOTENCY_TTL (bảng không partition)
+        if not options['dry_run']:
+            purged = idempotency_store.purge_expired(now)
+            if purged:
+                self.stdout.write(self.style.WARNING(f'Deleted {purged} expired idempotency keys'))
+
+        if options['verify_pruning']:
+            self.verify_pruning(current)
+
+    def verify_pruning(self, current):
+        """Query giới hạn trong một tháng chỉ được scan đúng partition tháng đó"""
+        start = datetime(current.year, current.month, 1, tzinfo=dt_timezone.utc)
+        end = start + timedelta(days=1)
+        queries = {
+            'commands_commandrequest': CommandRequest.objects.filter(
+                device_id='pruning-check', created_at__gte=start, created_at__lt=end
+            ),
+            'commands_commandexecution': CommandExecution.objects.filter(
+                completed_at__gte=start, completed_at__lt=end
+            ),
+        }
+
+        failed = []
+        with connection.cursor() as cursor:
+            for table, queryset in queries.items():
+                sql, params = queryset.query.sql_with_params()
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+
+                scanned = plan_relations(plan)
+                expected = {partition_name(table, current)}
+                if scanned == expected:
+                    self.stdout.write(self.style.SUCCESS(f'{table}: pruned to {", ".join(sorted(scanned))}'))
+                else:
+                    failed.append(table)
+                    self.stdout.write(self.style.ERROR(
+                        f'{table}: expected {", ".join(expected)}, scanned {", ".join(sorted(scanned)) or "nothing"}'
+                    ))
+
+        if failed:
+            raise CommandError(f'Partition pruning not effective for: {", ".join(failed)}')
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+import signal
+import sys
+from commands.scheduler import CommandScheduler
+
+class Command(BaseCommand):
+    help = 'Dispatch scheduled commands when they are due'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch_size', type=int, default=500, help='Max commands claimed per poll')
+        parser.add_argument('--poll_interval', type=float, default=1.0, help='Seconds between polls')
+        parser.add_argument('--lookahead', type=float, default=5.0, help='Claim and prewarm commands due within this many seconds')
+    
+    def signal_handler(self, signum, frame):
+        """Handle shutdown signals"""
+        self.stdout.write(self.style.WARNING('Received shutdown signal...'))
+        self.scheduler.stop()
+    
+    def handle(self, *args, **options):
+        self.scheduler = CommandScheduler(
+            batch_size=options['batch_size'],
+            poll_interval=options['poll_interval'],
+            lookahead=options['lookahead']
+        )
+        
+        signal.signal(signal.SIGINT, self.signal_handler)
+        signal.signal(signal.SIGTERM, self.signal_handler)
+        
+        self.stdout.write(self.style.SUCCESS('Command scheduler started'))
+        
+        try:
+            self.scheduler.run()
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f"Command scheduler error: {e}"))
+            sys.exit(1)
+        
+        self.stdout.write(self.style.SUCCESS('Command scheduler stopped'))
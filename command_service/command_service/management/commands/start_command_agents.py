@@ -1,101 +1,81 @@
 from django.conf import settings
 from django.core.management.base import BaseCommand
-import threading
-import time
+import os
 import signal
-import sys
-from commands.agents.api_test_agent import APITestAgent
 from commands.agents.device_command_agent import DeviceCommandAgent
+from commands.autoscaling import Autoscaler, LaneDepthReporter, LaneLagSource, ScalingPolicy
+from commands.dispatch import LANE_TOPICS
+from commands.supervisor import AgentSupervisor, WorkerSpec
 
 class Command(BaseCommand):
-   help = 'Start command processing agents'
-   
-   def __init__(self):
-       super().__init__()
-       self.agents = []
-       self.running = True
+   help = 'Start command processing agents (one process per agent, SIGHUP for rolling restart)'
    
    def add_arguments(self, parser):
-       parser.add_argument('--test_agents', type=int, default=1, help='Number of API test agents to start')
-       parser.add_argument('--device_agents', type=int, default=2, help='Number of device command agents to start')
+       parser.add_argument('--test_agents', type=int, default=1, help='Number of API test agent processes to start')
+       parser.add_argument('--device_agents', type=int, default=os.cpu_count() or 2, help='Number of device command agent processes to start (default: CPU count); minimum when autoscaling')
+       parser.add_argument('--max_device_agents', type=int, default=settings.AGENT_AUTOSCALE_MAX_WORKERS, help='Autoscale device agents up to this many processes by consumer lag (default: AGENT_AUTOSCALE_MAX_WORKERS, 0 = fixed)')
+       parser.add_argument('--device_concurrency', type=int, default=None, help='In-flight commands per device agent (default: DEVICE_AGENT_CONCURRENCY)')
+       parser.add_argument('--per_host_concurrency', type=int, default=None, help='In-flight commands per vendor host (default: DEVICE_AGENT_PER_HOST_CONCURRENCY)')
    
    def signal_handler(self, signum, frame):
        """Handle shutdown signals"""
        self.stdout.write(self.style.WARNING('Received shutdown signal...'))
-       self.running = False
-       
-       # Stop all agents gracefully
-       for agent in self.agents:
-           if hasattr(agent, 'stop'):
-               agent.stop()
-       
-       self.stdout.write(self.style.SUCCESS('All agents stopped'))
-       sys.exit(0)
+       self.supervisor.stop()
+   
+   def reload_handler(self, signum, frame):
+       self.stdout.write(self.style.WARNING('Received SIGHUP, rolling restart...'))
+       self.supervisor.request_rolling_restart()
    
    def handle(self, *args, **options):
-       # Setup signal handlers
-       signal.signal(signal.SIGINT, self.signal_handler)
-       signal.signal(signal.SIGTERM, self.signal_handler)
+       specs = [WorkerSpec(f"test-{i}", 'test') for i in range(options['test_agents'])]
+       specs += [
+           WorkerSpec(f"device-{i}", 'device', {
+               'concurrency': options['device_concurrency'],
+               'per_host_concurrency': options['per_host_concurrency'],
+           })
+           for i in range(options['device_agents'])
+       ]
        
-       threads = []
+       # Queue depth theo priority lane, dùng cho autoscaling (tổng) và metrics
+       lane_lag = LaneLagSource(DeviceCommandAgent.CONSUMER_GROUP, LANE_TOPICS)
+       autoscalers = []
+       if options['max_device_agents'] > options['device_agents']:
+           autoscalers.append(Autoscaler(
+               'device',
+               ScalingPolicy(
+                   min_workers=options['device_agents'],
+                   max_workers=options['max_device_agents'],
+                   target_lag=settings.AGENT_AUTOSCALE_TARGET_LAG,
+                   max_latency_ms=settings.AGENT_AUTOSCALE_MAX_LATENCY_MS,
+                   scale_up_after=settings.AGENT_AUTOSCALE_UP_AFTER,
+                   scale_down_after=settings.AGENT_AUTOSCALE_DOWN_AFTER,
+                   scale_down_ratio=settings.AGENT_AUTOSCALE_DOWN_RATIO,
+                   cooldown=settings.AGENT_AUTOSCALE_COOLDOWN
+               ),
+               lane_lag,
+               interval=settings.AGENT_AUTOSCALE_INTERVAL
+           ))
+           self.stdout.write(f"Autoscaling device agents between {options['device_agents']} "
+                             f"and {options['max_device_agents']} processes")
+       else:
+           autoscalers.append(LaneDepthReporter(lane_lag, interval=settings.DEVICE_COMMAND_LANE_DEPTH_INTERVAL))
        
-       # Start API test agents
-       for i in range(options.get('test_agents', 1)):
-           agent = APITestAgent(agent_id=f"test-{i}")
-           thread = threading.Thread(
-               target=self.run_agent_with_error_handling, 
-               args=(agent, 'test'),
-               daemon=False  # Không dùng daemon
-           )
-           thread.start()
-           threads.append(thread)
-           self.agents.append(agent)
-       
-       # Start device command agents  
-       for i in range(options.get('device_agents', 2)):
-           agent = DeviceCommandAgent(agent_id=f"device-{i}")
-           thread = threading.Thread(
-               target=self.run_agent_with_error_handling, 
-               args=(agent, 'device'),
-               daemon=False  # Không dùng daemon
-           )
-           thread.start()
-           threads.append(thread)
-           self.agents.append(agent)
-       
-       self.stdout.write(
-           self.style.SUCCESS(f"Started {len(self.agents)} command agents")
+       self.supervisor = AgentSupervisor(
+           specs,
+           heartbeat_interval=settings.AGENT_HEARTBEAT_INTERVAL,
+           heartbeat_timeout=settings.AGENT_HEARTBEAT_TIMEOUT,
+           startup_timeout=settings.AGENT_STARTUP_TIMEOUT,
+           stop_timeout=settings.AGENT_STOP_TIMEOUT,
+           backoff_base=settings.AGENT_RESTART_BACKOFF,
+           backoff_max=settings.AGENT_RESTART_BACKOFF_MAX,
+           stable_after=settings.AGENT_STABLE_AFTER,
+           autoscalers=autoscalers
        )
        
-       # Keep main thread alive
-       try:
-           while self.running:
-               time.sleep(1)
-               
-               # Optional: Check if any thread died
-               dead_threads = [t for t in threads if not t.is_alive()]
-               if dead_threads:
-                   self.stdout.write(
-                       self.style.WARNING(f"{len(dead_threads)} agent threads died")
-                   )
-               
-       except KeyboardInterrupt:
-           self.signal_handler(signal.SIGINT, None)
-   
-   def run_agent_with_error_handling(self, agent, agent_type):
-       """Run agent with proper error handling"""
-       try:
-           self.stdout.write(f'Starting {agent_type} agent {agent.agent_id}...')
-           agent.start_consumer()  # This should block
-           
-       except Exception as e:
-           self.stdout.write(
-               self.style.ERROR(f'Agent {agent.agent_id} failed: {e}')
-           )
-           # Wait before potential restart
-           time.sleep(5)
-           
-           # Optional: Restart agent
-           if self.running:
-               self.stdout.write(f'Restarting agent {agent.agent_id}...')
-               self.run_agent_with_error_handling(agent, agent_type)
\ No newline at end of file
+       signal.signal(signal.SIGINT, self.signal_handler)
+       signal.signal(signal.SIGTERM, self.signal_handler)
+       signal.signal(signal.SIGHUP, self.reload_handler)
+       
+       self.stdout.write(self.style.SUCCESS(f"Starting {len(specs)} command agent processes"))
+       self.supervisor.run()
+       self.stdout.write(self.style.SUCCESS('All agents stopped'))
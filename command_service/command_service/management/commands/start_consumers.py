@@ -4,6 +4,7 @@ import time
 import signal
 import sys
 from commands.consumers.device_command_consumer import DeviceCommandConsumer
+from commands.consumers.command_result_consumer import CommandResultConsumer
 
 class Command(BaseCommand):
     help = 'Start Kafka consumers for command service'
@@ -36,6 +37,10 @@ class Command(BaseCommand):
             device_consumer = DeviceCommandConsumer()
             self.consumers.append(device_consumer)
             
+            # Start result consumer (single writer cho command outcomes)
+            result_consumer = CommandResultConsumer()
+            self.consumers.append(result_consumer)
+            
             self.stdout.write(
                 self.style.SUCCESS(f"Started {len(self.consumers)} consumers")
             )
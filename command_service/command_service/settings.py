@@ -90,6 +90,23 @@ DATABASES = {
 }
 
 
+# Shared cache (command status...): Redis khi có REDIS_URL, không thì cache trong process
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -143,4 +160,131 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 10,
 }
 
-CORS_ALLOW_ALL_ORIGINS = os.getenv('DEBUG', 'True') == 'True'
\ No newline at end of file
+CORS_ALLOW_ALL_ORIGINS = os.getenv('DEBUG', 'True') == 'True'
+
+# Command agents
+DEVICE_AGENT_CONCURRENCY = int(os.getenv('DEVICE_AGENT_CONCURRENCY', '200'))
+DEVICE_AGENT_PER_HOST_CONCURRENCY = int(os.getenv('DEVICE_AGENT_PER_HOST_CONCURRENCY', '20'))
+DEVICE_AGENT_BLOCKING_WORKERS = int(os.getenv('DEVICE_AGENT_BLOCKING_WORKERS', '32'))
+# Tổng commands chờ trong các per-device queues của một agent
+DEVICE_AGENT_MAX_PENDING = int(os.getenv('DEVICE_AGENT_MAX_PENDING', '2000'))
+
+# Agent supervisor (mỗi agent một process)
+AGENT_HEARTBEAT_INTERVAL = float(os.getenv('AGENT_HEARTBEAT_INTERVAL', '5'))
+AGENT_HEARTBEAT_TIMEOUT = float(os.getenv('AGENT_HEARTBEAT_TIMEOUT', '30'))
+AGENT_STARTUP_TIMEOUT = float(os.getenv('AGENT_STARTUP_TIMEOUT', '60'))
+AGENT_STOP_TIMEOUT = float(os.getenv('AGENT_STOP_TIMEOUT', '45'))
+AGENT_RESTART_BACKOFF = float(os.getenv('AGENT_RESTART_BACKOFF', '1'))
+AGENT_RESTART_BACKOFF_MAX = float(os.getenv('AGENT_RESTART_BACKOFF_MAX', '60'))
+AGENT_STABLE_AFTER = float(os.getenv('AGENT_STABLE_AFTER', '60'))
+
+# Autoscaling device agents theo consumer lag (0 = số workers cố định)
+AGENT_AUTOSCALE_MAX_WORKERS = int(os.getenv('AGENT_AUTOSCALE_MAX_WORKERS', '0'))
+AGENT_AUTOSCALE_INTERVAL = float(os.getenv('AGENT_AUTOSCALE_INTERVAL', '10'))
+AGENT_AUTOSCALE_TARGET_LAG = int(os.getenv('AGENT_AUTOSCALE_TARGET_LAG', '1000'))
+AGENT_AUTOSCALE_MAX_LATENCY_MS = float(os.getenv('AGENT_AUTOSCALE_MAX_LATENCY_MS', '5000'))
+AGENT_AUTOSCALE_UP_AFTER = float(os.getenv('AGENT_AUTOSCALE_UP_AFTER', '30'))
+AGENT_AUTOSCALE_DOWN_AFTER = float(os.getenv('AGENT_AUTOSCALE_DOWN_AFTER', '300'))
+AGENT_AUTOSCALE_DOWN_RATIO = float(os.getenv('AGENT_AUTOSCALE_DOWN_RATIO', '0.3'))
+AGENT_AUTOSCALE_COOLDOWN = float(os.getenv('AGENT_AUTOSCALE_COOLDOWN', '60'))
+
+# Outbound HTTP connection pools (per vendor scheme/host/port)
+HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', '10'))
+HTTP_POOL_IDLE_TIMEOUT = int(os.getenv('HTTP_POOL_IDLE_TIMEOUT', '300'))
+
+# Compiled execution plans (per handler instance)
+EXECUTION_PLAN_CACHE_SIZE = int(os.getenv('EXECUTION_PLAN_CACHE_SIZE', '1000'))
+
+# Command context cache (per agent process)
+COMMAND_CONTEXT_CACHE_SIZE = int(os.getenv('COMMAND_CONTEXT_CACHE_SIZE', '10000'))
+COMMAND_CONTEXT_CACHE_TTL = int(os.getenv('COMMAND_CONTEXT_CACHE_TTL', '300'))
+
+# Bulk command fan-out
+BULK_COMMAND_MAX_DEVICES = int(os.getenv('BULK_COMMAND_MAX_DEVICES', '10000'))
+BULK_COMMAND_CHUNK_SIZE = int(os.getenv('BULK_COMMAND_CHUNK_SIZE', '100'))
+
+# Số device buckets dùng làm partition key của DEVICE_COMMANDS (nên >= số partitions)
+DEVICE_DISPATCH_BUCKETS = int(os.getenv('DEVICE_DISPATCH_BUCKETS', '64'))
+
+# Write-behind batching của command status/execution writes: result consumer
+# ghi mỗi batch outcomes (đợi tối đa FLUSH_MS, flush sớm khi đủ MAX_ROWS rows)
+WRITE_BEHIND_FLUSH_MS = int(os.getenv('WRITE_BEHIND_FLUSH_MS', '200'))
+WRITE_BEHIND_MAX_ROWS = int(os.getenv('WRITE_BEHIND_MAX_ROWS', '500'))
+
+# Monthly partitions của command tables (manage_partitions)
+PARTITION_PREMAKE_MONTHS = int(os.getenv('PARTITION_PREMAKE_MONTHS', '3'))
+COMMAND_RETENTION_DAYS = int(os.getenv('COMMAND_RETENTION_DAYS', '90'))
+
+# Cold archive của command history (archive_commands)
+COMMAND_ARCHIVE_AFTER_DAYS = int(os.getenv('COMMAND_ARCHIVE_AFTER_DAYS', '30'))
+COMMAND_ARCHIVE_STORAGE = os.getenv('COMMAND_ARCHIVE_STORAGE', 'commands.storage.LocalFileStorage')
+COMMAND_ARCHIVE_ROOT = os.getenv('COMMAND_ARCHIVE_ROOT', str(BASE_DIR / 'archive'))
+COMMAND_ARCHIVE_SHARDS = int(os.getenv('COMMAND_ARCHIVE_SHARDS', '16'))
+COMMAND_ARCHIVE_SEGMENT_ROWS = int(os.getenv('COMMAND_ARCHIVE_SEGMENT_ROWS', '50000'))
+# Số rows mặc định / tối đa của GET /commands/archive/
+COMMAND_ARCHIVE_QUERY_LIMIT = int(os.getenv('COMMAND_ARCHIVE_QUERY_LIMIT', '1000'))
+COMMAND_ARCHIVE_QUERY_MAX_LIMIT = int(os.getenv('COMMAND_ARCHIVE_QUERY_MAX_LIMIT', '10000'))
+
+# Vendor response capture: size cap, inline limit và blob store cho bodies lớn
+RESPONSE_MAX_BYTES = int(os.getenv('RESPONSE_MAX_BYTES', str(10 * 1024 * 1024)))
+RESPONSE_INLINE_BYTES = int(os.getenv('RESPONSE_INLINE_BYTES', str(64 * 1024)))
+RESPONSE_BLOB_STORAGE = os.getenv('RESPONSE_BLOB_STORAGE', 'commands.storage.LocalFileStorage')
+RESPONSE_BLOB_ROOT = os.getenv('RESPONSE_BLOB_ROOT', str(BASE_DIR / 'blobs'))
+
+# Command status stream (SSE / long-poll) fed bởi COMMAND_RESULTS.
+# Mỗi SSE stream / long-poll giữ một worker thread tới khi xong (tối đa
+# STREAM_TIMEOUT / MAX_WAIT giây): chạy web bằng threaded workers (gunicorn
+# --worker-class gthread --threads N) với MAX_WAITERS < N để requests
+# thường vẫn còn threads; quá MAX_WAITERS client nhận 503 + Retry-After.
+# EventSource tự reconnect khi stream đóng.
+COMMAND_STATUS_HUB_SIZE = int(os.getenv('COMMAND_STATUS_HUB_SIZE', '10000'))
+COMMAND_STATUS_HUB_TTL = int(os.getenv('COMMAND_STATUS_HUB_TTL', '600'))
+COMMAND_STATUS_SEED_TTL = int(os.getenv('COMMAND_STATUS_SEED_TTL', '10'))
+COMMAND_STATUS_MAX_WAIT = int(os.getenv('COMMAND_STATUS_MAX_WAIT', '20'))
+COMMAND_STATUS_STREAM_TIMEOUT = int(os.getenv('COMMAND_STATUS_STREAM_TIMEOUT', '60'))
+COMMAND_STATUS_MAX_WAITERS = int(os.getenv('COMMAND_STATUS_MAX_WAITERS', '32'))
+COMMAND_STATUS_BUSY_RETRY_AFTER = int(os.getenv('COMMAND_STATUS_BUSY_RETRY_AFTER', '5'))
+COMMAND_STATUS_KEEPALIVE = int(os.getenv('COMMAND_STATUS_KEEPALIVE', '15'))
+
+# Cache của command status (in-process tier + shared cache)
+COMMAND_STATUS_CACHE_TTL = int(os.getenv('COMMAND_STATUS_CACHE_TTL', '3600'))
+COMMAND_STATUS_LOCAL_CACHE_SIZE = int(os.getenv('COMMAND_STATUS_LOCAL_CACHE_SIZE', '10000'))
+COMMAND_STATUS_LOCAL_CACHE_TTL = int(os.getenv('COMMAND_STATUS_LOCAL_CACHE_TTL', '2'))
+
+# Device command timeline (keyset pagination)
+COMMAND_TIMELINE_PAGE_SIZE = int(os.getenv('COMMAND_TIMELINE_PAGE_SIZE', '50'))
+COMMAND_TIMELINE_MAX_PAGE_SIZE = int(os.getenv('COMMAND_TIMELINE_MAX_PAGE_SIZE', '500'))
+
+# Idempotency-Key của POST /commands/execute/ (shared cache + DB unique constraint)
+COMMAND_IDEMPOTENCY_TTL = int(os.getenv('COMMAND_IDEMPOTENCY_TTL', '86400'))
+
+# Vendor rate limiting (token bucket theo api_config + host, Redis khi có REDIS_URL)
+VENDOR_RATE_LIMIT_DEFAULT = float(os.getenv('VENDOR_RATE_LIMIT_DEFAULT', '0'))
+VENDOR_RATE_LIMIT_DEFAULT_BURST = int(os.getenv('VENDOR_RATE_LIMIT_DEFAULT_BURST', '0'))
+# Chờ trong agent nếu bucket có token trong khoảng này, lâu hơn thì defer command
+VENDOR_RATE_LIMIT_MAX_WAIT = float(os.getenv('VENDOR_RATE_LIMIT_MAX_WAIT', '1'))
+
+# Circuit breakers theo vendor host / api_config (trong mỗi agent process)
+CIRCUIT_BREAKER_WINDOW = int(os.getenv('CIRCUIT_BREAKER_WINDOW', '60'))
+CIRCUIT_BREAKER_MIN_REQUESTS = int(os.getenv('CIRCUIT_BREAKER_MIN_REQUESTS', '20'))
+CIRCUIT_BREAKER_ERROR_RATE = float(os.getenv('CIRCUIT_BREAKER_ERROR_RATE', '0.5'))
+CIRCUIT_BREAKER_OPEN_SECONDS = int(os.getenv('CIRCUIT_BREAKER_OPEN_SECONDS', '30'))
+CIRCUIT_BREAKER_HALF_OPEN_CALLS = int(os.getenv('CIRCUIT_BREAKER_HALF_OPEN_CALLS', '3'))
+
+# Deadline mặc định của command (giây tính từ lúc tạo / scheduled_at, 0 = không giới hạn)
+COMMAND_DEFAULT_TIMEOUT = int(os.getenv('COMMAND_DEFAULT_TIMEOUT', '600'))
+COMMAND_MAX_TIMEOUT = int(os.getenv('COMMAND_MAX_TIMEOUT', '86400'))
+# Retry đang chờ trong agent được lưu là 'scheduled' tại next_attempt_at + grace,
+# attempt của retry chạy dưới lease request timeout + grace; command scheduler
+# dispatch lại nếu agent chết trước khi retry có outcome
+COMMAND_RETRY_RECOVERY_GRACE = int(os.getenv('COMMAND_RETRY_RECOVERY_GRACE', '60'))
+
+# Priority lanes của device command dispatch (high / normal / low topics)
+DEVICE_COMMAND_DEFAULT_LANE = os.getenv('DEVICE_COMMAND_DEFAULT_LANE', 'normal')
+BULK_COMMAND_DEFAULT_LANE = os.getenv('BULK_COMMAND_DEFAULT_LANE', 'low')
+# Số messages agent đọc từ mỗi lane trong một vòng weighted round-robin
+DEVICE_COMMAND_LANE_WEIGHT_HIGH = int(os.getenv('DEVICE_COMMAND_LANE_WEIGHT_HIGH', '8'))
+DEVICE_COMMAND_LANE_WEIGHT_NORMAL = int(os.getenv('DEVICE_COMMAND_LANE_WEIGHT_NORMAL', '3'))
+DEVICE_COMMAND_LANE_WEIGHT_LOW = int(os.getenv('DEVICE_COMMAND_LANE_WEIGHT_LOW', '1'))
+# Chu kỳ report queue depth của từng lane (supervisor)
+DEVICE_COMMAND_LANE_DEPTH_INTERVAL = float(os.getenv('DEVICE_COMMAND_LANE_DEPTH_INTERVAL', '30'))
@@ -14,6 +14,7 @@ class APITestAgent:
     def __init__(self, agent_id):
         self.agent_id = agent_id  # Đã có "test-" prefix từ management command
         self.vendor_service = VendorServiceClient()
+        self.handler = get_protocol_handler("http")
         self.is_running = False
         
     def start_consumer(self):
@@ -41,12 +42,15 @@ class APITestAgent:
             self.is_running = True
             while self.is_running:
                 time.sleep(1)
-                # Optional: Add heartbeat or health check here
                 
         except Exception as e:
             print(f"APITestAgent {self.agent_id} error: {e}")
             raise
     
+    def is_healthy(self):
+        """Consumer còn chạy (dùng cho supervisor heartbeat)"""
+        return self.is_running and kafka_service.is_consumer_alive(f'api-test-agents-{self.agent_id}')
+    
     def stop(self):
         """Stop the agent gracefully"""
         print(f"Stopping APITestAgent {self.agent_id}")
@@ -77,8 +81,7 @@ class APITestAgent:
             
             # Execute test
             start_time = time.time()
-            handler = get_protocol_handler("http")
-            result = handler.execute_command(
+            result = self.handler.execute_command(
                 api_config, 
                 command_template, 
                 test_params,
@@ -1,20 +1,93 @@
+import asyncio
+import random
 import time
+import uuid
 from datetime import timedelta
+from django.conf import settings
 from django.utils import timezone
 from shared.grpc.services.vendor_service import VendorServiceClient
-from shared.kafka import kafka_service
-from shared.kafka.topics import Topics, EventTypes
+from shared.kafka import kafka_service, metrics_aggregator
+from shared.kafka.topics import EventTypes
 from shared.kafka.publisher import EventPublisher
-from commands.protocol_handlers import get_protocol_handler
-from commands.models import CommandExecution, CommandRequest
+from commands.agents.device_queues import DeviceCommandQueues
+from commands.agents.execution_engine import AsyncExecutionEngine
+from commands.protocol_handlers import AsyncHTTPHandler
+from commands.blob_store import BlobStore
+from commands.rate_limit import RateLimited, rate_limiter
+from commands.circuit_breaker import circuit_breakers
+from commands.deadlines import deadline_of, is_expired, publish_timeout, remaining_seconds
+from commands.retry import RetryPolicy, is_retryable
+from commands.context_cache import context_cache
+from commands.dispatch import lane_weights
+from commands.consumers.context_invalidation_consumer import start_context_invalidation
+
+def split_ack(ack, count):
+    """
+    Tách ack của một message chứa `count` commands thành `count` acks
+    (gọi nhiều lần không sao); message được ack khi mọi commands đã ack
+    """
+    remaining = set(range(count))
+
+    def part(index):
+        def command_ack():
+            if index in remaining:
+                remaining.discard(index)
+                if not remaining and ack is not None:
+                    ack()
+        return command_ack
+
+    if not count and ack is not None:
+        ack()
+    return [part(index) for index in range(count)]
 
 class DeviceCommandAgent:
     """Agent chuyên xử lý device commands thực tế"""
     
-    def __init__(self, agent_id):
+    # Tất cả device agents dùng chung một consumer group để chia partitions,
+    # tránh việc mỗi agent nhận và thực thi lại cùng một command
+    CONSUMER_GROUP = 'device-command-agents'
+    
+    def __init__(self, agent_id, concurrency=None, per_host_concurrency=None):
         self.agent_id = agent_id
         self.vendor_service = VendorServiceClient()
         self.is_running = False
+        self.consumer_key = f'device-command-agents-{self.agent_id}'
+        
+        concurrency = concurrency or settings.DEVICE_AGENT_CONCURRENCY
+        per_host_concurrency = per_host_concurrency or settings.DEVICE_AGENT_PER_HOST_CONCURRENCY
+        
+        self.handler = AsyncHTTPHandler(
+            concurrency=concurrency,
+            per_host_concurrency=per_host_concurrency,
+            idle_timeout=settings.HTTP_POOL_IDLE_TIMEOUT,
+            plan_cache_size=settings.EXECUTION_PLAN_CACHE_SIZE,
+            max_response_bytes=settings.RESPONSE_MAX_BYTES,
+            inline_response_bytes=settings.RESPONSE_INLINE_BYTES,
+            blob_store=BlobStore(),
+            rate_limiter=rate_limiter,
+            circuit_breakers=circuit_breakers
+        )
+        self.engine = AsyncExecutionEngine(
+            name=f'device-agent-{self.agent_id}',
+            concurrency=concurrency,
+            blocking_workers=settings.DEVICE_AGENT_BLOCKING_WORKERS
+        )
+        # Commands của mỗi device chạy tuần tự, coalesce theo CommandTemplate
+        self.device_queues = DeviceCommandQueues(
+            execute=self._run_device_command,
+            supersede=self._supersede,
+            is_coalescing=self._is_coalescing,
+            max_pending=settings.DEVICE_AGENT_MAX_PENDING
+        )
+        self.engine.on_drain(self.device_queues.drain)
+        self.engine.on_stop(self.handler.close)
+        
+        # Giới hạn commands in-flight, kể cả commands chạy trong bulk batches
+        self.concurrency = concurrency
+        self._command_slots = None
+        # command_id -> thời điểm (monotonic) hết recovery lease của các commands
+        # có retry / deferral đã persist (message đã ack, scheduler recover từ DB)
+        self._leases = {}
         
     def start_consumer(self):
         """Consumer cho device commands - MUST BLOCK"""
@@ -25,11 +98,19 @@ class DeviceCommandAgent:
             if not kafka_service.kafka_enabled:
                 raise Exception("Kafka service not enabled")
             
-            # Create consumer - listen for EXECUTING events
-            success = kafka_service.create_consumer(
-                topics=[Topics.DEVICE_COMMANDS],
-                group_id=f'device-command-agents-{self.agent_id}',
-                message_handler=self.handle_device_command
+            self.engine.start()
+            start_context_invalidation()
+            
+            # Create consumer - listen for EXECUTING events trên mọi priority
+            # lanes, weighted round-robin để lane cao đi trước mà lane thấp
+            # không bị starve. Một consumer cho mọi lanes nên commands của một
+            # device ở mọi lanes đều vào agent này
+            success = kafka_service.create_weighted_consumer(
+                lanes=lane_weights(),
+                group_id=self.CONSUMER_GROUP,
+                message_handler=self.handle_device_command,
+                consumer_key=self.consumer_key,
+                manual_ack=True
             )
             
             if not success:
@@ -46,29 +127,181 @@ class DeviceCommandAgent:
             print(f"DeviceCommandAgent {self.agent_id} error: {e}")
             raise
     
+    def is_healthy(self):
+        """Consumer và execution engine đều còn chạy (dùng cho supervisor heartbeat)"""
+        return self.is_running and kafka_service.is_consumer_alive(self.consumer_key) and self.engine.is_alive()
+    
+    def handler_latency_ms(self):
+        """EWMA thời gian thực thi một attempt (None nếu chưa xử lý command nào)"""
+        return self.engine.latency_ms
+    
     def stop(self):
         """Stop the agent gracefully"""
         print(f"Stopping DeviceCommandAgent {self.agent_id}")
         self.is_running = False
-        kafka_service.stop_consumer(f'device-command-agents-{self.agent_id}')
+        # Ngừng nhận commands mới nhưng vẫn commit offsets của commands chạy nốt
+        # trong lúc engine drain, rồi mới close consumer
+        kafka_service.drain_consumer(self.consumer_key)
+        self.engine.stop()
+        kafka_service.stop_consumer(self.consumer_key, join_timeout=10)
     
-    def handle_device_command(self, message):
-        """Handle device command execution"""
+    def handle_device_command(self, message, ack):
+        """
+        Handle device command execution. `ack` chỉ được gọi khi command đã có
+        outcome hoặc retry đã được persist: agent dừng trước đó thì message
+        được deliver lại (at-least-once).
+        """
         try:
             event_type = message.get('event_type')
             command_data = message.get('data', {})
             
             # Only process EXECUTING events (từ command consumer)
             if event_type == EventTypes.DEVICE_COMMAND_EXECUTING:
-                print(f"DeviceCommandAgent {self.agent_id} processing command: {command_data.get('command_id')}")
-                self.execute_device_command(command_data)
+                # Command quá deadline khi còn trong topic: bỏ, không chiếm engine
+                if is_expired(command_data):
+                    publish_timeout(command_data, stage='dispatch', agent_id=self.agent_id)
+                    ack()
+                    return
+                metrics_aggregator.increment('device_commands_consumed', lane=command_data.get('priority') or 'normal')
+                print(f"DeviceCommandAgent {self.agent_id} queueing command: {command_data.get('command_id')}")
+                # Block consumer thread khi engine queue đầy (backpressure)
+                self.engine.submit(self.execute_device_command, command_data, None, ack)
+            elif event_type == EventTypes.DEVICE_COMMAND_BATCH_EXECUTING:
+                commands = command_data.get('commands', [])
+                lane = (commands[0].get('priority') if commands else None) or 'normal'
+                metrics_aggregator.increment('device_commands_consumed', len(commands), lane=lane)
+                print(f"DeviceCommandAgent {self.agent_id} queueing {len(command_data.get('commands', []))} "
+                      f"commands of batch {command_data.get('batch_id')}")
+                self.engine.submit(self.execute_batch, command_data, ack)
+            elif event_type == EventTypes.DEVICE_COMMAND_PREWARM:
+                # Prewarm chỉ là tối ưu, mất khi agent dừng cũng không sao
+                ack()
+                self.engine.submit(self.prewarm_context, command_data)
+            else:
+                ack()
                 
         except Exception as e:
+            # Không ack (ví dụ engine đã dừng): message được deliver lại
             print(f"DeviceCommandAgent {self.agent_id} error handling command: {e}")
             
-    def execute_device_command(self, command_data):
-        """Execute command on actual device"""
+    async def execute_batch(self, batch_data, ack=None):
+        """
+        Execute một chunk của bulk batch: load contexts song song rồi chạy
+        commands theo nhóm api_config, để các commands cùng vendor chạy liền
+        nhau và dùng chung execution plan cache và connection pool.
+        Message của chunk được ack khi mọi commands đã được ack.
+        """
+        batch = batch_data.get('commands', [])
+        commands, acks = [], []
+        for command_data, command_ack in zip(batch, split_ack(ack, len(batch))):
+            if is_expired(command_data):
+                await self.engine.run_blocking(publish_timeout, command_data, 'dispatch', self.agent_id)
+                command_ack()
+            else:
+                commands.append(command_data)
+                acks.append(command_ack)
+        contexts = await asyncio.gather(
+            *(self.get_context(c.get('device_id'), c.get('command_type')) for c in commands),
+            return_exceptions=True
+        )
+        
+        groups = {}
+        for command_data, context, command_ack in zip(commands, contexts, acks):
+            if isinstance(context, Exception):
+                # execute_device_command sẽ load lại và ghi nhận lỗi
+                context = None
+            api_config_id = (context or {}).get('api_config', {}).get('id')
+            groups.setdefault(api_config_id, []).append((command_data, context, command_ack))
+        
+        # Tasks được tạo theo thứ tự nhóm; command slots (FIFO) giữ thứ tự đó
+        tasks = []
+        for api_config_id, group in groups.items():
+            print(f"DeviceCommandAgent {self.agent_id} batch {batch_data.get('batch_id')}: "
+                  f"{len(group)} commands for api_config {api_config_id}")
+            for command_data, context, command_ack in group:
+                tasks.append(asyncio.ensure_future(self.execute_device_command(command_data, context, command_ack)))
+        await asyncio.gather(*tasks)
+    
+    async def execute_device_command(self, command_data, context=None, ack=None):
+        """Đưa command vào queue của device (chạy tuần tự theo device)"""
+        try:
+            await self.device_queues.submit(command_data, context, ack)
+        except Exception:
+            # Không được giữ offset của partition mãi
+            if ack is not None:
+                ack()
+            raise
+    
+    async def _run_device_command(self, command_data, context=None):
+        """
+        Execute command, giới hạn số commands in-flight của agent. Trả về
+        (command_data, delay) của retry cho device queue (retry chạy trước
+        các commands sau của device), None nếu command đã kết thúc.
+
+        Khi vendor bucket hết token, command nhả slot rồi chờ (nếu token có
+        lại trong VENDOR_RATE_LIMIT_MAX_WAIT) hoặc được defer - không tính là
+        một attempt thất bại.
+        """
+        if self._command_slots is None:
+            self._command_slots = asyncio.Semaphore(self.concurrency)
         command_id = command_data.get('command_id')
+        while True:
+            try:
+                await self._wait_leased(command_data, self._command_slots.acquire())
+                try:
+                    # Handler latency cho autoscaling: thời gian một attempt, không tính
+                    # thời gian chờ trong device queue / command slot
+                    started = time.monotonic()
+                    retry = await self._execute_device_command(command_data, context)
+                    self.engine.observe_latency((time.monotonic() - started) * 1000)
+                finally:
+                    self._command_slots.release()
+                if retry is None:
+                    self._leases.pop(command_id, None)
+                return retry
+            except RateLimited as e:
+                metrics_aggregator.increment('vendor_requests_throttled', command_type=command_data.get('command_type'))
+                remaining = remaining_seconds(command_data)
+                if remaining is not None and remaining <= e.retry_after:
+                    # Không còn token trước deadline
+                    await self.engine.run_blocking(publish_timeout, command_data, 'throttled', self.agent_id)
+                    self._leases.pop(command_id, None)
+                    return
+                if e.retry_after > settings.VENDOR_RATE_LIMIT_MAX_WAIT:
+                    delay = await self.engine.run_blocking(self._defer, command_data, e)
+                    return command_data, delay
+                await self._wait_leased(command_data, asyncio.sleep(e.retry_after))
+    
+    async def _wait_leased(self, command_data, awaitable):
+        """
+        Chờ command slot / rate limit. Command có retry đã persist được renew
+        recovery lease khi lease sắp hết mà vẫn đang chờ, để scheduler không
+        dispatch lại command trong lúc agent vẫn giữ nó.
+        """
+        command_id = command_data.get('command_id')
+        task = asyncio.ensure_future(awaitable)
+        try:
+            while True:
+                expires = self._leases.get(command_id)
+                timeout = None
+                if expires is not None:
+                    timeout = max(0, expires - settings.COMMAND_RETRY_RECOVERY_GRACE / 2 - time.monotonic())
+                done, _ = await asyncio.wait({task}, timeout=timeout)
+                if done:
+                    return task.result()
+                await self.engine.run_blocking(self._renew_lease, command_data)
+        finally:
+            if not task.done():
+                task.cancel()
+    
+    async def _execute_device_command(self, command_data, context=None):
+        """Execute command on actual device (trả về retry nếu attempt cần retry)"""
+        command_id = command_data.get('command_id')
+        
+        # Có thể đã chờ lâu trong device queue / chờ command slot
+        if is_expired(command_data):
+            await self.engine.run_blocking(publish_timeout, command_data, 'execution', self.agent_id)
+            return
         
         try:
             device_id = command_data.get('device_id')
@@ -77,121 +310,279 @@ class DeviceCommandAgent:
             
             print(f"Executing device command {command_type} on device {device_id}")
             
-            # Lấy full context từ gRPC
-            context = self.get_device_command_context(device_id, command_type)
+            # Lấy full context (cache hoặc gRPC)
+            if context is None:
+                context = await self.get_context(device_id, command_type)
             
-            # Execute với device-specific context
             start_time = time.time()
-            handler = get_protocol_handler("http")
             
-            print(f"Using context: {context}")
             api_config       = context["api_config"]
             command_template = context["command_template"]
             device_info      = context["device"]
             device_command  = context["device_command"]
             command_params = {**device_command.get('custom_params', {}), **command_params}
             
-            # Get and update CommandRequest status
+            await self.engine.run_blocking(
+                self._publish_started, command_data, device_info.get('timeout') or api_config.get('timeout') or 30
+            )
+            
+            retry_policy = RetryPolicy.from_context(context, max_retries=command_data.get('max_retries', 3))
+            
             try:
-                command_request = CommandRequest.objects.get(id=command_id)
-                command_request.status = 'executing'
-                command_request.save()
-            except CommandRequest.DoesNotExist:
-                print(f"Warning: CommandRequest {command_id} not found, creating new one")
-                command_request = CommandRequest.objects.create(
-                    id=command_id,
-                    device_id=device_id,
-                    command_type=command_type,
-                    command_params=command_params,
-                    user_id=command_data.get('user_id', 'system'),
-                    status='executing'
+                result = await self.handler.execute_command_async(
+                    api_config,
+                    command_template,
+                    command_params,
+                    device=device_info,
+                    deadline=deadline_of(command_data)
                 )
-            
-            result = handler.execute_command(
-                api_config,
-                command_template,
-                command_params,
-                device=device_info
-            )
+            except RateLimited:
+                raise
+            except Exception as e:
+                # Chỉ lỗi kết nối/timeout tới vendor (error_code) được retry
+                result = {'success': False, 'error': str(e), 'error_code': self.handler.error_code(e)}
             execution_time = time.time() - start_time
             
             success = result.get('success', False)
-            
-            # Update CommandRequest status
-            command_request.status = 'completed' if success else 'failed'
-            command_request.save()
-            
-            # Store execution record với correct ForeignKey
-            CommandExecution.objects.create(
-                command_request=command_request,  # Sử dụng ForeignKey thay vì command_request_id
-                agent_id=self.agent_id,
-                api_config_id=str(api_config.get('id', '')),
-                protocol="http",
-                result=result,
-                error_message=result.get('error', '') if not success else '',
-                response_data=result.get('response_data', {}),
-                execution_time=execution_time,
-                response_size=len(str(result.get('response_data', {}))),
-                started_at=timezone.now() - timedelta(seconds=execution_time),
-                completed_at=timezone.now()
+            metrics_aggregator.record_command(
+                command_type, success, execution_time,
+                device_id=device_id, vendor_id=api_config.get('vendor_id')
             )
             
-            # Publish success/failure event
-            event_type = EventTypes.DEVICE_COMMAND_COMPLETED if success else EventTypes.DEVICE_COMMAND_FAILED
-            EventPublisher.publish_command_event(
-                event_type,
-                {
-                    'command_id': command_id,
-                    'device_id': device_id,
-                    'command_type': command_type,
-                    'result': result,
-                    'execution_time': execution_time,
-                    'agent_id': self.agent_id,
-                    'success': success,
-                    'status': command_request.status
-                }
+            return await self.engine.run_blocking(
+                self._record_execution, command_data, api_config, result, execution_time, retry_policy
             )
             
+        except RateLimited:
+            raise
         except Exception as e:
             print(f"DeviceCommandAgent {self.agent_id} execute_device_command error: {e}")
-            
-            # Update CommandRequest status to failed
-            try:
-                if command_id:
-                    command_request = CommandRequest.objects.get(id=command_id)
-                    command_request.status = 'failed'
-                    command_request.save()
-                    
-                    # Store failed execution record
-                    CommandExecution.objects.create(
-                        command_request=command_request,
-                        agent_id=self.agent_id,
-                        api_config_id='',
-                        protocol="http",
-                        result={},
-                        error_message=str(e),
-                        response_data={},
-                        execution_time=0,
-                        response_size=0,
-                        started_at=timezone.now(),
-                        completed_at=timezone.now()
-                    )
-            except Exception as update_error:
-                print(f"Failed to update command status: {update_error}")
-            
-            # Publish failure event
-            EventPublisher.publish_command_event(
-                EventTypes.DEVICE_COMMAND_FAILED,
-                {
-                    'command_id': command_id,
-                    'device_id': command_data.get('device_id'),
-                    'command_type': command_data.get('command_type'),
-                    'error': str(e),
+            metrics_aggregator.record_command(
+                command_data.get('command_type'), False, 0,
+                device_id=command_data.get('device_id')
+            )
+            await self.engine.run_blocking(self._record_failure, command_data, e)
+    
+    async def _is_coalescing(self, command_data, context=None):
+        """CommandTemplate của command có bật coalesce không"""
+        try:
+            if context is None:
+                context = await self.get_context(command_data.get('device_id'), command_data.get('command_type'))
+            return bool(context['command_template'].get('coalesce'))
+        except Exception:
+            # Lỗi load context sẽ được ghi nhận khi execute
+            return False
+    
+    async def _supersede(self, command_data, newer):
+        """Bỏ qua command đã bị command mới hơn cùng loại thay thế"""
+        print(f"DeviceCommandAgent {self.agent_id} command {command_data.get('command_id')} "
+              f"superseded by {newer.get('command_id')}")
+        metrics_aggregator.increment('device_commands_superseded', command_type=command_data.get('command_type'))
+        self._leases.pop(command_data.get('command_id'), None)
+        await self.engine.run_blocking(self._publish_superseded, command_data, newer.get('command_id'))
+    
+    async def get_context(self, device_id, command_type):
+        """Lấy command context từ cache, gọi gRPC khi miss"""
+        context = context_cache.get(device_id, command_type)
+        if context is not None:
+            return context
+        return await self.engine.run_blocking(
+            context_cache.load, device_id, command_type, self.get_device_command_context
+        )
+    
+    async def prewarm_context(self, command_data):
+        """Load device context vào cache trước khi scheduled command tới hạn"""
+        try:
+            await self.get_context(command_data.get('device_id'), command_data.get('command_type'))
+        except Exception as e:
+            print(f"DeviceCommandAgent {self.agent_id} prewarm error: {e}")
+    
+    def _publish_started(self, command_data, request_timeout=30):
+        """Publish outcome 'started' (result consumer set status executing)"""
+        data = {
+            'command_id': command_data.get('command_id'),
+            'device_id': command_data.get('device_id'),
+            'command_type': command_data.get('command_type'),
+            'attempt': command_data.get('attempt', 0),
+            'agent_id': self.agent_id,
+            'status': 'executing'
+        }
+        if data['command_id'] in self._leases:
+            # Message đã ack: attempt chạy dưới lease, hết lease mà chưa có
+            # outcome (agent dừng) thì scheduler dispatch lại command
+            lease = request_timeout + settings.COMMAND_RETRY_RECOVERY_GRACE
+            data['lease_until'] = (timezone.now() + timedelta(seconds=lease)).isoformat()
+            self._leases[data['command_id']] = time.monotonic() + lease
+        EventPublisher.publish_command_result(EventTypes.DEVICE_COMMAND_STARTED, data)
+    
+    def _renew_lease(self, command_data):
+        """Gia hạn recovery lease của retry đã tới hạn nhưng vẫn đang chờ trong agent"""
+        EventPublisher.publish_command_result(
+            EventTypes.DEVICE_COMMAND_RETRY_SCHEDULED,
+            {
+                'command_id': command_data.get('command_id'),
+                'device_id': command_data.get('device_id'),
+                'command_type': command_data.get('command_type'),
+                'attempt': command_data.get('attempt', 0),
+                'lease': True,
+                'next_attempt_at': timezone.now().isoformat(),
+                'agent_id': self.agent_id,
+                'status': 'scheduled'
+            }
+        )
+        self._leases[command_data.get('command_id')] = time.monotonic() + settings.COMMAND_RETRY_RECOVERY_GRACE
+    
+    def _publish_superseded(self, command_data, superseded_by):
+        """Publish outcome 'superseded' kèm command đã thay thế"""
+        EventPublisher.publish_command_result(
+            EventTypes.DEVICE_COMMAND_SUPERSEDED,
+            {
+                'command_id': command_data.get('command_id'),
+                'device_id': command_data.get('device_id'),
+                'command_type': command_data.get('command_type'),
+                'superseded_by': superseded_by,
+                'agent_id': self.agent_id,
+                'status': 'superseded'
+            }
+        )
+    
+    def _record_execution(self, command_data, api_config, result, execution_time, retry_policy):
+        """
+        Publish outcome kèm execution record (một record cho mỗi attempt).
+        Trả về (command_data, delay) của retry, None nếu không retry.
+        """
+        success = result.get('success', False)
+        attempt = command_data.get('attempt', 0)
+        retry = not success and is_retryable(result) and retry_policy.should_retry(attempt)
+        if retry:
+            # Circuit đang open: không retry trước khi circuit chuyển half-open
+            delay = max(retry_policy.next_delay(attempt), result.get('retry_after') or 0)
+            remaining = remaining_seconds(command_data)
+            # Retry sẽ chạy sau deadline: kết thúc với outcome của attempt này
+            retry = remaining is None or remaining > delay
+        
+        completed_at = timezone.now()
+        execution = {
+            # Execution id do agent sinh ra: ghi lại cùng outcome là idempotent
+            'id': str(uuid.uuid4()),
+            'agent_id': self.agent_id,
+            'api_config_id': str(api_config.get('id', '')),
+            'protocol': 'http',
+            # Body (inline hoặc blob ref + preview) chỉ lưu ở response_data
+            'result': {key: value for key, value in result.items() if key != 'response'},
+            'error_message': result.get('error', '') if not success else '',
+            'response_data': result.get('response'),
+            'execution_time': execution_time,
+            'response_size': result.get('response_size', 0),
+            'started_at': completed_at - timedelta(seconds=execution_time),
+            'completed_at': completed_at,
+        }
+        
+        if retry:
+            return self._schedule_retry(command_data, result, attempt + 1, retry_policy, execution, delay)
+        
+        # Publish success/failure outcome
+        event_type = EventTypes.DEVICE_COMMAND_COMPLETED if success else EventTypes.DEVICE_COMMAND_FAILED
+        EventPublisher.publish_command_result(
+            event_type,
+            {
+                'command_id': command_data.get('command_id'),
+                'device_id': command_data.get('device_id'),
+                'command_type': command_data.get('command_type'),
+                'result': execution['result'],
+                'execution_time': execution_time,
+                'agent_id': self.agent_id,
+                'success': success,
+                'status': 'completed' if success else 'failed',
+                'execution': execution
+            }
+        )
+    
+    def _schedule_retry(self, command_data, result, attempt, retry_policy, execution, delay):
+        """
+        Publish retry đang chờ (được lưu để recover nếu agent dừng) và trả về
+        (command_data, delay) để device queue chạy retry sau backoff delay
+        """
+        next_attempt_at = timezone.now() + timedelta(seconds=delay)
+        EventPublisher.publish_command_result(
+            EventTypes.DEVICE_COMMAND_RETRY_SCHEDULED,
+            {
+                'command_id': command_data.get('command_id'),
+                'device_id': command_data.get('device_id'),
+                'command_type': command_data.get('command_type'),
+                'attempt': attempt,
+                'retry_count': attempt,
+                'max_retries': retry_policy.max_retries,
+                'error': result.get('error') or f"HTTP {result.get('status_code')}",
+                'retry_delay': delay,
+                'next_attempt_at': next_attempt_at.isoformat(),
+                'agent_id': self.agent_id,
+                'status': 'scheduled',
+                'execution': execution
+            }
+        )
+        self._leases[command_data.get('command_id')] = (
+            time.monotonic() + delay + settings.COMMAND_RETRY_RECOVERY_GRACE
+        )
+        print(f"Retry of command {command_data.get('command_id')} scheduled in {delay:.1f}s (attempt {attempt})")
+        return {**command_data, 'attempt': attempt}, delay
+    
+    def _defer(self, command_data, throttled):
+        """Publish deferral của command bị rate limit, trả về delay tới lần chạy lại (giữ nguyên attempt)"""
+        # Jitter để các commands cùng bị defer không quay lại cùng lúc (trong deadline)
+        jitter = throttled.retry_after
+        remaining = remaining_seconds(command_data)
+        if remaining is not None:
+            jitter = min(jitter, remaining - throttled.retry_after)
+        delay = throttled.retry_after + random.random() * jitter
+        EventPublisher.publish_command_result(
+            EventTypes.DEVICE_COMMAND_RETRY_SCHEDULED,
+            {
+                'command_id': command_data.get('command_id'),
+                'device_id': command_data.get('device_id'),
+                'command_type': command_data.get('command_type'),
+                'attempt': command_data.get('attempt', 0),
+                'throttled': True,
+                'error': str(throttled),
+                'retry_delay': delay,
+                'next_attempt_at': (timezone.now() + timedelta(seconds=delay)).isoformat(),
+                'agent_id': self.agent_id,
+                'status': 'scheduled'
+            }
+        )
+        self._leases[command_data.get('command_id')] = (
+            time.monotonic() + delay + settings.COMMAND_RETRY_RECOVERY_GRACE
+        )
+        return delay
+    
+    def _record_failure(self, command_data, error):
+        """Publish failure outcome (lỗi trước khi gọi được vendor)"""
+        now = timezone.now()
+        EventPublisher.publish_command_result(
+            EventTypes.DEVICE_COMMAND_FAILED,
+            {
+                'command_id': command_data.get('command_id'),
+                'device_id': command_data.get('device_id'),
+                'command_type': command_data.get('command_type'),
+                'error': str(error),
+                'agent_id': self.agent_id,
+                'success': False,
+                'status': 'failed',
+                'execution': {
+                    'id': str(uuid.uuid4()),
                     'agent_id': self.agent_id,
-                    'success': False,
-                    'status': 'failed'
+                    'api_config_id': '',
+                    'protocol': 'http',
+                    'result': {},
+                    'error_message': str(error),
+                    'response_data': {},
+                    'execution_time': 0,
+                    'response_size': 0,
+                    'started_at': now,
+                    'completed_at': now,
                 }
-            )
+            }
+        )
     
     def get_device_command_context(self, device_id, command_type):
         """Get full device command context via gRPC"""
@@ -0,0 +1,139 @@
+import asyncio
+from collections import OrderedDict, deque
+from datetime import datetime
+
+def command_order(command_data):
+    """
+    Thời điểm command có hiệu lực: scheduled_at (scheduled commands) hoặc
+    created_at. Dùng để so sánh command nào mới hơn khi coalescing.
+    """
+    value = command_data.get('scheduled_at') or command_data.get('created_at')
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value) if isinstance(value, str) else value
+    except ValueError:
+        return None
+
+class DeviceCommandQueues:
+    """
+    Per-device command queues chạy trên event loop của agent.
+
+    Commands của cùng một device chạy tuần tự theo thứ tự nhận (thứ tự
+    partition, vì mọi dispatch được key theo device); các devices khác nhau
+    chạy song song. Trước khi chạy command kế tiếp của device, nếu template
+    của command_type bật `coalesce` và có command cùng loại mới hơn (đang chờ
+    trong queue hoặc đã chạy), command đó được đánh dấu superseded thay vì
+    gọi vendor.
+
+    `execute` trả về (command_data, delay) khi attempt cần retry: queue chờ
+    delay rồi chạy retry trước command kế tiếp của device, nên retry không
+    làm đảo thứ tự commands của device. Retry của command coalesce bị bỏ
+    nếu trong lúc chờ đã có command cùng loại mới hơn.
+
+    `submit()` trả về ngay sau khi enqueue; tổng số commands đang chờ bị giới
+    hạn bởi `max_pending` (backpressure lên engine workers / consumer).
+    `ack` của command được gọi khi attempt đầu tiên đã có outcome hoặc retry
+    đã được publish (hoặc command bị superseded), không chờ các retries.
+    """
+
+    # Số (device, command_type) được nhớ command đã chạy gần nhất
+    MAX_TRACKED = 100000
+
+    def __init__(self, execute, supersede, is_coalescing, max_pending=1000):
+        self.execute = execute
+        self.supersede = supersede
+        self.is_coalescing = is_coalescing
+        self.max_pending = max_pending
+
+        self._queues = {}
+        self._runners = {}
+        self._latest = OrderedDict()
+        self._space = None
+        self._stats = {'executed': 0, 'superseded': 0, 'retried': 0}
+
+    async def submit(self, command_data, context=None, ack=None):
+        """Thêm command vào queue của device (chờ nếu đã có max_pending commands)"""
+        if self._space is None:
+            self._space = asyncio.Semaphore(self.max_pending)
+        await self._space.acquire()
+
+        device_id = command_data.get('device_id')
+        self._queues.setdefault(device_id, deque()).append((command_data, context, ack))
+        if device_id not in self._runners:
+            self._runners[device_id] = asyncio.ensure_future(self._run(device_id))
+
+    async def _run(self, device_id):
+        queue = self._queues[device_id]
+        try:
+            while queue:
+                command_data, context, ack = queue.popleft()
+                try:
+                    while command_data is not None:
+                        newer = await self._superseded_by(command_data, context, queue)
+                        if newer is not None:
+                            self._stats['superseded'] += 1
+                            await self.supersede(command_data, newer)
+                            break
+                        self._stats['executed'] += 1
+                        retry = await self.execute(command_data, context)
+                        # Outcome hoặc retry đã được publish: offset có thể commit
+                        if ack is not None:
+                            ack()
+                            ack = None
+                        command_data = None
+                        if retry is not None:
+                            command_data, delay = retry
+                            self._stats['retried'] += 1
+                            await asyncio.sleep(delay)
+                except Exception as e:
+                    print(f"Device queue {device_id} error: {e}")
+                finally:
+                    if ack is not None:
+                        ack()
+                    self._space.release()
+        finally:
+            del self._queues[device_id]
+            del self._runners[device_id]
+
+    async def _superseded_by(self, command_data, context, queue):
+        """Command mới hơn cùng loại thay thế command_data (None nếu phải chạy)"""
+        key = (command_data.get('device_id'), command_data.get('command_type'))
+        order = command_order(command_data)
+        if not await self.is_coalescing(command_data, context):
+            return None
+
+        # Command cùng loại mới nhất đang chờ trong queue
+        newer = None
+        for candidate, _, _ in queue:
+            if candidate.get('command_type') != key[1]:
+                continue
+            candidate_order = command_order(candidate)
+            if order is None or (candidate_order is not None and candidate_order >= order):
+                newer = candidate
+        if newer is not None:
+            return newer
+
+        # Command cùng loại mới hơn đã chạy (ví dụ command này là một retry đến muộn)
+        latest = self._latest.get(key)
+        if latest is not None and order is not None and latest[0] is not None and latest[0] > order:
+            return latest[1]
+
+        self._latest[key] = (order, command_data)
+        self._latest.move_to_end(key)
+        while len(self._latest) > self.MAX_TRACKED:
+            self._latest.popitem(last=False)
+        return None
+
+    async def drain(self, timeout=30):
+        """Chờ các commands đã enqueue chạy xong (gọi khi agent stop)"""
+        runners = list(self._runners.values())
+        if runners:
+            await asyncio.wait(runners, timeout=timeout)
+
+    def stats(self):
+        return {
+            **self._stats,
+            'devices': len(self._queues),
+            'pending': sum(len(queue) for queue in self._queues.values()),
+        }
@@ -0,0 +1,178 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+class AsyncExecutionEngine:
+    """
+    Asyncio execution engine cho agents.
+
+    Chạy một event loop trong background thread với một pool worker
+    coroutines đọc từ bounded queue. Kafka consumer thread gọi `submit()`,
+    hàm này block khi queue đầy (backpressure). Blocking work (Django ORM,
+    gRPC) chạy trong executor riêng của loop qua `run_blocking()`.
+
+    Stop: queue và drain hooks (`on_drain`) dùng chung một budget
+    `drain_timeout`; cleanup hooks (`on_stop`) luôn chạy sau đó, kể cả khi
+    drain hết budget, mỗi hook tối đa CLOSE_TIMEOUT giây.
+    """
+
+    # Thời gian tối đa của mỗi cleanup hook khi stop
+    CLOSE_TIMEOUT = 5
+
+    def __init__(self, name, concurrency=100, queue_size=None, blocking_workers=32):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size or concurrency * 2
+        self.blocking_workers = blocking_workers
+
+        self.loop = None
+        self._queue = None
+        self._workers = []
+        self._thread = None
+        self._ready = threading.Event()
+        self._executor = None
+        self._in_flight = 0
+        self._on_drain = []
+        self._on_stop = []
+        # EWMA thời gian xử lý mỗi command (ms) do caller report qua
+        # observe_latency(), dùng cho autoscaling
+        self.latency_ms = None
+
+    def start(self):
+        """Start event loop thread và worker coroutines"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        self._ready.clear()
+        self._thread = threading.Thread(target=self._run_loop, name=f"{self.name}-loop", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        print(f"Execution engine {self.name} started with {self.concurrency} workers")
+
+    def _run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.blocking_workers,
+            thread_name_prefix=f"{self.name}-blocking"
+        )
+        self.loop.set_default_executor(self._executor)
+
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._workers = [
+            self.loop.create_task(self._worker(i))
+            for i in range(self.concurrency)
+        ]
+        self._ready.set()
+
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+            self._executor.shutdown(wait=False)
+
+    async def _worker(self, worker_index):
+        while True:
+            coro_func, args = await self._queue.get()
+            self._in_flight += 1
+            try:
+                await coro_func(*args)
+            except Exception as e:
+                print(f"Execution engine {self.name} worker {worker_index} error: {e}")
+            finally:
+                self._in_flight -= 1
+                self._queue.task_done()
+
+    def observe_latency(self, value_ms, alpha=0.2):
+        """
+        Report thời gian xử lý một command. Worker coroutine có thể chỉ
+        enqueue command (ví dụ vào device queue) nên caller đo quanh phần
+        thực thi thật.
+        """
+        if self.latency_ms is None:
+            self.latency_ms = value_ms
+        else:
+            self.latency_ms += alpha * (value_ms - self.latency_ms)
+
+    def submit(self, coro_func, *args, timeout=None):
+        """
+        Submit coroutine function từ thread khác (thread-safe).
+        Block cho tới khi queue có chỗ trống.
+        """
+        if not self.loop or not self.loop.is_running():
+            raise RuntimeError(f"Execution engine {self.name} is not running")
+
+        future = asyncio.run_coroutine_threadsafe(self._queue.put((coro_func, args)), self.loop)
+        future.result(timeout=timeout)
+
+    async def run_blocking(self, func, *args):
+        """Chạy blocking function trong executor của engine"""
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    def on_drain(self, coro_func):
+        """Đăng ký drain coroutine coro_func(timeout), chạy trong budget còn lại của drain_timeout"""
+        self._on_drain.append(coro_func)
+
+    def on_stop(self, coro_func):
+        """Đăng ký cleanup coroutine (ví dụ đóng HTTP session), luôn chạy khi stop"""
+        self._on_stop.append(coro_func)
+
+    def is_alive(self):
+        """Event loop thread còn chạy"""
+        return bool(self._thread and self._thread.is_alive() and self.loop and self.loop.is_running())
+
+    def stats(self):
+        """Engine statistics"""
+        return {
+            'name': self.name,
+            'concurrency': self.concurrency,
+            'in_flight': self._in_flight,
+            'queued': self._queue.qsize() if self._queue else 0,
+            'latency_ms': round(self.latency_ms, 3) if self.latency_ms is not None else None,
+        }
+
+    def stop(self, drain_timeout=30):
+        """Drain queue và drain hooks trong `drain_timeout`, cancel workers, chạy cleanup hooks, stop event loop"""
+        if not self.loop or not self.loop.is_running():
+            return
+
+        async def _drain():
+            deadline = time.monotonic() + drain_timeout
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout=drain_timeout)
+            except asyncio.TimeoutError:
+                print(f"Execution engine {self.name} drain timed out, {self._queue.qsize()} commands dropped")
+            for drain in self._on_drain:
+                remaining = max(0, deadline - time.monotonic())
+                try:
+                    await asyncio.wait_for(drain(remaining), timeout=remaining)
+                except asyncio.TimeoutError:
+                    print(f"Execution engine {self.name} drain hook timed out")
+
+        async def _shutdown():
+            try:
+                await _drain()
+            except Exception as e:
+                print(f"Execution engine {self.name} drain error: {e}")
+            finally:
+                for worker in self._workers:
+                    worker.cancel()
+                await asyncio.gather(*self._workers, return_exceptions=True)
+                for cleanup in self._on_stop:
+                    try:
+                        await asyncio.wait_for(cleanup(), timeout=self.CLOSE_TIMEOUT)
+                    except Exception as e:
+                        print(f"Execution engine {self.name} cleanup error: {e!r}")
+
+        try:
+            asyncio.run_coroutine_threadsafe(_shutdown(), self.loop).result(
+                timeout=drain_timeout + self.CLOSE_TIMEOUT * len(self._on_stop) + 5
+            )
+        except Exception as e:
+            print(f"Execution engine {self.name} shutdown error: {e}")
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            if self._thread:
+                self._thread.join(timeout=5)
+            print(f"Execution engine {self.name} stopped")
@@ -0,0 +1,284 @@
+import gzip
+import hashlib
+import json
+import uuid
+import zlib
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from commands.models import CommandBatch, CommandRequest, CommandExecution
+from commands.partitioning import add_months, month_start
+from commands.storage import load_storage
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+REQUEST_COLUMNS = (
+    'id', 'device_id', 'command_type', 'command_params', 'user_id', 'batch_id', 'scheduled_at', 'deadline',
+    'priority', 'retry_count', 'max_retries', 'status', 'superseded_by_id', 'created_at', 'updated_at',
+)
+EXECUTION_COLUMNS = (
+    'id', 'command_request_id', 'agent_id', 'api_config_id', 'protocol', 'result', 'error_message',
+    'response_data', 'execution_time', 'response_size', 'started_at', 'completed_at',
+)
+
+# dataset -> cột thời gian dùng để lọc
+DATASETS = {
+    'requests': 'created_at',
+    'executions': 'completed_at',
+}
+
+def get_archive_storage():
+    """Storage backend theo settings.COMMAND_ARCHIVE_STORAGE (dotted path)"""
+    return load_storage(settings.COMMAND_ARCHIVE_STORAGE, settings.COMMAND_ARCHIVE_ROOT)
+
+def compress(data):
+    """zstd nếu có, fallback gzip; trả về (bytes, extension)"""
+    if ZSTD_AVAILABLE:
+        return zstandard.ZstdCompressor(level=10).compress(data), '.zst'
+    return gzip.compress(data), '.gz'
+
+def decompress(name, data):
+    if name.endswith('.zst'):
+        if not ZSTD_AVAILABLE:
+            raise RuntimeError(f"zstandard is required to read {name}")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if name.endswith('.gz'):
+        return gzip.decompress(data)
+    return data
+
+def encode_segment(columns, rows):
+    """Columnar segment: mỗi cột là một array (nén tốt hơn row-oriented JSON)"""
+    segment = {
+        'columns': list(columns),
+        'rows': len(rows),
+        'data': {column: [row.get(column) for row in rows] for column in columns},
+    }
+    return json.dumps(segment, cls=DjangoJSONEncoder, separators=(',', ':')).encode()
+
+def decode_segment(payload):
+    """Yield rows (dict) từ columnar segment"""
+    segment = json.loads(payload)
+    columns = segment['columns']
+    for values in zip(*(segment['data'][column] for column in columns)):
+        yield dict(zip(columns, values))
+
+def month_bounds(month):
+    """[đầu tháng, đầu tháng sau) dạng aware UTC datetimes"""
+    next_month = add_months(month, 1)
+    return (
+        datetime(month.year, month.month, 1, tzinfo=dt_timezone.utc),
+        datetime(next_month.year, next_month.month, 1, tzinfo=dt_timezone.utc),
+    )
+
+def shard_for(device_id, shards):
+    """Shard ổn định giữa các processes (không dùng hash() vì bị randomize)"""
+    return zlib.crc32(str(device_id).encode()) % shards
+
+class CommandArchiver:
+    """
+    Chuyển command history cũ sang cold storage.
+
+    Mỗi tháng là một thư mục; rows được chia theo shard của device_id thành
+    các segments (requests + executions của cùng các commands), mô tả trong
+    manifest.json của tháng (devices, time range, số rows, sha256). Rows chỉ
+    bị xoá khỏi Postgres sau khi segment và manifest đã được ghi.
+
+    Giả định chỉ có một archiver chạy tại một thời điểm.
+    """
+
+    def __init__(self, storage=None, shards=None, segment_rows=None, chunk_size=1000):
+        self.storage = storage or get_archive_storage()
+        self.shards = shards or settings.COMMAND_ARCHIVE_SHARDS
+        self.segment_rows = segment_rows or settings.COMMAND_ARCHIVE_SEGMENT_ROWS
+        self.chunk_size = chunk_size
+
+    def archivable(self, start, end):
+        """Commands đã kết thúc trong [start, end)"""
+        return CommandRequest.objects.filter(
+            created_at__gte=start, created_at__lt=end, status__in=CommandBatch.FINISHED_STATUSES
+        )
+
+    def archive_before(self, cutoff, dry_run=False):
+        """Archive theo từng tháng mọi commands đã kết thúc trước cutoff"""
+        stats = {'requests': 0, 'executions': 0, 'segments': 0}
+        oldest = CommandRequest.objects.filter(
+            created_at__lt=cutoff, status__in=CommandBatch.FINISHED_STATUSES
+        ).order_by('created_at').values_list('created_at', flat=True).first()
+        if oldest is None:
+            return stats
+
+        month = month_start(oldest.astimezone(dt_timezone.utc))
+        start, end = month_bounds(month)
+        while start < cutoff:
+            end = min(end, cutoff)
+            if dry_run:
+                stats['requests'] += self.archivable(start, end).count()
+            else:
+                for key, value in self.archive_range(month, start, end).items():
+                    stats[key] += value
+            month = add_months(month, 1)
+            start, end = month_bounds(month)
+        return stats
+
+    def archive_range(self, month, start, end):
+        """Stream commands của một tháng vào segments theo shard"""
+        stats = {'requests': 0, 'executions': 0, 'segments': 0}
+        buffers = {}
+
+        requests = self.archivable(start, end).order_by().values(*REQUEST_COLUMNS).iterator(chunk_size=self.chunk_size)
+        chunk = []
+        for row in requests:
+            chunk.append(row)
+            if len(chunk) >= self.chunk_size:
+                self._buffer_chunk(month, start, end, chunk, buffers, stats)
+                chunk = []
+        if chunk:
+            self._buffer_chunk(month, start, end, chunk, buffers, stats)
+
+        for shard, buffer in buffers.items():
+            if buffer['requests']:
+                self._flush_segment(month, start, end, shard, buffer, stats)
+        return stats
+
+    def _buffer_chunk(self, month, start, end, chunk, buffers, stats):
+        device_by_command = {row['id']: row['device_id'] for row in chunk}
+        executions = {}
+        # Execution luôn completed sau khi command được tạo: giới hạn dưới để prune partitions
+        for row in CommandExecution.objects.filter(
+            command_request_id__in=list(device_by_command), completed_at__gte=start
+        ).values(*EXECUTION_COLUMNS):
+            row['device_id'] = device_by_command[row['command_request_id']]
+            executions.setdefault(row['command_request_id'], []).append(row)
+
+        for row in chunk:
+            shard = shard_for(row['device_id'], self.shards)
+            buffer = buffers.setdefault(shard, {'requests': [], 'executions': []})
+            buffer['requests'].append(row)
+            buffer['executions'].extend(executions.get(row['id'], []))
+            if len(buffer['requests']) >= self.segment_rows:
+                self._flush_segment(month, start, end, shard, buffer, stats)
+
+    def _write_file(self, name, columns, rows, time_column):
+        data, extension = compress(encode_segment(columns, rows))
+        file_name = f"{name}{extension}"
+        self.storage.write(file_name, data)
+        times = [row[time_column] for row in rows]
+        return {
+            'file': file_name,
+            'rows': len(rows),
+            'bytes': len(data),
+            'sha256': hashlib.sha256(data).hexdigest(),
+            'min_time': min(times).isoformat() if times else None,
+            'max_time': max(times).isoformat() if times else None,
+        }
+
+    def _flush_segment(self, month, start, end, shard, buffer, stats):
+        """Ghi segment, cập nhật manifest, rồi xoá rows đã archive theo chunks"""
+        requests, executions = buffer['requests'], buffer['executions']
+        prefix = f"{month:%Y-%m}"
+        name = f"{prefix}/shard-{shard:02d}-{uuid.uuid4().hex[:12]}"
+
+        entry = {
+            'name': name,
+            'shard': shard,
+            'device_ids': sorted({row['device_id'] for row in requests}),
+            'archived_at': timezone.now().isoformat(),
+            'files': {
+                'requests': self._write_file(f"{name}.requests", REQUEST_COLUMNS, requests, 'created_at'),
+                'executions': self._write_file(
+                    f"{name}.executions", EXECUTION_COLUMNS + ('device_id',), executions, 'completed_at'
+                ),
+            },
+        }
+        manifest = self.read_manifest(prefix)
+        manifest['segments'].append(entry)
+        self.storage.write(f"{prefix}/manifest.json", json.dumps(manifest, indent=2).encode())
+
+        # Executions trước để cascade của CommandRequest không xoá rows chưa archive
+        self._delete(CommandExecution, [row['id'] for row in executions], completed_at__gte=start)
+        self._delete(CommandRequest, [row['id'] for row in requests], created_at__gte=start, created_at__lt=end)
+
+        stats['requests'] += len(requests)
+        stats['executions'] += len(executions)
+        stats['segments'] += 1
+        buffer['requests'], buffer['executions'] = [], []
+
+    def _delete(self, model, ids, **prune):
+        for i in range(0, len(ids), self.chunk_size):
+            with transaction.atomic():
+                model.objects.filter(id__in=ids[i:i + self.chunk_size], **prune).delete()
+
+    def read_manifest(self, prefix):
+        name = f"{prefix}/manifest.json"
+        if not self.storage.exists(name):
+            return {'month': prefix, 'segments': []}
+        return json.loads(self.storage.read(name))
+
+    def query(self, device_id, start=None, end=None, dataset='requests', limit=None, user_id=None):
+        """
+        Đọc archived rows của một device trong [start, end) trực tiếp từ
+        archive files (không restore vào Postgres). Chỉ đọc các segments có
+        device và time range giao với query; segments được đọc từ mới tới
+        cũ và dừng khi các segments còn lại không thể có rows trong `limit`
+        rows mới nhất.
+
+        user_id: chỉ trả về rows của commands do user này tạo (None = mọi user).
+        """
+        time_column = DATASETS[dataset]
+        shard = shard_for(device_id, self.shards)
+        segments = []
+
+        for prefix in self.storage.listdir():
+            if not self.storage.exists(f"{prefix}/manifest.json"):
+                continue
+            for segment in self.read_manifest(prefix)['segments']:
+                info = segment['files'][dataset]
+                if segment['shard'] != shard or device_id not in segment['device_ids'] or not info['rows']:
+                    continue
+                if start and parse_datetime(info['max_time']) < start:
+                    continue
+                if end and parse_datetime(info['min_time']) >= end:
+                    continue
+                segments.append(segment)
+
+        segments.sort(key=lambda segment: parse_datetime(segment['files'][dataset]['max_time']), reverse=True)
+        rows = {}
+        for segment in segments:
+            info = segment['files'][dataset]
+            if limit and len(rows) >= limit:
+                oldest = sorted(rows.values(), key=lambda row: row[time_column], reverse=True)[limit - 1]
+                if parse_datetime(info['max_time']) < parse_datetime(oldest[time_column]):
+                    break
+
+            owners = None
+            if user_id is not None and dataset == 'executions':
+                owners = self._segment_owners(segment)
+            payload = decompress(info['file'], self.storage.read(info['file']))
+            for row in decode_segment(payload):
+                if row['device_id'] != device_id:
+                    continue
+                if user_id is not None:
+                    owner = row['user_id'] if owners is None else owners.get(row['command_request_id'])
+                    if str(owner) != str(user_id):
+                        continue
+                timestamp = parse_datetime(row[time_column])
+                if (start and timestamp < start) or (end and timestamp >= end):
+                    continue
+                # Một segment có thể bị archive lại nếu job dừng giữa chừng
+                rows[row['id']] = row
+
+        results = sorted(rows.values(), key=lambda row: row[time_column], reverse=True)
+        return results[:limit] if limit else results
+
+    def _segment_owners(self, segment):
+        """command_id -> user_id từ requests file của segment (executions không lưu user_id)"""
+        info = segment['files']['requests']
+        payload = decompress(info['file'], self.storage.read(info['file']))
+        return {row['id']: row['user_id'] for row in decode_segment(payload)}
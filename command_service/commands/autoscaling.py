@@ -0,0 +1,204 @@
+import abc
+import math
+import threading
+import time
+from shared.kafka import kafka_service, metrics_aggregator
+
+class LagSource(abc.ABC):
+    """Nguồn consumer lag cho autoscaler"""
+
+    @abc.abstractmethod
+    def lag(self):
+        """Trả về {'lag': int, 'partitions': int | None} hoặc None nếu không đo được"""
+
+class KafkaLagSource(LagSource):
+    """Lag của consumer group đọc từ broker (committed offsets vs high watermarks)"""
+
+    def __init__(self, group_id, topics):
+        self.group_id = group_id
+        self.topics = topics
+
+    def lag(self):
+        return kafka_service.get_consumer_lag(self.group_id, self.topics)
+
+class LaneLagSource(LagSource):
+    """
+    Lag của consumer group trên từng priority lane (một topic mỗi lane).
+    Mỗi lần đo report queue depth theo lane (gauge `device_command_lane_depth`)
+    và trả về tổng lag; partitions là số partitions lớn nhất của một lane vì
+    mỗi worker được assign partitions trên mọi lanes.
+    """
+
+    def __init__(self, group_id, lanes):
+        self.group_id = group_id
+        self.lanes = lanes
+
+    def lag(self):
+        total, partitions, measured = 0, 0, False
+        for lane, topic in self.lanes.items():
+            lane_lag = kafka_service.get_consumer_lag(self.group_id, [topic])
+            if lane_lag is None:
+                continue
+            measured = True
+            total += lane_lag['lag']
+            partitions = max(partitions, lane_lag['partitions'])
+            metrics_aggregator.set_gauge('device_command_lane_depth', lane_lag['lag'], lane=lane)
+        if not measured:
+            return None
+        return {'lag': total, 'partitions': partitions or None}
+
+class LaneDepthReporter:
+    """
+    Report queue depth của các lanes định kỳ khi không bật autoscaling
+    (supervisor gọi check() giống Autoscaler; không scale)
+    """
+
+    def __init__(self, lag_source, interval=30):
+        self.lag_source = lag_source
+        self.interval = interval
+        self._next_check = 0
+
+    def check(self, supervisor, now=None):
+        now = time.monotonic() if now is None else now
+        if now < self._next_check:
+            return None
+        self._next_check = now + self.interval
+        self.lag_source.lag()
+        return None
+
+class LocalLagSource(LagSource):
+    """
+    Broker stand-in chạy trong process: đếm messages produced/consumed.
+    Dùng để chạy và test scaling policy offline, không cần Kafka.
+    """
+
+    def __init__(self, partitions=None):
+        self.partitions = partitions
+        self.produced = 0
+        self.consumed = 0
+        self._lock = threading.Lock()
+
+    def produce(self, count=1):
+        with self._lock:
+            self.produced += count
+
+    def consume(self, count=1):
+        with self._lock:
+            self.consumed = min(self.consumed + count, self.produced)
+
+    def lag(self):
+        with self._lock:
+            return {'lag': self.produced - self.consumed, 'partitions': self.partitions}
+
+class ScalingPolicy:
+    """
+    Quyết định số workers từ consumer lag và handler latency.
+
+    - Scale up khi lag vượt `target_lag` mỗi worker (hoặc latency vượt
+      `max_latency_ms` khi còn lag) liên tục `scale_up_after` giây; nhảy
+      thẳng tới số workers cần để lag/worker về target.
+    - Scale down từng worker một, chỉ khi lag/worker dưới
+      `target_lag * scale_down_ratio` liên tục `scale_down_after` giây.
+    - Khoảng giữa hai ngưỡng là vùng hysteresis: giữ nguyên số workers.
+    - Sau mỗi lần thay đổi chờ `cooldown` giây.
+    - Không vượt quá số partitions (workers dư sẽ không được assign).
+    """
+
+    def __init__(self, min_workers, max_workers, target_lag=1000, max_latency_ms=None,
+                 scale_up_after=30, scale_down_after=300, scale_down_ratio=0.3, cooldown=60):
+        if min_workers < 1 or max_workers < min_workers:
+            raise ValueError("Require 1 <= min_workers <= max_workers")
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.target_lag = target_lag
+        self.max_latency_ms = max_latency_ms
+        self.scale_up_after = scale_up_after
+        self.scale_down_after = scale_down_after
+        self.scale_down_ratio = scale_down_ratio
+        self.cooldown = cooldown
+
+        self._pressure = None
+        self._pressure_since = None
+        self._last_change = None
+
+    def decide(self, current, lag, partitions=None, latency_ms=None, now=None):
+        """Trả về (desired_workers, reason); reason None khi giữ nguyên"""
+        now = time.monotonic() if now is None else now
+        upper = min(self.max_workers, partitions) if partitions else self.max_workers
+        upper = max(upper, self.min_workers)
+
+        # Ngoài bounds (ví dụ bounds vừa đổi): sửa ngay
+        if current < self.min_workers or current > upper:
+            return self._changed(min(max(current, self.min_workers), upper), 'bounds', now)
+
+        lag_per_worker = lag / current
+        if lag_per_worker > self.target_lag:
+            pressure, desired = 'up', math.ceil(lag / self.target_lag)
+        elif self.max_latency_ms and latency_ms and latency_ms > self.max_latency_ms and lag > 0:
+            pressure, desired = 'up', current + 1
+        elif lag_per_worker < self.target_lag * self.scale_down_ratio:
+            pressure, desired = 'down', current - 1
+        else:
+            pressure, desired = None, current
+
+        if pressure != self._pressure:
+            self._pressure, self._pressure_since = pressure, now
+        desired = min(max(desired, self.min_workers), upper)
+        if pressure is None or desired == current:
+            return current, None
+
+        sustained = self.scale_up_after if pressure == 'up' else self.scale_down_after
+        if now - self._pressure_since < sustained:
+            return current, None
+        if self._last_change is not None and now - self._last_change < self.cooldown:
+            return current, None
+
+        reason = 'lag' if pressure == 'down' or lag_per_worker > self.target_lag else 'latency'
+        return self._changed(desired, reason, now)
+
+    def _changed(self, desired, reason, now):
+        self._last_change = now
+        self._pressure, self._pressure_since = None, now
+        return desired, reason
+
+class Autoscaler:
+    """Chạy ScalingPolicy định kỳ cho một loại agent của supervisor"""
+
+    def __init__(self, agent_type, policy, lag_source, interval=10):
+        self.agent_type = agent_type
+        self.policy = policy
+        self.lag_source = lag_source
+        self.interval = interval
+        self._next_check = 0
+
+    def check(self, supervisor, now=None):
+        """Gọi từ supervise loop; scale supervisor khi policy quyết định thay đổi"""
+        now = time.monotonic() if now is None else now
+        if now < self._next_check:
+            return None
+        self._next_check = now + self.interval
+
+        measured = self.lag_source.lag()
+        current = supervisor.worker_count(self.agent_type)
+        if measured is None or current == 0:
+            return None
+        latency_ms = supervisor.handler_latency_ms(self.agent_type)
+
+        desired, reason = self.policy.decide(
+            current, measured['lag'], partitions=measured.get('partitions'), latency_ms=latency_ms, now=now
+        )
+
+        metrics_aggregator.set_gauge('agent_consumer_lag', measured['lag'], agent_type=self.agent_type)
+        if latency_ms is not None:
+            metrics_aggregator.set_gauge('agent_handler_latency_ms', latency_ms, agent_type=self.agent_type)
+        metrics_aggregator.set_gauge('agent_desired_workers', desired, agent_type=self.agent_type)
+
+        if reason is None:
+            return None
+        direction = 'up' if desired > current else 'down'
+        metrics_aggregator.increment('agent_scaling_decisions', agent_type=self.agent_type,
+                                     direction=direction, reason=reason)
+        print(f"Autoscaler {self.agent_type}: {current} -> {desired} workers "
+              f"(lag={measured['lag']}, latency_ms={latency_ms}, reason={reason})")
+        supervisor.scale(self.agent_type, desired)
+        return desired
@@ -0,0 +1,35 @@
+import re
+from django.conf import settings
+from commands.storage import load_storage
+
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+class BlobStore:
+    """
+    Content-addressed store cho vendor response bodies lớn. Key là sha256
+    của content nên cùng một body chỉ được lưu một lần.
+    """
+
+    def __init__(self, storage=None):
+        self.storage = storage or load_storage(settings.RESPONSE_BLOB_STORAGE, settings.RESPONSE_BLOB_ROOT)
+
+    @staticmethod
+    def path(digest):
+        return f"{digest[:2]}/{digest[2:4]}/{digest}"
+
+    @staticmethod
+    def ref(digest):
+        return f"sha256:{digest}"
+
+    def put_file(self, digest, fileobj):
+        """Lưu content (đã hash bởi caller) nếu chưa có; trả về blob ref"""
+        if not self.storage.exists(self.path(digest)):
+            self.storage.write_file(self.path(digest), fileobj)
+        return self.ref(digest)
+
+    def get(self, ref):
+        """Đọc content theo blob ref ('sha256:<hex>'); ValueError nếu ref không hợp lệ"""
+        scheme, _, digest = str(ref or '').partition(':')
+        if scheme != 'sha256' or not DIGEST_PATTERN.match(digest):
+            raise ValueError(f"Invalid blob ref: {ref!r}")
+        return self.storage.read(self.path(digest))
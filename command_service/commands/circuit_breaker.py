@@ -0,0 +1,172 @@
+import threading
+import time
+from urllib.parse import urlsplit
+from django.conf import settings
+from shared.kafka import metrics_aggregator
+
+CIRCUIT_OPEN = 'circuit_open'
+
+class CircuitBreaker:
+    """
+    Circuit breaker của một vendor endpoint với rolling error-rate window.
+
+    - closed: requests đi qua; khi window có ít nhất `min_requests` và tỉ lệ
+      lỗi >= `error_rate` thì chuyển open
+    - open: fast-fail tới khi hết `open_duration` giây, sau đó half-open
+    - half_open: cho tối đa `half_open_calls` requests thử đồng thời; đủ
+      `half_open_calls` lần thành công thì closed, một lần lỗi thì open lại
+
+    Không thread-safe: registry giữ lock.
+    """
+
+    STATES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+    def __init__(self, scope, key, window=60, buckets=10, min_requests=20, error_rate=0.5,
+                 open_duration=30, half_open_calls=3):
+        self.scope = scope
+        self.key = key
+        self.bucket_width = window / buckets
+        self.buckets = buckets
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.open_duration = open_duration
+        self.half_open_calls = half_open_calls
+
+        self.state = 'closed'
+        self.opened_at = None
+        self._window = {}
+        self._trials = 0
+        self._trial_successes = 0
+
+    def _counts(self, now):
+        """(requests, errors) trong window, bỏ các buckets đã trôi ra ngoài"""
+        current = int(now // self.bucket_width)
+        for index in [index for index in self._window if index <= current - self.buckets]:
+            del self._window[index]
+        requests = sum(counts[0] for counts in self._window.values())
+        errors = sum(counts[1] for counts in self._window.values())
+        return requests, errors
+
+    def retry_after(self, now):
+        """Số giây còn fast-fail, None nếu request được đi qua"""
+        if self.state == 'open':
+            remaining = self.opened_at + self.open_duration - now
+            if remaining > 0:
+                return remaining
+            self._set_state('half_open')
+        if self.state == 'half_open' and self._trials >= self.half_open_calls:
+            return self.bucket_width
+        return None
+
+    def on_call(self):
+        if self.state == 'half_open':
+            self._trials += 1
+
+    def release(self):
+        """Request được cho qua nhưng không gửi (ví dụ bị rate limit)"""
+        if self.state == 'half_open' and self._trials:
+            self._trials -= 1
+
+    def record(self, success, now):
+        if self.state == 'half_open':
+            self._trials = max(self._trials - 1, 0)
+            if not success:
+                self._open(now)
+                return
+            self._trial_successes += 1
+            if self._trial_successes >= self.half_open_calls:
+                self._window.clear()
+                self._set_state('closed')
+            return
+        if self.state == 'open':
+            # Request gửi trước khi circuit open
+            return
+
+        counts = self._window.setdefault(int(now // self.bucket_width), [0, 0])
+        counts[0] += 1
+        counts[1] += 0 if success else 1
+        if not success:
+            requests, errors = self._counts(now)
+            if requests >= self.min_requests and errors / requests >= self.error_rate:
+                self._open(now)
+
+    def _open(self, now):
+        self.opened_at = now
+        self._set_state('open')
+        metrics_aggregator.increment('circuit_breaker_opened', scope=self.scope, key=self.key)
+
+    def _set_state(self, state):
+        if state != self.state:
+            print(f"Circuit breaker {self.scope} {self.key}: {self.state} -> {state}")
+        self.state = state
+        self._trials = 0
+        self._trial_successes = 0
+        metrics_aggregator.set_gauge('circuit_breaker_state', self.STATES[state], scope=self.scope, key=self.key)
+
+    def snapshot(self, now):
+        requests, errors = self._counts(now)
+        return {'state': self.state, 'requests': requests, 'errors': errors}
+
+class CircuitBreakerRegistry:
+    """
+    Circuit breakers theo host và theo api_config. Một request chỉ được gửi
+    khi cả hai circuits cho qua; kết quả được ghi vào cả hai, nên host chết
+    chặn mọi api_configs trỏ tới nó và api_config lỗi không ảnh hưởng api
+    configs khác cùng host.
+    """
+
+    def __init__(self, **options):
+        self.options = options
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def _breaker(self, scope, key):
+        breaker = self._breakers.get((scope, key))
+        if breaker is None:
+            breaker = self._breakers[(scope, key)] = CircuitBreaker(scope, key, **self.options)
+            metrics_aggregator.set_gauge('circuit_breaker_state', 0, scope=scope, key=key)
+        return breaker
+
+    def breakers_for(self, api_config, url):
+        with self._lock:
+            return [
+                self._breaker('host', urlsplit(url).netloc.lower()),
+                self._breaker('api_config', str((api_config or {}).get('id', ''))),
+            ]
+
+    def acquire(self, breakers):
+        """(scope, key, retry_after) của circuit đang chặn request, None nếu được gửi"""
+        now = time.monotonic()
+        with self._lock:
+            for breaker in breakers:
+                retry_after = breaker.retry_after(now)
+                if retry_after is not None:
+                    metrics_aggregator.increment('circuit_breaker_rejected', scope=breaker.scope, key=breaker.key)
+                    return breaker.scope, breaker.key, retry_after
+            for breaker in breakers:
+                breaker.on_call()
+        return None
+
+    def release(self, breakers):
+        with self._lock:
+            for breaker in breakers:
+                breaker.release()
+
+    def record(self, breakers, success):
+        now = time.monotonic()
+        with self._lock:
+            for breaker in breakers:
+                breaker.record(success, now)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {f"{scope}:{key}": breaker.snapshot(now) for (scope, key), breaker in self._breakers.items()}
+
+circuit_breakers = CircuitBreakerRegistry(
+    window=settings.CIRCUIT_BREAKER_WINDOW,
+    min_requests=settings.CIRCUIT_BREAKER_MIN_REQUESTS,
+    error_rate=settings.CIRCUIT_BREAKER_ERROR_RATE,
+    open_duration=settings.CIRCUIT_BREAKER_OPEN_SECONDS,
+    half_open_calls=settings.CIRCUIT_BREAKER_HALF_OPEN_CALLS
+)
@@ -0,0 +1,123 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, close_old_connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from shared.kafka import kafka_service
+from shared.kafka.topics import Topics, EventTypes
+from commands.status_cache import execution_summary, status_cache
+from commands.write_behind import WriteBehindBuffer
+
+class CommandResultConsumer:
+    """
+    Stage ghi duy nhất cho command outcomes.
+
+    Agents chỉ publish outcomes lên COMMAND_RESULTS (key theo command_id nên
+    các events của một command giữ thứ tự). Consumer này đọc theo batch,
+    merge status transitions, ghi bằng bulk_update/bulk_create rồi mới commit
+    offsets. Execution ids do agent sinh ra nên xử lý lại một batch sau lỗi
+    không tạo executions trùng.
+
+    Retry đang chờ trong agent được lưu là 'scheduled' với scheduled_at =
+    next_attempt_at + COMMAND_RETRY_RECOVERY_GRACE (agent renew khi retry
+    phải chờ lâu hơn). Attempt của retry chạy dưới lease: outcome 'started'
+    kèm lease_until được lưu vào claimed_until. Agent dừng trước khi có
+    outcome thì command scheduler dispatch lại command khi hết lease.
+    """
+
+    GROUP_ID = 'command-service-results'
+
+    # event_type -> status của CommandRequest
+    STATUS_BY_EVENT = {
+        EventTypes.DEVICE_COMMAND_STARTED: 'executing',
+        EventTypes.DEVICE_COMMAND_RETRY_SCHEDULED: 'scheduled',
+        EventTypes.DEVICE_COMMAND_COMPLETED: 'completed',
+        EventTypes.DEVICE_COMMAND_FAILED: 'failed',
+        EventTypes.DEVICE_COMMAND_SUPERSEDED: 'superseded',
+        EventTypes.DEVICE_COMMAND_TIMEOUT: 'timeout',
+    }
+
+    EXECUTION_FIELDS = (
+        'id', 'agent_id', 'api_config_id', 'protocol', 'result', 'error_message',
+        'response_data', 'execution_time', 'response_size', 'started_at', 'completed_at',
+    )
+
+    def __init__(self, batch_size=None, batch_timeout=None):
+        self.batch_size = batch_size or settings.WRITE_BEHIND_MAX_ROWS
+        self.batch_timeout = batch_timeout or settings.WRITE_BEHIND_FLUSH_MS / 1000
+        self.setup_consumer()
+
+    def setup_consumer(self):
+        """Setup batch consumer cho command results"""
+        try:
+            kafka_service.create_batch_consumer(
+                topics=[Topics.COMMAND_RESULTS],
+                group_id=self.GROUP_ID,
+                batch_handler=self.handle_batch,
+                batch_size=self.batch_size,
+                batch_timeout=self.batch_timeout,
+                # Outcome hỏng (ví dụ command_id không hợp lệ) không được chặn partition
+                dead_letter_topic=Topics.COMMAND_RESULTS_DLQ,
+                transient_errors=(OperationalError, InterfaceError)
+            )
+            print("CommandResultConsumer initialized successfully")
+        except Exception as e:
+            print(f"Failed to setup CommandResultConsumer: {e}")
+
+    def stop(self):
+        kafka_service.stop_consumer(self.GROUP_ID)
+
+    def handle_batch(self, messages):
+        """Persist một batch outcomes (raise để batch được xử lý lại)"""
+        close_old_connections()
+        buffer = WriteBehindBuffer(max_rows=self.batch_size)
+        cache_updates = {}
+
+        for message in messages:
+            self.apply(buffer, message.get('event_type'), message.get('data', {}), cache_updates)
+
+        written = buffer.flush()
+        if written:
+            print(f"CommandResultConsumer persisted {written} rows from {len(messages)} outcomes")
+
+        # Chỉ cập nhật status cache sau khi DB đã ghi xong
+        now = timezone.now()
+        for fields in cache_updates.values():
+            fields['updated_at'] = now
+        status_cache.update_existing(cache_updates)
+
+    def apply(self, buffer, event_type, data, cache_updates=None):
+        """Chuyển một outcome event thành status update và execution record"""
+        command_id = data.get('command_id')
+        status = self.STATUS_BY_EVENT.get(event_type)
+        if not command_id or not status:
+            return
+
+        fields = {'status': status}
+        if data.get('retry_count') is not None:
+            fields['retry_count'] = data['retry_count']
+        if data.get('superseded_by'):
+            fields['superseded_by_id'] = data['superseded_by']
+        if event_type == EventTypes.DEVICE_COMMAND_RETRY_SCHEDULED and data.get('next_attempt_at'):
+            fields['scheduled_at'] = (
+                parse_datetime(data['next_attempt_at']) + timedelta(seconds=settings.COMMAND_RETRY_RECOVERY_GRACE)
+            )
+            fields['claimed_until'] = None
+        if event_type == EventTypes.DEVICE_COMMAND_STARTED and data.get('lease_until'):
+            fields['claimed_until'] = parse_datetime(data['lease_until'])
+        buffer.update_status(command_id, **fields)
+
+        execution = data.get('execution')
+        if execution:
+            buffer.add_execution(
+                command_request_id=command_id,
+                **{k: v for k, v in execution.items() if k in self.EXECUTION_FIELDS}
+            )
+
+        if cache_updates is not None:
+            cached = cache_updates.setdefault(command_id, {})
+            cached['status'] = status
+            if data.get('superseded_by'):
+                cached['superseded_by'] = data['superseded_by']
+            if execution:
+                cached['execution'] = execution_summary(execution)
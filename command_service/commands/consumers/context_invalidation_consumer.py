@@ -0,0 +1,69 @@
+import os
+import socket
+import threading
+from shared.kafka import kafka_service
+from shared.kafka.topics import Topics, EventTypes
+from commands.context_cache import context_cache
+
+class ContextInvalidationConsumer:
+    """
+    Invalidate command context cache khi vendor_service thay đổi device,
+    device command, command template hoặc API configuration.
+
+    Mỗi agent process có cache riêng nên dùng consumer group riêng để nhận
+    tất cả events, bắt đầu từ offset mới nhất.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache or context_cache
+        self.group_id = f'command-context-cache-{socket.gethostname()}-{os.getpid()}'
+
+    def start(self):
+        return kafka_service.create_consumer(
+            topics=[Topics.VENDOR_EVENTS, Topics.DEVICE_STATUS],
+            group_id=self.group_id,
+            message_handler=self.handle_event,
+            offset_reset='latest'
+        )
+
+    def stop(self):
+        kafka_service.stop_consumer(self.group_id)
+
+    def handle_event(self, message):
+        try:
+            event_type = message.get('event_type')
+            data = message.get('data', {})
+
+            if event_type in (EventTypes.COMMAND_TEMPLATE_DELETED, EventTypes.COMMAND_TEMPLATE_UPDATED):
+                self.cache.invalidate('template', data.get('template_id'))
+                for device_command in data.get('affected_device_commands', []):
+                    self.cache.invalidate('device_command', device_command.get('id'))
+
+            elif event_type in (EventTypes.API_CONFIG_DELETED, EventTypes.API_CONFIG_UPDATED):
+                self.cache.invalidate('api_config', data.get('api_config_id'))
+
+            elif event_type in (EventTypes.DEVICE_UPDATED, EventTypes.DEVICE_DELETED):
+                self.cache.invalidate('device', data.get('device_id'))
+
+            elif event_type == EventTypes.DEVICE_COMMAND_UPDATED:
+                self.cache.invalidate('device_command', data.get('device_command_id'))
+                self.cache.invalidate_key(data.get('device_id'), data.get('command_type'))
+
+            elif event_type == EventTypes.DEVICE_COMMANDS_DISCONNECTED:
+                self.cache.invalidate_key(data.get('device_id'), data.get('command_type'))
+
+        except Exception as e:
+            print(f"Error processing context invalidation event: {e}")
+
+_consumer = None
+_consumer_lock = threading.Lock()
+
+def start_context_invalidation():
+    """Start invalidation consumer một lần cho mỗi process"""
+    global _consumer
+    with _consumer_lock:
+        if _consumer is None:
+            consumer = ContextInvalidationConsumer()
+            if consumer.start():
+                _consumer = consumer
+    return _consumer
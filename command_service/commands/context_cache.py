@@ -0,0 +1,162 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from shared.kafka import metrics_aggregator
+
+class CommandContextCache:
+    """
+    LRU + TTL cache cho (device_id, command_type) -> command context.
+
+    Entries được index theo device, device command, command template và
+    api config để vendor events có thể invalidate đúng các contexts bị
+    ảnh hưởng. TTL là giới hạn trên cho staleness khi bỏ lỡ event.
+    """
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._entries = OrderedDict()
+        self._index = {}
+        self._lock = threading.Lock()
+        # Tăng mỗi lần invalidate, để bỏ qua kết quả load bắt đầu trước đó
+        self._generation = 0
+        self._stats = {'hits': 0, 'misses': 0, 'stale': 0, 'evictions': 0, 'invalidations': 0}
+
+    @staticmethod
+    def _index_keys(context):
+        """Các index keys mà một context phụ thuộc vào"""
+        keys = []
+        for kind, section in (
+            ('device', 'device'),
+            ('device_command', 'device_command'),
+            ('template', 'command_template'),
+            ('api_config', 'api_config'),
+        ):
+            value = (context.get(section) or {}).get('id')
+            if value:
+                keys.append((kind, str(value)))
+        return keys
+
+    def get(self, device_id, command_type):
+        """Lấy context còn hạn, None nếu miss hoặc hết hạn"""
+        key = (str(device_id), command_type)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                result = 'miss'
+            elif entry['expires_at'] <= now:
+                self._remove(key)
+                self._stats['stale'] += 1
+                self._stats['misses'] += 1
+                result = 'stale'
+            else:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                result = 'hit'
+
+        metrics_aggregator.increment('command_context_cache_lookups', result=result)
+        return entry['context'] if result == 'hit' else None
+
+    def set(self, device_id, command_type, context, generation=None):
+        """Cache context (bỏ qua nếu đã có invalidation kể từ `generation`)"""
+        key = (str(device_id), command_type)
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return False
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {
+                'context': context,
+                'expires_at': time.monotonic() + self.ttl,
+                'cached_at': time.time(),
+            }
+            for index_key in self._index_keys(context):
+                self._index.setdefault(index_key, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+            size = len(self._entries)
+
+        metrics_aggregator.set_gauge('command_context_cache_size', size)
+        return True
+
+    def get_or_load(self, device_id, command_type, loader):
+        """Lấy context từ cache, load qua `loader` khi miss"""
+        context = self.get(device_id, command_type)
+        if context is not None:
+            return context
+        return self.load(device_id, command_type, loader)
+
+    def load(self, device_id, command_type, loader):
+        """Load context qua `loader` và cache kết quả"""
+        generation = self._generation
+        context = loader(device_id, command_type)
+        self.set(device_id, command_type, context, generation=generation)
+        return context
+
+    def _remove(self, key):
+        """Remove entry và index của nó (caller giữ lock)"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for index_key in self._index_keys(entry['context']):
+            keys = self._index.get(index_key)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._index[index_key]
+
+    def invalidate(self, kind, value):
+        """Invalidate mọi contexts phụ thuộc vào (kind, value)"""
+        with self._lock:
+            self._generation += 1
+            keys = list(self._index.get((kind, str(value)), ()))
+            for key in keys:
+                self._remove(key)
+            self._stats['invalidations'] += len(keys)
+
+        if keys:
+            metrics_aggregator.increment('command_context_cache_invalidations', len(keys), kind=kind)
+        return len(keys)
+
+    def invalidate_key(self, device_id, command_type):
+        """Invalidate context của một (device_id, command_type)"""
+        with self._lock:
+            self._generation += 1
+            key = (str(device_id), command_type)
+            found = key in self._entries
+            self._remove(key)
+            if found:
+                self._stats['invalidations'] += 1
+        return int(found)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._index.clear()
+
+    def stats(self):
+        """Cache statistics"""
+        now = time.time()
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            oldest = min((e['cached_at'] for e in self._entries.values()), default=None)
+            return {
+                **self._stats,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hit_ratio': round(self._stats['hits'] / lookups, 4) if lookups else None,
+                'oldest_entry_age': round(now - oldest, 3) if oldest else None,
+            }
+
+# Global instance (một cache cho mỗi agent process)
+context_cache = CommandContextCache(
+    max_size=settings.COMMAND_CONTEXT_CACHE_SIZE,
+    ttl=settings.COMMAND_CONTEXT_CACHE_TTL
+)
@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+from django.utils import timezone
+from shared.kafka import metrics_aggregator
+from shared.kafka.topics import EventTypes
+from shared.kafka.publisher import EventPublisher
+
+def command_deadline(start, timeout):
+    """Deadline = start (created/scheduled) + timeout giây; None nếu không giới hạn"""
+    if not timeout:
+        return None
+    return start + timedelta(seconds=timeout)
+
+def deadline_of(command_data):
+    """Deadline trong event data (ISO string hoặc datetime), None nếu không có"""
+    value = command_data.get('deadline')
+    if not value:
+        return None
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value
+
+def remaining_seconds(command_data, now=None):
+    """Budget còn lại (giây, có thể âm), None nếu command không có deadline"""
+    deadline = deadline_of(command_data)
+    if deadline is None:
+        return None
+    return (deadline - (now or timezone.now())).total_seconds()
+
+def is_expired(command_data, now=None):
+    remaining = remaining_seconds(command_data, now)
+    return remaining is not None and remaining <= 0
+
+def publish_timeout(command_data, stage, agent_id=None):
+    """Publish outcome 'timeout' cho command hết deadline trước khi chạy"""
+    metrics_aggregator.increment('device_commands_expired', stage=stage, command_type=command_data.get('command_type'))
+    print(f"Command {command_data.get('command_id')} expired at {stage} (deadline {command_data.get('deadline')})")
+    EventPublisher.publish_command_result(
+        EventTypes.DEVICE_COMMAND_TIMEOUT,
+        {
+            'command_id': command_data.get('command_id'),
+            'device_id': command_data.get('device_id'),
+            'command_type': command_data.get('command_type'),
+            'deadline': command_data.get('deadline'),
+            'stage': stage,
+            'error': 'Command deadline exceeded before execution',
+            'agent_id': agent_id,
+            'status': 'timeout'
+        }
+    )
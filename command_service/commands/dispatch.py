@@ -0,0 +1,83 @@
+import zlib
+from django.conf import settings
+from shared.kafka.topics import Topics, EventTypes
+from shared.kafka.publisher import EventPublisher
+from commands.priority import resolve_priority
+
+# Topic của từng priority lane, theo thứ tự ưu tiên giảm dần. Lane normal
+# dùng DEVICE_COMMANDS (cùng topic với REQUESTED / PREWARM events). Các lane
+# topics phải có cùng số partitions: cùng device key vào cùng partition
+# number ở mọi lanes và agent dùng range assignor nên nhận cả nhóm đó
+LANE_TOPICS = {
+    'high': Topics.DEVICE_COMMANDS_HIGH,
+    'normal': Topics.DEVICE_COMMANDS,
+    'low': Topics.DEVICE_COMMANDS_LOW,
+}
+
+def lane_topic(priority):
+    return LANE_TOPICS.get(priority, LANE_TOPICS[settings.DEVICE_COMMAND_DEFAULT_LANE])
+
+def lane_weights():
+    """[(topic, weight)] cho weighted polling của device agents"""
+    weights = {
+        'high': settings.DEVICE_COMMAND_LANE_WEIGHT_HIGH,
+        'normal': settings.DEVICE_COMMAND_LANE_WEIGHT_NORMAL,
+        'low': settings.DEVICE_COMMAND_LANE_WEIGHT_LOW,
+    }
+    return [(topic, weights[lane]) for lane, topic in LANE_TOPICS.items()]
+
+def device_key(device_id):
+    """
+    Partition key của một device. Mọi message của device (request, dispatch,
+    batch chunk, retry, prewarm) dùng cùng key nên luôn vào cùng partition
+    number (ở mọi priority lanes) và cùng agent, giữ đúng thứ tự trong mỗi
+    lane; giữa các lanes, command lane cao có thể chạy trước command lane
+    thấp gửi trước nó. Key theo bucket (không theo device_id) để một batch
+    chunk có thể chứa nhiều devices mà vẫn đúng partition.
+    """
+    return f"device-bucket:{zlib.crc32(str(device_id or '').encode()) % settings.DEVICE_DISPATCH_BUCKETS}"
+
+def dispatch_command(command_data):
+    """
+    Publish command lên execution queue (lane theo priority) cho device
+    agents. Priority được resolve một lần và giữ trong command_data nên
+    retries / deferrals đi cùng lane.
+    """
+    command_data['priority'] = resolve_priority(command_data)
+    EventPublisher.publish_event(
+        lane_topic(command_data['priority']),
+        EventTypes.DEVICE_COMMAND_EXECUTING,
+        command_data,
+        key=device_key(command_data.get('device_id'))
+    )
+
+def dispatch_batch(batch_id, commands, chunk_size=100, priority=None):
+    """
+    Publish commands của một bulk batch theo chunks với một lần produce/flush.
+    Commands được gom theo device bucket trước khi chia chunk; mỗi chunk
+    được key theo bucket nên vào cùng partition với các commands đơn lẻ của
+    các devices đó (trong cùng lane).
+    
+    Cả batch đi một lane: `priority` hoặc BULK_COMMAND_DEFAULT_LANE (không
+    resolve theo vendor config từng device).
+    """
+    priority = priority or settings.BULK_COMMAND_DEFAULT_LANE
+    for command in commands:
+        command['priority'] = priority
+
+    buckets = {}
+    for command in commands:
+        buckets.setdefault(device_key(command.get('device_id')), []).append(command)
+    
+    events = []
+    for key, bucket in buckets.items():
+        for index in range(0, len(bucket), chunk_size):
+            events.append({
+                'event_type': EventTypes.DEVICE_COMMAND_BATCH_EXECUTING,
+                'data': {
+                    'batch_id': str(batch_id),
+                    'commands': bucket[index:index + chunk_size]
+                },
+                'key': key
+            })
+    return EventPublisher.publish_events(lane_topic(priority), events)
@@ -0,0 +1,122 @@
+import hashlib
+import json
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from commands.models import CommandIdempotencyKey
+
+def request_fingerprint(**fields):
+    """Hash của request body: cùng Idempotency-Key phải đi kèm cùng request"""
+    payload = json.dumps(fields, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+class IdempotencyConflict(Exception):
+    """Idempotency-Key đã được dùng cho một request khác"""
+
+class IdempotencyStore:
+    """
+    Dedup Idempotency-Key của command submissions, hai tầng:
+    - shared cache (Redis khi có REDIS_URL): `add` là atomic nên trong các
+      requests trùng key đồng thời chỉ một request claim được key, các
+      request còn lại nhận ngay command_id của request đó
+    - bảng CommandIdempotencyKey với unique (user_id, key): fallback khi
+      cache lỗi / bị evict, ghi cùng transaction với CommandRequest
+
+    Key hết hạn sau `ttl` giây ở cả hai tầng.
+    """
+
+    KEY_PREFIX = 'command-idempotency:'
+
+    def __init__(self, alias='default', ttl=86400):
+        self.alias = alias
+        self.ttl = ttl
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def key(self, user_id, key):
+        digest = hashlib.sha256(f"{user_id}:{key}".encode()).hexdigest()
+        return f"{self.KEY_PREFIX}{digest}"
+
+    def claim(self, user_id, key, fingerprint, command_id):
+        """
+        Claim key trong shared cache cho command_id. Trả về command_id gốc
+        nếu key đã được claim (duplicate), None nếu claim thành công hoặc
+        cache không dùng được (caller dựa vào DB constraint).
+        """
+        entry = {'command_id': str(command_id), 'fingerprint': fingerprint}
+        try:
+            if self.cache.add(self.key(user_id, key), entry, self.ttl):
+                return None
+            existing = self.cache.get(self.key(user_id, key))
+        except Exception as e:
+            print(f"Idempotency cache error: {e}")
+            return None
+
+        if existing is None:
+            # Key vừa hết hạn giữa add và get
+            return None
+        return self._original(existing['command_id'], existing['fingerprint'], fingerprint)
+
+    def release(self, user_id, key):
+        """Bỏ claim khi tạo command thất bại để client retry được với cùng key"""
+        try:
+            self.cache.delete(self.key(user_id, key))
+        except Exception as e:
+            print(f"Idempotency cache error: {e}")
+
+    def record(self, user_id, key, fingerprint, command_id):
+        """
+        Ghi key vào DB (gọi trong transaction tạo command). Trả về command_id
+        gốc nếu key đã tồn tại (và sửa cache entry cho khớp); row quá `ttl`
+        được thay bằng row mới.
+        Insert trùng đồng thời chờ transaction đang giữ key commit.
+        """
+        for _ in range(2):
+            try:
+                with transaction.atomic():
+                    CommandIdempotencyKey.objects.create(
+                        user_id=user_id, key=key, command_id=command_id, request_hash=fingerprint
+                    )
+                return None
+            except IntegrityError:
+                existing = CommandIdempotencyKey.objects.filter(user_id=user_id, key=key).first()
+                if existing is None:
+                    continue
+                if existing.created_at < timezone.now() - timedelta(seconds=self.ttl):
+                    existing.delete()
+                    continue
+                # Cache claim (nếu có) đang trỏ tới command_id không được tạo:
+                # ghi lại entry của command gốc
+                self._remember(user_id, key, existing.command_id, existing.request_hash, existing.created_at)
+                return self._original(existing.command_id, existing.request_hash, fingerprint)
+        raise IntegrityError(f"Could not record idempotency key {key}")
+
+    def _remember(self, user_id, key, command_id, fingerprint, created_at):
+        """Ghi entry của command gốc vào cache tới hết TTL của DB row"""
+        timeout = self.ttl - (timezone.now() - created_at).total_seconds()
+        if timeout <= 0:
+            return
+        try:
+            self.cache.set(
+                self.key(user_id, key), {'command_id': str(command_id), 'fingerprint': fingerprint}, timeout
+            )
+        except Exception as e:
+            print(f"Idempotency cache error: {e}")
+
+    def purge_expired(self, now=None):
+        """Xoá DB rows đã hết hạn; trả về số rows bị xoá"""
+        cutoff = (now or timezone.now()) - timedelta(seconds=self.ttl)
+        deleted, _ = CommandIdempotencyKey.objects.filter(created_at__lt=cutoff).delete()
+        return deleted
+
+    @staticmethod
+    def _original(command_id, original_fingerprint, fingerprint):
+        if original_fingerprint != fingerprint:
+            raise IdempotencyConflict('Idempotency-Key was already used with a different request')
+        return str(command_id)
+
+idempotency_store = IdempotencyStore(ttl=settings.COMMAND_IDEMPOTENCY_TTL)
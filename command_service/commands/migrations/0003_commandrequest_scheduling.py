@@ -0,0 +1,27 @@
+# Generated by Django 4.2.21 on 2026-10-19 01:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commands', '0002_alter_commandexecution_api_config_id_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commandrequest',
+            name='claimed_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='commandrequest',
+            name='status',
+            field=models.CharField(choices=[('scheduled', 'Scheduled'), ('queued', 'Queued'), ('executing', 'Executing'), ('completed', 'Completed'), ('failed', 'Failed'), ('timeout', 'Timeout'), ('cancelled', 'Cancelled')], default='queued', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='commandrequest',
+            index=models.Index(condition=models.Q(('status', 'scheduled')), fields=['scheduled_at'], name='command_due_idx'),
+        ),
+    ]
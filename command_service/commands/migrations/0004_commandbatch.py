@@ -0,0 +1,33 @@
+# Generated by Django 4.2.21 on 2026-10-19 01:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commands', '0003_commandrequest_scheduling'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommandBatch',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, primary_key=True, serialize=False)),
+                ('command_type', models.CharField(max_length=100)),
+                ('command_params', models.JSONField(default=dict)),
+                ('device_filter', models.JSONField(blank=True, default=dict)),
+                ('total', models.IntegerField(default=0)),
+                ('user_id', models.CharField(max_length=100)),
+                ('scheduled_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='commandrequest',
+            name='batch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='commands', to='commands.commandbatch'),
+        ),
+    ]
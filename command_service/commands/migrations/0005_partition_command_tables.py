@@ -0,0 +1,46 @@
+# Generated by Django 4.2.21 on 2026-10-19 01:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from commands.partitioning import PARTITIONED_TABLES, convert_to_partitioned, convert_to_regular
+
+
+def partition_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table, column in PARTITIONED_TABLES.items():
+            convert_to_partitioned(cursor, table, column)
+
+
+def unpartition_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table in PARTITIONED_TABLES:
+            convert_to_regular(cursor, table)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commands', '0004_commandbatch'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='commandexecution',
+            name='command_request',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='executions', to='commands.commandrequest'),
+        ),
+        migrations.RunPython(partition_tables, unpartition_tables),
+        migrations.AddIndex(
+            model_name='commandrequest',
+            index=models.Index(fields=['device_id', 'created_at'], name='command_device_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='commandrequest',
+            index=models.Index(fields=['status', 'created_at'], name='command_status_created_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.21 on 2026-10-19 01:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commands', '0005_partition_command_tables'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='commandrequest',
+            name='command_device_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='commandrequest',
+            index=models.Index(fields=['device_id', '-created_at', '-id'], include=('status',), name='command_device_timeline_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.21 on 2026-10-19 02:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commands', '0006_device_timeline_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commandrequest',
+            name='superseded_by',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='superseded_commands', to='commands.commandrequest'),
+        ),
+        migrations.AlterField(
+            model_name='commandrequest',
+            name='status',
+            field=models.CharField(choices=[('scheduled', 'Scheduled'), ('queued', 'Queued'), ('executing', 'Executing'), ('completed', 'Completed'), ('failed', 'Failed'), ('timeout', 'Timeout'), ('cancelled', 'Cancelled'), ('superseded', 'Superseded')], default='queued', max_length=20),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.21 on 2026-10-19 02:07
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commands', '0007_commandrequest_superseded'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommandIdempotencyKey',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, primary_key=True, serialize=False)),
+                ('user_id', models.CharField(max_length=100)),
+                ('key', models.CharField(max_length=255)),
+                ('command_id', models.UUIDField()),
+                ('request_hash', models.CharField(max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at'], name='command_idem_created_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='commandidempotencykey',
+            constraint=models.UniqueConstraint(fields=('user_id', 'key'), name='command_idempotency_key_unique'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.21 on 2026-10-19 02:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commands', '0008_commandidempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commandrequest',
+            name='deadline',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
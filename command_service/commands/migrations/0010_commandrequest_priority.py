@@ -0,0 +1,18 @@
+# Generated by Django 4.2.21 on 2026-10-19 02:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commands', '0009_commandrequest_deadline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commandrequest',
+            name='priority',
+            field=models.CharField(blank=True, choices=[('high', 'High'), ('normal', 'Normal'), ('low', 'Low')], default='', max_length=10),
+        ),
+    ]
@@ -1,5 +1,39 @@
 from django.db import models
 import uuid
+from shared.models.constants import COMMAND_PRIORITY_CHOICES
+
+class CommandBatch(models.Model):
+    """Một command chạy trên nhiều devices (bulk fan-out)"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4)
+    command_type = models.CharField(max_length=100)
+    command_params = models.JSONField(default=dict)
+    device_filter = models.JSONField(default=dict, blank=True)
+    total = models.IntegerField(default=0)
+    
+    user_id = models.CharField(max_length=100)
+    scheduled_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    FINISHED_STATUSES = ('completed', 'failed', 'timeout', 'cancelled', 'superseded')
+
+    def progress(self):
+        """Aggregate progress theo status của các commands trong batch"""
+        counts = dict(
+            self.commands.values_list('status').annotate(count=models.Count('id')).order_by()
+        )
+        finished = sum(counts.get(s, 0) for s in self.FINISHED_STATUSES)
+        return {
+            'batch_id': str(self.id),
+            'command_type': self.command_type,
+            'total': self.total,
+            'finished': finished,
+            'percent': round(finished * 100 / self.total, 2) if self.total else 100.0,
+            'by_status': counts,
+            'created_at': self.created_at,
+        }
+
+    def __str__(self):
+        return f"{self.command_type} on {self.total} devices"
 
 class CommandRequest(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4)
@@ -9,31 +43,72 @@ class CommandRequest(models.Model):
     
     # Request context
     user_id = models.CharField(max_length=100)
+    batch = models.ForeignKey(
+        CommandBatch, on_delete=models.SET_NULL, related_name='commands', null=True, blank=True
+    )
     
     # Scheduling
     scheduled_at = models.DateTimeField(null=True, blank=True)
     retry_count = models.IntegerField(default=0)
     max_retries = models.IntegerField(default=3)
+    # Sau thời điểm này command không còn được thực thi (status timeout)
+    deadline = models.DateTimeField(null=True, blank=True)
+    # Priority lane (rỗng = resolve theo DeviceCommand / CommandTemplate khi dispatch)
+    priority = models.CharField(max_length=10, choices=COMMAND_PRIORITY_CHOICES, blank=True, default='')
+    
+    # Scheduler lease: replica đã claim command tới thời điểm này
+    claimed_until = models.DateTimeField(null=True, blank=True)
     
     # Status tracking
     status = models.CharField(max_length=20, choices=[
+        ('scheduled', 'Scheduled'),
         ('queued', 'Queued'),
         ('executing', 'Executing'),
         ('completed', 'Completed'),
         ('failed', 'Failed'),
         ('timeout', 'Timeout'),
-        ('cancelled', 'Cancelled')
+        ('cancelled', 'Cancelled'),
+        ('superseded', 'Superseded')
     ], default='queued')
     
+    # Command mới hơn cùng loại đã thay thế command này (coalescing)
+    superseded_by = models.ForeignKey(
+        'self', on_delete=models.SET_NULL, related_name='superseded_commands',
+        null=True, blank=True, db_constraint=False
+    )
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Scheduler chỉ quét các commands đang chờ tới giờ chạy
+            models.Index(
+                fields=['scheduled_at'],
+                condition=models.Q(status='scheduled'),
+                name='command_due_idx'
+            ),
+            # Status lookups theo thời gian
+            # Device timeline (keyset theo created_at DESC, id DESC); status
+            # nằm trong index để lọc theo status không cần đọc heap
+            models.Index(
+                fields=['device_id', '-created_at', '-id'],
+                include=['status'],
+                name='command_device_timeline_idx'
+            ),
+            models.Index(fields=['status', 'created_at'], name='command_status_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.command_type} on {self.device_id}"
 
 class CommandExecution(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4)
-    command_request = models.ForeignKey(CommandRequest, on_delete=models.CASCADE, related_name='executions')
+    # Cả hai bảng được partition theo thời gian (PK gồm cả partition key) nên
+    # không có FK constraint ở DB; cascade do Django xử lý
+    command_request = models.ForeignKey(
+        CommandRequest, on_delete=models.CASCADE, related_name='executions', db_constraint=False
+    )
     
     # Execution details
     agent_id = models.CharField(max_length=100)
@@ -54,4 +129,28 @@ class CommandExecution(models.Model):
     completed_at = models.DateTimeField()
 
     def __str__(self):
-        return f"Execution of {self.command_request.command_type} ({self.id})"
\ No newline at end of file
+        return f"Execution of {self.command_request.command_type} ({self.id})"
+
+class CommandIdempotencyKey(models.Model):
+    """
+    Idempotency-Key của command submission (fallback bền vững cho shared
+    cache): unique theo user nên duplicate đồng thời chỉ tạo một command.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4)
+    user_id = models.CharField(max_length=100)
+    key = models.CharField(max_length=255)
+    # Không FK: command có thể đã được archive/drop partition trước khi key hết hạn
+    command_id = models.UUIDField()
+    request_hash = models.CharField(max_length=64)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_id', 'key'], name='command_idempotency_key_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at'], name='command_idem_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} -> {self.command_id}"
@@ -0,0 +1,45 @@
+import base64
+import json
+import uuid
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+def encode_cursor(created_at, command_id):
+    """Cursor (opaque) trỏ tới row cuối của page: (created_at, id)"""
+    payload = json.dumps([created_at.isoformat(), str(command_id)]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Ngược lại của encode_cursor; raise ValueError nếu cursor không hợp lệ"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, command_id = json.loads(base64.urlsafe_b64decode(padded))
+        created_at = parse_datetime(created_at)
+        command_id = uuid.UUID(command_id)
+    except (TypeError, ValueError, json.JSONDecodeError):
+        raise ValueError('Invalid cursor')
+    if created_at is None:
+        raise ValueError('Invalid cursor')
+    return created_at, command_id
+
+def keyset_page(queryset, cursor=None, limit=50):
+    """
+    Keyset pagination theo (created_at DESC, id DESC): page sau bắt đầu ngay
+    sau row cuối của page trước thay vì OFFSET, nên chi phí mỗi page không
+    phụ thuộc vào độ dài history.
+
+    Trả về (rows, next_cursor).
+    """
+    if cursor:
+        created_at, command_id = decode_cursor(cursor)
+        # created_at__lte là range bound cho index scan và partition pruning
+        queryset = queryset.filter(created_at__lte=created_at).filter(
+            Q(created_at__lt=created_at) | Q(id__lt=command_id)
+        )
+
+    rows = list(queryset.order_by('-created_at', '-id')[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return rows, next_cursor
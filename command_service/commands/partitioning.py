@@ -0,0 +1,183 @@
+import re
+from datetime import date, datetime, timezone as dt_timezone
+
+# Bảng được partition theo tháng: table -> partition key
+PARTITIONED_TABLES = {
+    'commands_commandrequest': 'created_at',
+    'commands_commandexecution': 'completed_at',
+}
+
+PARTITION_SUFFIX = re.compile(r'_p(\d{4})_(\d{2})$')
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+def add_months(value, months):
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def _bound(value):
+    """Partition bound dạng timestamptz UTC (không phụ thuộc session timezone)"""
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc).isoformat()
+
+def partition_name(table, start):
+    return f"{table}_p{start:%Y_%m}"
+
+def default_partition_name(table):
+    return f"{table}_default"
+
+def is_partitioned(cursor, table):
+    cursor.execute(
+        "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+        "WHERE c.relname = %s",
+        [table]
+    )
+    return cursor.fetchone() is not None
+
+def list_partitions(cursor, table):
+    """Monthly partitions của table: list (name, start) sort theo start"""
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = %s",
+        [table]
+    )
+    partitions = []
+    for (name,) in cursor.fetchall():
+        match = PARTITION_SUFFIX.search(name)
+        if match:
+            partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda p: p[1])
+
+def create_partition(cursor, table, column, start):
+    """
+    Tạo partition [start, start + 1 tháng). Trả về False nếu đã tồn tại.
+
+    Rows đã rơi vào default partition trong khoảng này được chuyển sang
+    partition mới (Postgres không cho tạo partition trùng rows của default).
+    """
+    start = month_start(start)
+    name = partition_name(table, start)
+    if any(existing == name for existing, _ in list_partitions(cursor, table)):
+        return False
+
+    lower, upper = _bound(start), _bound(add_months(start, 1))
+    default = default_partition_name(table)
+    cursor.execute(f'SELECT 1 FROM "{default}" WHERE "{column}" >= %s AND "{column}" < %s LIMIT 1', [lower, upper])
+    if cursor.fetchone() is None:
+        cursor.execute(
+            f'CREATE TABLE "{name}" PARTITION OF "{table}" FOR VALUES FROM (%s) TO (%s)',
+            [lower, upper]
+        )
+        return True
+
+    cursor.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{default}"')
+    cursor.execute(
+        f'CREATE TABLE "{name}" PARTITION OF "{table}" FOR VALUES FROM (%s) TO (%s)',
+        [lower, upper]
+    )
+    cursor.execute(
+        f'WITH moved AS (DELETE FROM "{default}" WHERE "{column}" >= %s AND "{column}" < %s RETURNING *) '
+        f'INSERT INTO "{name}" SELECT * FROM moved',
+        [lower, upper]
+    )
+    cursor.execute(f'ALTER TABLE "{table}" ATTACH PARTITION "{default}" DEFAULT')
+    return True
+
+def expired_partitions(cursor, table, cutoff):
+    """Partitions mà toàn bộ range đã cũ hơn cutoff (upper bound <= cutoff)"""
+    cutoff = cutoff.date() if isinstance(cutoff, datetime) else cutoff
+    return [
+        (name, start) for name, start in list_partitions(cursor, table)
+        if add_months(start, 1) <= cutoff
+    ]
+
+def drop_partition(cursor, table, name):
+    cursor.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{name}"')
+    cursor.execute(f'DROP TABLE "{name}"')
+
+def _rebuild_table(cursor, table, create_suffix, primary_key):
+    """
+    Tạo lại table với cùng columns (CREATE TABLE ... LIKE), copy data và
+    replay indexes/foreign keys của bảng cũ. Dùng cho migration chuyển
+    sang/ra khỏi partitioned table.
+    """
+    cursor.execute(
+        "SELECT pg_get_indexdef(i.indexrelid) FROM pg_index i "
+        "WHERE i.indrelid = %s::regclass "
+        "AND i.indexrelid NOT IN (SELECT conindid FROM pg_constraint WHERE conrelid = %s::regclass)",
+        [table, table]
+    )
+    # Index của partitioned parent được định nghĩa "ON ONLY"; replay trên bảng mới
+    indexes = [row[0].replace(' ON ONLY ', ' ON ', 1) for row in cursor.fetchall()]
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND contype = 'f'",
+        [table]
+    )
+    foreign_keys = cursor.fetchall()
+
+    staging = f"{table}_rebuild"
+    cursor.execute(f'CREATE TABLE "{staging}" (LIKE "{table}" INCLUDING DEFAULTS) {create_suffix}')
+    cursor.execute(f'ALTER TABLE "{staging}" ADD PRIMARY KEY ({primary_key})')
+    return staging, indexes, foreign_keys
+
+def _swap_table(cursor, table, staging, indexes, foreign_keys):
+    cursor.execute(f'INSERT INTO "{staging}" SELECT * FROM "{table}"')
+    # CASCADE: bỏ các FK trỏ vào bảng cũ (đã chuyển sang db_constraint=False)
+    cursor.execute(f'DROP TABLE "{table}" CASCADE')
+    cursor.execute(f'ALTER TABLE "{staging}" RENAME TO "{table}"')
+    cursor.execute(f'ALTER INDEX "{staging}_pkey" RENAME TO "{table}_pkey"')
+    for definition in indexes:
+        cursor.execute(definition)
+    for name, definition in foreign_keys:
+        cursor.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{name}" {definition}')
+
+def convert_to_partitioned(cursor, table, column, months_ahead=3, today=None):
+    """Chuyển table thường thành range-partitioned theo tháng trên `column`"""
+    if is_partitioned(cursor, table):
+        return
+
+    staging, indexes, foreign_keys = _rebuild_table(
+        cursor, table, f'PARTITION BY RANGE ("{column}")', f'"id", "{column}"'
+    )
+    cursor.execute(f'CREATE TABLE "{default_partition_name(table)}_rebuild" PARTITION OF "{staging}" DEFAULT')
+
+    # Partitions phủ data hiện có cho tới `months_ahead` tháng sau
+    cursor.execute(f'SELECT MIN("{column}") FROM "{table}"')
+    oldest = cursor.fetchone()[0]
+    current = month_start(today or datetime.now(dt_timezone.utc))
+    start = month_start(oldest) if oldest else current
+    while start <= add_months(current, months_ahead):
+        cursor.execute(
+            f'CREATE TABLE "{partition_name(table, start)}" PARTITION OF "{staging}" FOR VALUES FROM (%s) TO (%s)',
+            [_bound(start), _bound(add_months(start, 1))]
+        )
+        start = add_months(start, 1)
+
+    _swap_table(cursor, table, staging, indexes, foreign_keys)
+    cursor.execute(
+        f'ALTER TABLE "{default_partition_name(table)}_rebuild" RENAME TO "{default_partition_name(table)}"'
+    )
+
+def convert_to_regular(cursor, table):
+    """Ngược lại của convert_to_partitioned (dùng khi rollback migration)"""
+    if not is_partitioned(cursor, table):
+        return
+    staging, indexes, foreign_keys = _rebuild_table(cursor, table, '', '"id"')
+    _swap_table(cursor, table, staging, indexes, foreign_keys)
+
+def plan_relations(plan):
+    """Tên các relations xuất hiện trong EXPLAIN (FORMAT JSON) plan"""
+    relations = set()
+    if isinstance(plan, list):
+        for item in plan:
+            relations |= plan_relations(item)
+    elif isinstance(plan, dict):
+        if 'Relation Name' in plan:
+            relations.add(plan['Relation Name'])
+        for value in plan.values():
+            if isinstance(value, (list, dict)):
+                relations |= plan_relations(value)
+    return relations
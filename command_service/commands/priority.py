@@ -0,0 +1,56 @@
+from django.conf import settings
+from shared.grpc.services.vendor_service import VendorServiceClient
+from shared.models.constants import COMMAND_PRIORITY_CHOICES
+from commands.context_cache import context_cache
+
+PRIORITIES = tuple(value for value, _ in COMMAND_PRIORITY_CHOICES)
+
+# DeviceCommand.priority là số nguyên, nhỏ hơn = ưu tiên hơn, 1 là mặc định
+DEVICE_COMMAND_DEFAULT_PRIORITY = 1
+
+_vendor_service = None
+
+def normalize_priority(value):
+    """Priority của request ('high'/'normal'/'low'); None nếu không truyền, ValueError nếu không hợp lệ"""
+    if value is None or value == '':
+        return None
+    priority = str(value).strip().lower()
+    if priority not in PRIORITIES:
+        raise ValueError(f"priority must be one of: {', '.join(PRIORITIES)}")
+    return priority
+
+def priority_from_context(context):
+    """
+    Priority theo vendor config: DeviceCommand.priority nếu khác mặc định
+    (< 1 high, > 1 low), ngược lại CommandTemplate.priority. None nếu cả hai
+    đều để mặc định.
+    """
+    device_command = (context or {}).get('device_command') or {}
+    value = device_command.get('priority')
+    if value is not None and value != DEVICE_COMMAND_DEFAULT_PRIORITY:
+        return 'high' if value < DEVICE_COMMAND_DEFAULT_PRIORITY else 'low'
+    template_priority = ((context or {}).get('command_template') or {}).get('priority')
+    return template_priority if template_priority in PRIORITIES else None
+
+def _load_context(device_id, command_type):
+    global _vendor_service
+    if _vendor_service is None:
+        _vendor_service = VendorServiceClient()
+    return _vendor_service.get_command_context(device_id=device_id, command_type=command_type)
+
+def resolve_priority(command_data, loader=None):
+    """
+    Priority lane của một command: priority của request, nếu không có thì
+    theo DeviceCommand / CommandTemplate (context qua context cache), mặc
+    định DEVICE_COMMAND_DEFAULT_LANE. Không load được context thì dùng mặc định.
+    """
+    if command_data.get('priority') in PRIORITIES:
+        return command_data['priority']
+    try:
+        context = context_cache.get_or_load(
+            command_data.get('device_id'), command_data.get('command_type'), loader or _load_context
+        )
+    except Exception as e:
+        print(f"Could not resolve priority of command {command_data.get('command_id')}: {e}")
+        context = None
+    return priority_from_context(context) or settings.DEVICE_COMMAND_DEFAULT_LANE
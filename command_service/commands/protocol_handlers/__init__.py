@@ -1,11 +1,44 @@
+import threading
+from django.conf import settings
 from .http_handler import HTTPHandler
+from .async_http_handler import AsyncHTTPHandler
+from commands.blob_store import BlobStore
+from commands.rate_limit import rate_limiter
+from commands.circuit_breaker import circuit_breakers
 
 PROTOCOL_HANDLERS = {
     'http': HTTPHandler,
 }
 
+_handler_instances = {}
+_handler_lock = threading.Lock()
+
 def get_protocol_handler(protocol):
+    """
+    Get long-lived handler instance cho protocol.
+    Handler được tạo một lần mỗi agent process để dùng lại connection pool
+    và template renderer giữa các commands.
+    """
+    handler = _handler_instances.get(protocol)
+    if handler is not None:
+        return handler
+    
     handler_class = PROTOCOL_HANDLERS.get(protocol)
     if not handler_class:
         raise ValueError(f"Unsupported protocol: {protocol}")
-    return handler_class()
\ No newline at end of file
+    
+    with _handler_lock:
+        handler = _handler_instances.get(protocol)
+        if handler is None:
+            handler = handler_class(
+                pool_maxsize=settings.HTTP_POOL_MAXSIZE,
+                idle_timeout=settings.HTTP_POOL_IDLE_TIMEOUT,
+                plan_cache_size=settings.EXECUTION_PLAN_CACHE_SIZE,
+                max_response_bytes=settings.RESPONSE_MAX_BYTES,
+                inline_response_bytes=settings.RESPONSE_INLINE_BYTES,
+                blob_store=BlobStore(),
+                rate_limiter=rate_limiter,
+                circuit_breakers=circuit_breakers
+            )
+            _handler_instances[protocol] = handler
+    return handler
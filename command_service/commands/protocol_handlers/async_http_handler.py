@@ -0,0 +1,141 @@
+import asyncio
+from .http_handler import CONNECTION_ERROR, TIMEOUT, HTTPHandler, RESPONSE_CHUNK_SIZE
+from commands.rate_limit import RateLimited
+
+# Check if aiohttp is available
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    print("Warning: aiohttp not installed. AsyncHTTPHandler will run requests in threads.")
+    AIOHTTP_AVAILABLE = False
+    aiohttp = None
+
+class AsyncHTTPHandler(HTTPHandler):
+    """Non-blocking HTTP handler cho asyncio execution engine"""
+
+    def __init__(self, concurrency=100, per_host_concurrency=10, idle_timeout=300, plan_cache_size=1000,
+                 max_response_bytes=10 * 1024 * 1024, inline_response_bytes=64 * 1024, blob_store=None,
+                 rate_limiter=None, circuit_breakers=None):
+        super().__init__(
+            pool_maxsize=per_host_concurrency,
+            idle_timeout=idle_timeout,
+            plan_cache_size=plan_cache_size,
+            max_response_bytes=max_response_bytes,
+            inline_response_bytes=inline_response_bytes,
+            blob_store=blob_store,
+            rate_limiter=rate_limiter,
+            circuit_breakers=circuit_breakers
+        )
+        self.concurrency = concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.idle_timeout = idle_timeout
+        self._session = None
+
+    def _get_session(self):
+        """Lazily create ClientSession bên trong running event loop"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.concurrency,
+                limit_per_host=self.per_host_concurrency,
+                keepalive_timeout=self.idle_timeout,
+            )
+            # Session dùng chung cho mọi tenants: không giữ cookies của vendor
+            self._session = aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar())
+        return self._session
+
+    async def execute_command_async(self, api_config, command_template, params, device=None, deadline=None):
+        """
+        Execute HTTP command without blocking the event loop. Raise
+        RateLimited (request chưa được gửi) khi vendor bucket hết token,
+        để caller quyết định chờ hay defer thay vì giữ worker slot. Circuit
+        đang open trả về fast-fail result (error_code 'circuit_open').
+        HTTP timeout không vượt quá budget còn lại tới `deadline`.
+        """
+        try:
+            request = self.build_request(api_config, command_template, params, device)
+            request = self.apply_deadline(request, deadline)
+            breakers, rejected = self.check_circuit(api_config, request)
+            if rejected:
+                return rejected
+
+            if self.rate_limiter is not None:
+                try:
+                    # Redis round-trip: chạy ngoài event loop
+                    await asyncio.get_running_loop().run_in_executor(
+                        None, self.acquire_rate_limit, api_config, request
+                    )
+                except RateLimited:
+                    self.release_circuit(breakers)
+                    raise
+
+            try:
+                if AIOHTTP_AVAILABLE:
+                    result = await self._send_async(request)
+                else:
+                    result = await asyncio.get_running_loop().run_in_executor(None, self.send_request, request)
+            except Exception:
+                self.record_circuit(breakers)
+                raise
+            self.record_circuit(breakers, result['status_code'])
+            return result
+
+        except RateLimited:
+            raise
+        except Exception as e:
+            print(f"Async HTTP command execution error: {e}")
+            raise Exception(f"HTTP command execution failed: {str(e)}") from e
+
+    def transport_error_code(self, error):
+        if isinstance(error, asyncio.TimeoutError):
+            return TIMEOUT
+        if AIOHTTP_AVAILABLE and isinstance(error, aiohttp.ClientConnectionError):
+            return CONNECTION_ERROR
+        return super().transport_error_code(error)
+
+    async def _send_async(self, request):
+        """Gửi request qua aiohttp session và capture response"""
+        print(f"Making async HTTP request: {request['method']} {request['url']}")
+
+        session = self._get_session()
+        async with session.request(
+            method=request['method'],
+            url=request['url'],
+            headers=request['headers'],
+            json=request['body'] if request['body'] else None,
+            timeout=aiohttp.ClientTimeout(total=request['timeout']),
+        ) as response:
+            capture = self.new_capture(response.headers.get('Content-Type'))
+            async for chunk in response.content.iter_chunked(RESPONSE_CHUNK_SIZE):
+                if not capture.feed(chunk):
+                    break
+            status_code = response.status
+
+        # Ghi blob store là file IO: chạy ngoài event loop
+        if capture.offloaded:
+            response_data, meta = await asyncio.get_running_loop().run_in_executor(
+                None, capture.finish, self.blob_store
+            )
+        else:
+            response_data, meta = capture.finish(self.blob_store)
+
+        return self.build_result(request, status_code, response_data, meta)
+
+    def pool_stats(self):
+        """Connection pool statistics"""
+        stats = {'sync': super().pool_stats()}
+        if self._session is not None and not self._session.closed:
+            connector = self._session.connector
+            stats['async'] = {
+                'limit': connector.limit,
+                'limit_per_host': connector.limit_per_host,
+                'keepalive_timeout': self.idle_timeout,
+            }
+        return stats
+
+    async def close(self):
+        """Close underlying ClientSession"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        super().close()
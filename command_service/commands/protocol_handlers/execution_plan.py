@@ -0,0 +1,207 @@
+import base64
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urljoin
+
+PLACEHOLDER_PATTERN = re.compile(r'\{[^}]+\}')
+
+def _safe_get(obj, key, default=None):
+    if obj is None:
+        return default
+    if isinstance(obj, dict):
+        return obj.get(key, default)
+    return getattr(obj, key, default)
+
+def has_placeholder(value):
+    """Check xem template có chứa parameter slot nào không"""
+    if isinstance(value, str):
+        return PLACEHOLDER_PATTERN.search(value) is not None
+    if isinstance(value, dict):
+        return any(has_placeholder(v) for v in value.values())
+    if isinstance(value, list):
+        return any(has_placeholder(v) for v in value)
+    return False
+
+def _slots(template):
+    """Tách dict template thành (key, value, is_dynamic) theo thứ tự keys"""
+    return tuple((key, value, has_placeholder(value)) for key, value in template.items())
+
+def _header_value(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return str(value).lower()
+    return str(value)
+
+def build_auth_headers(auth_type, auth_config):
+    """Encode authentication thành headers (một lần khi compile plan)"""
+    headers = {}
+    if not auth_type or auth_type == 'none':
+        return headers
+    auth_config = auth_config or {}
+
+    if auth_type == 'bearer':
+        token = auth_config.get('token')
+        if token:
+            headers['Authorization'] = f"Bearer {token}"
+    elif auth_type == 'basic':
+        username = auth_config.get('username')
+        password = auth_config.get('password')
+        if username and password:
+            encoded = base64.b64encode(f"{username}:{password}".encode()).decode()
+            headers['Authorization'] = f"Basic {encoded}"
+    elif auth_type == 'api_key':
+        api_key = auth_config.get('api_key')
+        if api_key:
+            headers[auth_config.get('key_name', 'X-API-Key')] = api_key
+    return headers
+
+@dataclass(frozen=True)
+class ExecutionPlan:
+    """
+    Immutable request plan cho một (device, api_config, command_template).
+
+    URL, headers và body đã được merge sẵn; phần static được giữ nguyên và
+    chỉ các parameter slots được render cho mỗi command. Auth headers được
+    encode sẵn và áp dụng sau cùng.
+    """
+    method: str
+    url: str
+    url_dynamic: bool
+    header_slots: Tuple[Tuple[str, Any, bool], ...]
+    body_slots: Tuple[Tuple[str, Any, bool], ...]
+    auth_headers: Tuple[Tuple[str, str], ...]
+    timeout: Any
+
+    def render(self, renderer, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Build request dict: chỉ substitute parameters"""
+        url = str(renderer.render_template(self.url, params)) if self.url_dynamic else self.url
+
+        # Header values phải là string; native types chỉ giữ trong body
+        headers = {
+            key: _header_value(renderer.render_template(value, params)) if dynamic else value
+            for key, value, dynamic in self.header_slots
+        }
+        headers.update(self.auth_headers)
+
+        body = {
+            key: renderer.render_template(value, params) if dynamic else value
+            for key, value, dynamic in self.body_slots
+        }
+
+        return {
+            'method': self.method,
+            'url': url,
+            'headers': headers,
+            'body': body,
+            'timeout': self.timeout,
+        }
+
+def compile_plan(api_config, command_template, device=None) -> ExecutionPlan:
+    """Compile command context thành ExecutionPlan"""
+    base_url = (
+        _safe_get(device, 'base_url') if device else None
+    ) or (
+        _safe_get(api_config, 'base_url')
+    ) or (
+        _safe_get(command_template, 'base_url')
+    )
+
+    if not base_url:
+        raise Exception("No base URL found in device, api_config, or command_template")
+
+    url_template = _safe_get(command_template, 'url_template', '')
+    url = urljoin(base_url, url_template) if url_template else base_url
+
+    # Thứ tự merge: command template < api config < device
+    headers = {}
+    headers.update(_safe_get(command_template, 'headers_template', None) or {})
+    headers.update(_safe_get(api_config, 'headers_template', None) or {})
+    if device:
+        headers.update(_safe_get(device, 'headers_template', None) or {})
+
+    body = {}
+    body.update(_safe_get(command_template, 'body_template', None) or {})
+    if device:
+        body.update(_safe_get(device, 'body_template', None) or {})
+
+    # Device auth override api config auth
+    if device and _safe_get(device, 'auth_type', 'none') not in (None, '', 'none'):
+        auth_headers = build_auth_headers(_safe_get(device, 'auth_type'), _safe_get(device, 'auth_config', {}))
+    else:
+        auth_headers = build_auth_headers(
+            _safe_get(api_config, 'auth_type', 'none'), _safe_get(api_config, 'auth_config', {})
+        )
+
+    timeout = (
+        _safe_get(device, 'timeout') if device else None
+    ) or _safe_get(api_config, 'timeout', 30)
+
+    return ExecutionPlan(
+        method=_safe_get(command_template, 'method', 'POST'),
+        url=url,
+        url_dynamic=has_placeholder(url),
+        header_slots=_slots(headers),
+        body_slots=_slots(body),
+        auth_headers=tuple(auth_headers.items()),
+        timeout=timeout,
+    )
+
+def plan_key(api_config, command_template, device=None) -> Optional[tuple]:
+    """
+    Cache key theo version của context (id + updated_at của từng phần).
+    None nếu context không có đủ version info - khi đó plan không được cache.
+    """
+    key = []
+    for part in (device, api_config, command_template):
+        if part is None:
+            key.append(None)
+            continue
+        part_id = _safe_get(part, 'id')
+        updated_at = _safe_get(part, 'updated_at')
+        if not part_id or not updated_at:
+            return None
+        key.append((str(part_id), str(updated_at)))
+    return tuple(key)
+
+class ExecutionPlanCache:
+    """LRU cache của compiled plans, key theo context version"""
+
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'uncacheable': 0}
+
+    def get_plan(self, api_config, command_template, device=None) -> ExecutionPlan:
+        key = plan_key(api_config, command_template, device)
+        if key is None:
+            with self._lock:
+                self._stats['uncacheable'] += 1
+            return compile_plan(api_config, command_template, device)
+
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self._plans.move_to_end(key)
+                self._stats['hits'] += 1
+                return plan
+            self._stats['misses'] += 1
+
+        plan = compile_plan(api_config, command_template, device)
+        with self._lock:
+            self._plans[key] = plan
+            while len(self._plans) > self.max_size:
+                self._plans.popitem(last=False)
+        return plan
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'size': len(self._plans), 'max_size': self.max_size}
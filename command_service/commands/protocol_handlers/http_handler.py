@@ -1,10 +1,39 @@
-import requests
 import json
+import time
+import requests
+from datetime import datetime, timezone
+from django.conf import settings
 from .base import BaseProtocolHandler
-from urllib.parse import urljoin
+from .session_manager import SessionManager
+from .execution_plan import ExecutionPlanCache, build_auth_headers
+from .response_capture import ResponseCapture
+from commands.rate_limit import RateLimited
+from commands.circuit_breaker import CIRCUIT_OPEN
+
+# Kích thước chunk khi stream vendor response
+RESPONSE_CHUNK_SIZE = 64 * 1024
+
+# HTTP timeout tối thiểu khi bị giới hạn bởi deadline của command
+MIN_DEADLINE_TIMEOUT = 0.1
+
+# error_code của lỗi transport (request không nhận được response)
+CONNECTION_ERROR = 'connection_error'
+TIMEOUT = 'timeout'
 
 class HTTPHandler(BaseProtocolHandler):
     
+    def __init__(self, pool_maxsize=10, idle_timeout=300, plan_cache_size=1000,
+                 max_response_bytes=10 * 1024 * 1024, inline_response_bytes=64 * 1024, blob_store=None,
+                 rate_limiter=None, circuit_breakers=None):
+        super().__init__()
+        self.sessions = SessionManager(pool_maxsize=pool_maxsize, idle_timeout=idle_timeout)
+        self.plans = ExecutionPlanCache(max_size=plan_cache_size)
+        self.max_response_bytes = max_response_bytes
+        self.inline_response_bytes = inline_response_bytes
+        self.blob_store = blob_store
+        self.rate_limiter = rate_limiter
+        self.circuit_breakers = circuit_breakers
+    
     def safe_get(self, obj, key, default=None):
         """Safely get attribute from object or dict"""
         if obj is None:
@@ -28,7 +57,7 @@ class HTTPHandler(BaseProtocolHandler):
             self._add_auth(headers, auth_type, auth_config)
             
             timeout = self.safe_get(api_config, 'timeout', 30)
-            response = requests.get(url, headers=headers, timeout=timeout)
+            response = self.sessions.request('GET', url, headers=headers, timeout=timeout)
             
             return {
                 'status_code': response.status_code,
@@ -38,118 +67,175 @@ class HTTPHandler(BaseProtocolHandler):
         except Exception as e:
             raise Exception(f"HTTP connection test failed: {str(e)}")
 
-    def execute_command(self, api_config, command_template, params, device=None):
-        """Execute HTTP command"""
+    def execute_command(self, api_config, command_template, params, device=None, deadline=None):
+        """
+        Execute HTTP command (chờ vendor rate limit nếu có, xem
+        wait_for_rate_limit). Raise RateLimited nếu request chưa được gửi.
+        """
         try:
-            # Prepare URL
-            base_url = (
-                self.safe_get(device, 'base_url') if device else None
-            ) or (
-                self.safe_get(api_config, 'base_url')
-            ) or (
-                self.safe_get(command_template, 'base_url')
-            )
-            
-            if not base_url:
-                raise Exception("No base URL found in device, api_config, or command_template")
-            
-            url_template = self.safe_get(command_template, 'url_template', '')
-            if not url_template:
-                url = base_url
-            else:
-                url = urljoin(base_url, url_template)
-            
-            url = self.render_template(url, params)
-            print(f"Resolved URL: {url} with params: {params}")
-            
-            # Prepare headers
-            headers = {}
-            headers.update(self.safe_get(command_template, 'headers_template', {}))
-            headers.update(self.safe_get(api_config, 'headers_template', {}))
-            if device:
-                headers.update(self.safe_get(device, 'headers_template', {}))
-            
-            headers = self.render_template(headers, params)
-
-            # Prepare body
-            body = {}
-            body.update(self.safe_get(command_template, 'body_template', {}))
-            if device:
-                body.update(self.safe_get(device, 'body_template', {}))
-            
-            body = self.render_template(body, params)
-
-            # Add authentication
-            if device and self.safe_get(device, 'auth_type', 'none') != 'none':
-                auth_type = self.safe_get(device, 'auth_type')
-                auth_config = self.safe_get(device, 'auth_config', {})
-            else:
-                auth_type = self.safe_get(api_config, 'auth_type', 'none')
-                auth_config = self.safe_get(api_config, 'auth_config', {})
-            
-            self._add_auth(headers, auth_type, auth_config)
-            
-            # Make request
-            method = self.safe_get(command_template, 'method', 'POST')
-            timeout = (
-                self.safe_get(device, 'timeout') if device else None
-            ) or self.safe_get(api_config, 'timeout', 30)
-            
-            print(f"Making HTTP request: {method} {url}")
-            print(f"Headers: {headers}")
-            print(f"Body: {body}")
-            
-            response = requests.request(
-                method=method,
-                url=url,
-                headers=headers,
-                json=body if body else None,
-                timeout=timeout,
-            )
-            
+            request = self.build_request(api_config, command_template, params, device)
+            request = self.apply_deadline(request, deadline)
+            breakers, rejected = self.check_circuit(api_config, request)
+            if rejected:
+                return rejected
             try:
-                response_data = response.json()
-            except ValueError:
-                response_data = response.text
-            
-            # Process response
-            result = {
-                'status_code': response.status_code,
-                'response': response_data,
-                'success': response.status_code < 400,
-                'url': url,
-                'method': method
-            }
-            
-            print(f"HTTP response: {result}")
+                self.wait_for_rate_limit(api_config, request, deadline)
+            except RateLimited:
+                self.release_circuit(breakers)
+                raise
+            try:
+                result = self.send_request(request)
+            except Exception:
+                self.record_circuit(breakers)
+                raise
+            self.record_circuit(breakers, result['status_code'])
             return result
             
+        except RateLimited:
+            raise
         except Exception as e:
             print(f"HTTP command execution error: {e}")
-            raise Exception(f"HTTP command execution failed: {str(e)}")
+            raise Exception(f"HTTP command execution failed: {str(e)}") from e
+
+    def error_code(self, error):
+        """CONNECTION_ERROR / TIMEOUT nếu error (hoặc cause của nó) là lỗi transport, None nếu không"""
+        while error is not None:
+            code = self.transport_error_code(error)
+            if code:
+                return code
+            error = error.__cause__
+        return None
+
+    def transport_error_code(self, error):
+        if isinstance(error, (requests.Timeout, TimeoutError)):
+            return TIMEOUT
+        if isinstance(error, (requests.ConnectionError, ConnectionError)):
+            return CONNECTION_ERROR
+        return None
+
+    def send_request(self, request):
+        """Gửi request đã resolve và capture response"""
+        print(f"Making HTTP request: {request['method']} {request['url']}")
+        print(f"Headers: {request['headers']}")
+        print(f"Body: {request['body']}")
+        
+        response = self.sessions.request(
+            request['method'],
+            request['url'],
+            headers=request['headers'],
+            json=request['body'] if request['body'] else None,
+            timeout=request['timeout'],
+            stream=True,
+        )
+        
+        capture = self.new_capture(response.headers.get('Content-Type'))
+        try:
+            for chunk in response.iter_content(chunk_size=RESPONSE_CHUNK_SIZE):
+                if not capture.feed(chunk):
+                    break
+        finally:
+            response.close()
+        
+        response_data, meta = capture.finish(self.blob_store)
+        result = self.build_result(request, response.status_code, response_data, meta)
+        print(f"HTTP response: {response.status_code} ({meta['response_size']} bytes)")
+        return result
+
+    def build_request(self, api_config, command_template, params, device=None):
+        """Resolve URL, headers, body, auth và timeout cho một command"""
+        plan = self.plans.get_plan(api_config, command_template, device)
+        request = plan.render(self.renderer, params)
+        print(f"Resolved URL: {request['url']} with params: {params}")
+        return request
+
+    def acquire_rate_limit(self, api_config, request):
+        """Lấy token của vendor bucket; raise RateLimited nếu chưa được gửi"""
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(api_config, request['url'])
+
+    def wait_for_rate_limit(self, api_config, request, deadline=None):
+        """
+        Blocking: chờ tới khi vendor bucket có token. Tổng thời gian chờ không
+        quá VENDOR_RATE_LIMIT_MAX_WAIT và không quá deadline của command, nếu
+        phải chờ lâu hơn thì raise RateLimited
+        """
+        waited_until = time.monotonic() + settings.VENDOR_RATE_LIMIT_MAX_WAIT
+        while True:
+            try:
+                return self.acquire_rate_limit(api_config, request)
+            except RateLimited as e:
+                if time.monotonic() + e.retry_after > waited_until:
+                    raise
+                if deadline is not None and (deadline - datetime.now(timezone.utc)).total_seconds() <= e.retry_after:
+                    raise
+                time.sleep(e.retry_after)
+
+    def apply_deadline(self, request, deadline):
+        """Giới hạn HTTP timeout bởi budget còn lại tới deadline (aware datetime) của command"""
+        if deadline is None:
+            return request
+        remaining = (deadline - datetime.now(timezone.utc)).total_seconds()
+        timeout = min(request['timeout'], remaining) if request['timeout'] else remaining
+        return {**request, 'timeout': max(timeout, MIN_DEADLINE_TIMEOUT)}
+
+    def check_circuit(self, api_config, request):
+        """
+        Circuit breakers (host + api_config) của request. Trả về (breakers,
+        result) - result là fast-fail result khi một circuit đang open.
+        """
+        if self.circuit_breakers is None:
+            return [], None
+        breakers = self.circuit_breakers.breakers_for(api_config, request['url'])
+        rejected = self.circuit_breakers.acquire(breakers)
+        if rejected is None:
+            return breakers, None
+        scope, key, retry_after = rejected
+        return breakers, {
+            'success': False,
+            'error_code': CIRCUIT_OPEN,
+            'error': f"Circuit open for {scope} {key}, retry after {retry_after:.0f}s",
+            'retry_after': retry_after,
+            'url': request['url'],
+            'method': request['method'],
+        }
+
+    def record_circuit(self, breakers, status_code=None):
+        """Ghi kết quả vào circuits: lỗi kết nối/timeout (không có status) và 5xx là lỗi"""
+        if breakers:
+            self.circuit_breakers.record(breakers, status_code is not None and status_code < 500)
+
+    def release_circuit(self, breakers):
+        """Request được circuit cho qua nhưng không gửi"""
+        if breakers:
+            self.circuit_breakers.release(breakers)
+
+    def pool_stats(self):
+        """Connection pool statistics"""
+        return self.sessions.stats()
+
+    def close(self):
+        """Close pooled sessions"""
+        self.sessions.close()
+
+    def new_capture(self, content_type=None):
+        """Streaming capture cho một response (size cap + hash)"""
+        return ResponseCapture(
+            max_bytes=self.max_response_bytes,
+            inline_bytes=self.inline_response_bytes,
+            content_type=content_type
+        )
+
+    def build_result(self, request, status_code, response_data, meta=None):
+        """Build result dict từ HTTP response"""
+        return {
+            'status_code': status_code,
+            'response': response_data,
+            'success': status_code < 400,
+            'url': request['url'],
+            'method': request['method'],
+            **(meta or {})
+        }
 
     def _add_auth(self, headers, auth_type, auth_config):
         """Add authentication to headers"""
-        if not auth_type or auth_type == 'none':
-            return
-            
-        if not auth_config:
-            auth_config = {}
-            
-        if auth_type == 'bearer':
-            token = auth_config.get('token')
-            if token:
-                headers['Authorization'] = f"Bearer {token}"
-        elif auth_type == 'basic':
-            username = auth_config.get('username')
-            password = auth_config.get('password')
-            if username and password:
-                import base64
-                credentials = f"{username}:{password}"
-                encoded = base64.b64encode(credentials.encode()).decode()
-                headers['Authorization'] = f"Basic {encoded}"
-        elif auth_type == 'api_key':
-            api_key = auth_config.get('api_key')
-            if api_key:
-                key_name = auth_config.get('key_name', 'X-API-Key')
-                headers[key_name] = api_key
\ No newline at end of file
+        headers.update(build_auth_headers(auth_type, auth_config))
@@ -0,0 +1,93 @@
+import hashlib
+import json
+import tempfile
+
+class ResponseCapture:
+    """
+    Đọc vendor response theo chunks thay vì load toàn bộ body.
+
+    Đếm số bytes thật và hash sha256 trong lúc đọc; dừng khi vượt
+    `max_bytes` (response_truncated). Body nhỏ hơn `inline_bytes` được parse
+    và trả về inline; body lớn hoặc binary được spool ra temp file, offload
+    vào blob store và chỉ để lại preview (reference trong metadata).
+    """
+
+    def __init__(self, max_bytes=10 * 1024 * 1024, inline_bytes=64 * 1024, preview_bytes=512, content_type=''):
+        self.max_bytes = max_bytes
+        self.inline_bytes = inline_bytes
+        self.preview_bytes = preview_bytes
+        self.content_type = content_type or ''
+        self.size = 0
+        self.truncated = False
+        self._digest = hashlib.sha256()
+        self._body = tempfile.SpooledTemporaryFile(max_size=inline_bytes)
+
+    def feed(self, chunk):
+        """Thêm một chunk; trả về False khi đã tới size cap (ngừng đọc)"""
+        remaining = self.max_bytes - self.size
+        if len(chunk) > remaining:
+            chunk = chunk[:remaining]
+            self.truncated = True
+        if chunk:
+            self._digest.update(chunk)
+            self._body.write(chunk)
+            self.size += len(chunk)
+        return not self.truncated
+
+    @property
+    def offloaded(self):
+        """Body quá lớn để giữ inline (finish() sẽ ghi vào blob store)"""
+        return self.truncated or self.size > self.inline_bytes
+
+    def finish(self, blob_store=None):
+        """Trả về (response, capture metadata) và giải phóng buffer"""
+        digest = self._digest.hexdigest()
+        meta = {
+            'response_size': self.size,
+            'response_sha256': digest,
+            'response_truncated': self.truncated,
+        }
+        try:
+            self._body.seek(0)
+            if not self.offloaded:
+                response = self._parse(self._body.read())
+                if response is not None:
+                    return response, meta
+
+            self._body.seek(0)
+            preview = self._preview(self._body.read(self.preview_bytes))
+            self._body.seek(0)
+            # Blob ref chỉ nằm trong metadata (result['response_blob']): body
+            # inline là dữ liệu của vendor nên không được coi là reference
+            meta['response_blob'] = blob_store.put_file(digest, self._body) if blob_store else None
+            response = {
+                'preview': preview,
+                'size': self.size,
+                'content_type': self.content_type,
+                'truncated': self.truncated,
+            }
+            return response, meta
+        finally:
+            self._body.close()
+
+    @staticmethod
+    def _preview(data):
+        """Preview dạng text; None nếu body là binary"""
+        # Bỏ tối đa 3 bytes cuối: ký tự UTF-8 có thể bị cắt ở giới hạn preview
+        for cut in range(4):
+            try:
+                return data[:len(data) - cut].decode('utf-8')
+            except UnicodeDecodeError:
+                continue
+        return None
+
+    def _parse(self, body):
+        """JSON nếu parse được, không thì text; None nếu là binary"""
+        try:
+            text = body.decode('utf-8')
+        except UnicodeDecodeError:
+            return None
+        try:
+            return json.loads(text)
+        except ValueError:
+            return text
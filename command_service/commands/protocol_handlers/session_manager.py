@@ -0,0 +1,136 @@
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+class RejectCookiePolicy(DefaultCookiePolicy):
+    """Không lưu cookie nào từ responses"""
+
+    def set_ok(self, cookie, request):
+        return False
+
+class SessionManager:
+    """
+    Quản lý pooled keep-alive HTTP sessions theo (scheme, host, port).
+
+    Mỗi vendor endpoint có một requests.Session riêng với connection pool
+    giới hạn, nên các commands liên tiếp tới cùng vendor dùng lại kết nối
+    TCP/TLS đã mở. Sessions không dùng quá `idle_timeout` giây bị đóng.
+
+    Một session được dùng chung bởi commands của mọi tenants tới cùng
+    endpoint, nên session không giữ cookies (Set-Cookie của vendor cho
+    command này không được gửi kèm command của tenant khác).
+    """
+
+    def __init__(self, pool_maxsize=10, idle_timeout=300, max_sessions=256):
+        self.pool_maxsize = pool_maxsize
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._last_eviction = time.monotonic()
+        self._stats = {'created': 0, 'reused': 0, 'evicted': 0, 'requests': 0}
+
+    @staticmethod
+    def pool_key(url):
+        """(scheme, host, port) của một URL"""
+        parts = urlsplit(url)
+        scheme = (parts.scheme or 'http').lower()
+        host = (parts.hostname or '').lower()
+        port = parts.port or DEFAULT_PORTS.get(scheme)
+        return scheme, host, port
+
+    def _create_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=True,
+            max_retries=0,
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers['Connection'] = 'keep-alive'
+        session.cookies.set_policy(RejectCookiePolicy())
+        return session
+
+    def get_session(self, url):
+        """Lấy (hoặc tạo) session cho endpoint của URL"""
+        key = self.pool_key(url)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is None:
+                if len(self._sessions) >= self.max_sessions:
+                    self._evict_lru()
+                entry = {'session': self._create_session(), 'last_used': now, 'requests': 0}
+                self._sessions[key] = entry
+                self._stats['created'] += 1
+            else:
+                self._stats['reused'] += 1
+            entry['last_used'] = now
+            entry['requests'] += 1
+            self._stats['requests'] += 1
+            session = entry['session']
+
+        if now - self._last_eviction > min(self.idle_timeout, 60):
+            self.evict_idle()
+
+        return session
+
+    def request(self, method, url, **kwargs):
+        """Gửi request qua pooled session"""
+        return self.get_session(url).request(method=method, url=url, **kwargs)
+
+    def _evict_lru(self):
+        """Đóng session ít được dùng gần đây nhất (caller giữ lock)"""
+        key = min(self._sessions, key=lambda k: self._sessions[k]['last_used'])
+        self._sessions.pop(key)['session'].close()
+        self._stats['evicted'] += 1
+
+    def evict_idle(self):
+        """Đóng các sessions idle quá idle_timeout"""
+        now = time.monotonic()
+        with self._lock:
+            self._last_eviction = now
+            idle_keys = [
+                key for key, entry in self._sessions.items()
+                if now - entry['last_used'] > self.idle_timeout
+            ]
+            for key in idle_keys:
+                self._sessions.pop(key)['session'].close()
+            self._stats['evicted'] += len(idle_keys)
+        return len(idle_keys)
+
+    def stats(self):
+        """Pool statistics"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                **self._stats,
+                'active_sessions': len(self._sessions),
+                'pool_maxsize': self.pool_maxsize,
+                'pools': [
+                    {
+                        'scheme': scheme,
+                        'host': host,
+                        'port': port,
+                        'requests': entry['requests'],
+                        'idle_seconds': round(now - entry['last_used'], 3),
+                    }
+                    for (scheme, host, port), entry in self._sessions.items()
+                ],
+            }
+
+    def close(self):
+        """Đóng tất cả sessions"""
+        with self._lock:
+            for entry in self._sessions.values():
+                entry['session'].close()
+            self._sessions.clear()
@@ -1,90 +1,186 @@
 import re
 import json
 import uuid
-from typing import Any, Dict, Union
+import threading
+from typing import Any, Callable, Dict, Union
 from datetime import datetime
 
+PLACEHOLDER_PATTERN = re.compile(r'\{([^}]+)\}')
+
 class TemplateRenderer:
-    """Enhanced template renderer with support for advanced features"""
-    
-    def __init__(self):
+    """
+    Enhanced template renderer with support for advanced features
+
+    Templates được parse một lần thành cây closures và cache lại (string theo
+    giá trị, dict/list theo repr nội dung của template), nên mỗi lần render chỉ còn
+    evaluate closures với params. Template bị sửa tại chỗ có key mới và cache
+    không giữ reference tới template objects.
+    """
+
+    def __init__(self, cache_size=4096):
         self.builtin_functions = {
             'now': lambda: datetime.now().isoformat(),
             'timestamp': lambda: int(datetime.now().timestamp()),
             'uuid': lambda: str(uuid.uuid4()),
         }
-    
+        self.cache_size = cache_size
+        self._string_cache = {}
+        # repr của dict/list template -> compiled
+        self._object_cache = {}
+        self._cache_lock = threading.Lock()
+
     def render_template(self, template: Any, params: Dict[str, Any]) -> Any:
         """
         Render template with parameters
-        
+
         Supports:
         - Simple replacement: {device_id}
         - Nested parameters: {device.id}
         - Functions: {now()}, {timestamp()}
         - Conditional: {value|default_value}
         - Type conversion: {value:int}, {value:float}
+
+        Placeholder chiếm toàn bộ string (vd. "{zoom_level}") trả về native
+        type của giá trị thay vì string.
         """
+        return self.compile(template)(params)
+
+    def compile(self, template: Any) -> Callable[[Dict[str, Any]], Any]:
+        """Compile template (có cache) thành callable(params)"""
         if isinstance(template, str):
-            return self._render_string(template, params)
-        elif isinstance(template, dict):
-            return {k: self.render_template(v, params) for k, v in template.items()}
-        elif isinstance(template, list):
-            return [self.render_template(item, params) for item in template]
-        return template
-    
+            compiled = self._string_cache.get(template)
+            if compiled is None:
+                compiled = self._compile_string(template)
+                self._cache_put(self._string_cache, template, compiled)
+            return compiled
+
+        if isinstance(template, (dict, list)):
+            # repr theo nội dung (nhanh hơn json.dumps và phân biệt 1 / '1')
+            key = repr(template)
+            compiled = self._object_cache.get(key)
+            if compiled is None:
+                compiled = self._compile_container(template)
+                self._cache_put(self._object_cache, key, compiled)
+            return compiled
+
+        return lambda params: template
+
+    def _cache_put(self, cache, key, value):
+        with self._cache_lock:
+            while len(cache) >= self.cache_size:
+                cache.pop(next(iter(cache)))
+            cache[key] = value
+
+    def _compile_container(self, template: Union[dict, list]) -> Callable:
+        """Compile dict/list: compile từng phần tử, tạo container mới mỗi lần render"""
+        if isinstance(template, dict):
+            items = [(k, self._compile_value(v)) for k, v in template.items()]
+            return lambda params: {k: render(params) for k, render in items}
+
+        items = [self._compile_value(v) for v in template]
+        return lambda params: [render(params) for render in items]
+
+    def _compile_value(self, value: Any) -> Callable:
+        """Compile phần tử lồng nhau (không cache riêng)"""
+        if isinstance(value, str):
+            return self.compile(value)
+        if isinstance(value, (dict, list)):
+            return self._compile_container(value)
+        return lambda params: value
+
+    def _compile_string(self, template: str) -> Callable:
+        """Parse string template thành literal segments và placeholder resolvers"""
+        segments = []
+        position = 0
+        for match in PLACEHOLDER_PATTERN.finditer(template):
+            if match.start() > position:
+                segments.append(template[position:match.start()])
+            placeholder = match.group(1)
+            segments.append((self._compile_placeholder(placeholder), self._stringifier(placeholder)))
+            position = match.end()
+        if position < len(template):
+            segments.append(template[position:])
+
+        if all(isinstance(segment, str) for segment in segments):
+            return lambda params: template
+
+        if len(segments) == 1:
+            # Whole-value placeholder: giữ native type
+            return segments[0][0]
+
+        def render(params):
+            return ''.join(
+                segment if isinstance(segment, str) else segment[1](segment[0](params))
+                for segment in segments
+            )
+        return render
+
     def _render_string(self, template: str, params: Dict[str, Any]) -> str:
         """Render string template with advanced features"""
-        
-        # Pattern để match các placeholder
-        pattern = r'\{([^}]+)\}'
-        
-        def replacer(match):
-            placeholder = match.group(1)
-            return self._resolve_placeholder(placeholder, params)
-        result = re.sub(pattern, replacer, template)
-        return result
-    
-    def _resolve_placeholder(self, placeholder: str, params: Dict[str, Any]) -> str:
-        """Resolve single placeholder"""
-        try:
-            # Check for type conversion {value:type}
-            if ':' in placeholder:
-                key, type_hint = placeholder.split(':', 1)
-                key = key.strip()  # Remove any whitespace
-                value = self._get_value(key, params)
-                return self._convert_type(value, type_hint)
-            
-            # Check for default value {value|default}
-            elif '|' in placeholder:
-                key, default = placeholder.split('|', 1)
-                key = key.strip()  # Remove any whitespace
+        return self.compile(template)(params)
+
+    def _compile_placeholder(self, placeholder: str) -> Callable:
+        """Parse một placeholder thành resolver(params) -> native value"""
+        fallback = f"{{{placeholder}}}"
+
+        # Check for type conversion {value:type}
+        if ':' in placeholder:
+            key, type_hint = placeholder.split(':', 1)
+            getter = self._compile_getter(key.strip())
+            converter = self._native_converter(type_hint)
+
+            def resolve(params):
                 try:
-                    return str(self._get_value(key, params))
+                    return converter(getter(params))
+                except Exception:
+                    return fallback
+            return resolve
+
+        # Check for default value {value|default}
+        if '|' in placeholder:
+            key, default = placeholder.split('|', 1)
+            getter = self._compile_getter(key.strip())
+
+            def resolve(params):
+                try:
+                    return getter(params)
                 except (KeyError, AttributeError):
                     return default
-            
-            # Check for function call {func()}
-            elif placeholder.endswith('()'):
-                func_name = placeholder[:-2].strip()
-                if func_name in self.builtin_functions:
-                    return str(self.builtin_functions[func_name]())
-                raise ValueError(f"Unknown function: {func_name}")
-            
-            # Simple replacement
-            else:
-                key = placeholder.strip()  # Remove any whitespace
-                return str(self._get_value(key, params))
-                
-        except Exception as e:
-            # Fallback: return placeholder as-is if resolution fails
-            return f"{{{placeholder}}}"
-    
-    def _get_value(self, key: str, params: Dict[str, Any]) -> Any:
-        """Get value from params, supporting nested keys"""
-        # Support nested keys like 'device.id'
-        if '.' in key:
-            parts = key.split('.')
+                except Exception:
+                    return fallback
+            return resolve
+
+        # Check for function call {func()}
+        if placeholder.endswith('()'):
+            func = self.builtin_functions.get(placeholder[:-2].strip())
+            if func is None:
+                return lambda params: fallback
+
+            def resolve(params):
+                try:
+                    return func()
+                except Exception:
+                    return fallback
+            return resolve
+
+        # Simple replacement
+        getter = self._compile_getter(placeholder.strip())
+
+        def resolve(params):
+            try:
+                return getter(params)
+            except Exception:
+                return fallback
+        return resolve
+
+    def _compile_getter(self, key: str) -> Callable:
+        """Compile key (hỗ trợ nested 'device.id') thành getter(params)"""
+        if '.' not in key:
+            return lambda params: params[key]
+
+        parts = key.split('.')
+
+        def getter(params):
             value = params
             for part in parts:
                 if isinstance(value, list):
@@ -93,25 +189,41 @@ class TemplateRenderer:
                     except ValueError:
                         raise KeyError(f"Invalid index: {part}")
                     value = value[part]
-                if isinstance(value, dict):
+                elif isinstance(value, dict):
                     value = value[part]
                 else:
                     value = getattr(value, part)
             return value
-        else:
-            return params[key]
-    
+        return getter
+
+    def _native_converter(self, type_hint: str) -> Callable:
+        """Converter cho {value:type}, trả về native type"""
+        if type_hint == 'int':
+            return lambda value: int(float(value)) if isinstance(value, str) and '.' in value else int(value)
+        if type_hint == 'float':
+            return float
+        if type_hint == 'bool':
+            return bool
+        if type_hint == 'json':
+            return json.dumps
+        return str
+
+    @staticmethod
+    def _stringifier(placeholder: str) -> Callable:
+        """Format giá trị khi placeholder được nhúng trong string"""
+        if ':' in placeholder and placeholder.split(':', 1)[1] == 'bool':
+            return lambda value: str(value).lower() if isinstance(value, bool) else str(value)
+        return str
+
+    def _resolve_placeholder(self, placeholder: str, params: Dict[str, Any]) -> str:
+        """Resolve single placeholder"""
+        value = self._compile_placeholder(placeholder)(params)
+        return self._stringifier(placeholder)(value)
+
+    def _get_value(self, key: str, params: Dict[str, Any]) -> Any:
+        """Get value from params, supporting nested keys"""
+        return self._compile_getter(key)(params)
+
     def _convert_type(self, value: Any, type_hint: str) -> str:
         """Convert value to specified type"""
-        if type_hint == 'int':
-            if isinstance(value, str) and '.' in value:
-                return str(int(float(value)))
-            return str(int(value))
-        elif type_hint == 'float':
-            return str(float(value))
-        elif type_hint == 'bool':
-            return str(bool(value)).lower()
-        elif type_hint == 'json':
-            return json.dumps(value)
-        else:
-            return str(value)
\ No newline at end of file
+        return self._stringifier(f"value:{type_hint}")(self._native_converter(type_hint)(value))
@@ -0,0 +1,147 @@
+import math
+import threading
+import time
+from urllib.parse import urlsplit
+from django.conf import settings
+
+# Check if redis is available
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+    redis = None
+
+class RateLimited(Exception):
+    """Bucket của vendor hết token: request chưa được gửi, thử lại sau retry_after giây"""
+
+    def __init__(self, key, retry_after):
+        super().__init__(f"Rate limit exceeded for {key}, retry after {retry_after:.2f}s")
+        self.key = key
+        self.retry_after = retry_after
+
+class LocalTokenBucket:
+    """
+    Token buckets trong process. Stand-in cho RedisTokenBucket khi không có
+    Redis (dev/test): chỉ giới hạn được requests của process hiện tại.
+    """
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key, rate, burst, tokens=1):
+        """Lấy `tokens` từ bucket; trả về 0 nếu được, ngược lại số giây cần chờ"""
+        now = time.monotonic()
+        with self._lock:
+            available, updated_at = self._buckets.get(key, (burst, now))
+            available = min(burst, available + (now - updated_at) * rate)
+            wait = 0.0
+            if available >= tokens:
+                available -= tokens
+            else:
+                wait = (tokens - available) / rate
+            self._buckets[key] = (available, now)
+        return wait
+
+class RedisTokenBucket:
+    """
+    Token buckets trong Redis, dùng chung giữa các agent processes/hosts.
+    Refill và take chạy trong một Lua script (atomic), dùng clock của Redis
+    nên không phụ thuộc clock của từng agent.
+    """
+
+    KEY_PREFIX = 'vendor-rate-limit:'
+
+    SCRIPT = """
+    local rate = tonumber(ARGV[1])
+    local burst = tonumber(ARGV[2])
+    local requested = tonumber(ARGV[3])
+    local clock = redis.call('TIME')
+    local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or burst
+    local updated_at = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+    local wait = 0
+    if tokens >= requested then
+        tokens = tokens - requested
+    else
+        wait = (requested - tokens) / rate
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+    redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+    return tostring(wait)
+    """
+
+    def __init__(self, url):
+        if not REDIS_AVAILABLE:
+            raise ImportError("redis is required for RedisTokenBucket")
+        self.client = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+        self._script = self.client.register_script(self.SCRIPT)
+
+    def acquire(self, key, rate, burst, tokens=1):
+        return float(self._script(keys=[f"{self.KEY_PREFIX}{key}"], args=[rate, burst, tokens]))
+
+class RateLimiter:
+    """
+    Rate limit outbound requests theo (api_config, host). Limit lấy từ
+    `rate_limit` (requests/giây) và `rate_limit_burst` của APIConfiguration,
+    mặc định VENDOR_RATE_LIMIT_DEFAULT (0 = không giới hạn).
+
+    Lỗi của backend không chặn requests (fail open).
+    """
+
+    def __init__(self, backend, default_rate=0, default_burst=0):
+        self.backend = backend
+        self.default_rate = default_rate
+        self.default_burst = default_burst
+        self._stats = {'allowed': 0, 'throttled': 0, 'errors': 0}
+
+    def limit_for(self, api_config):
+        """(rate, burst) của api_config, None nếu không giới hạn"""
+        rate = (api_config or {}).get('rate_limit') or self.default_rate
+        if not rate or rate <= 0:
+            return None
+        burst = (api_config or {}).get('rate_limit_burst') or self.default_burst or math.ceil(rate)
+        return rate, max(burst, 1)
+
+    @staticmethod
+    def bucket_key(api_config, url):
+        return f"{(api_config or {}).get('id', '')}:{urlsplit(url).netloc.lower()}"
+
+    def acquire(self, api_config, url):
+        """Raise RateLimited nếu request tới url phải chờ"""
+        limit = self.limit_for(api_config)
+        if limit is None:
+            return
+        key = self.bucket_key(api_config, url)
+        try:
+            wait = self.backend.acquire(key, *limit)
+        except Exception as e:
+            self._stats['errors'] += 1
+            print(f"Rate limiter error for {key}: {e}")
+            return
+        if wait > 0:
+            self._stats['throttled'] += 1
+            raise RateLimited(key, wait)
+        self._stats['allowed'] += 1
+
+    def stats(self):
+        return dict(self._stats)
+
+def build_rate_limiter():
+    """Redis backend khi có REDIS_URL, ngược lại buckets trong process"""
+    backend = None
+    if settings.REDIS_URL:
+        try:
+            backend = RedisTokenBucket(settings.REDIS_URL)
+        except ImportError as e:
+            print(f"Warning: {e}. Vendor rate limits apply per process only.")
+    return RateLimiter(
+        backend or LocalTokenBucket(),
+        default_rate=settings.VENDOR_RATE_LIMIT_DEFAULT,
+        default_burst=settings.VENDOR_RATE_LIMIT_DEFAULT_BURST
+    )
+
+rate_limiter = build_rate_limiter()
@@ -0,0 +1,25 @@
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.renderers import BaseRenderer
+
+def format_sse(data, event=None, event_id=None):
+    """Encode một server-sent event"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, cls=DjangoJSONEncoder)}")
+    return '\n'.join(lines) + '\n\n'
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Cho phép content negotiation với Accept: text/event-stream. Stream thật
+    được trả về bằng StreamingHttpResponse; renderer chỉ dùng cho lỗi.
+    """
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return format_sse(data, event='error').encode(self.charset)
@@ -0,0 +1,51 @@
+import random
+from commands.circuit_breaker import CIRCUIT_OPEN
+from commands.protocol_handlers.http_handler import CONNECTION_ERROR, TIMEOUT
+
+# HTTP status codes coi là lỗi tạm thời của vendor
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+# Lỗi không có status code được retry: kết nối/timeout và circuit open.
+# Lỗi khác (ví dụ config thiếu base URL) retry cũng không thành công
+RETRYABLE_ERROR_CODES = {CONNECTION_ERROR, TIMEOUT, CIRCUIT_OPEN}
+
+def is_retryable(result):
+    """Check xem một attempt thất bại có nên retry hay không"""
+    if result.get('success'):
+        return False
+    status_code = result.get('status_code')
+    if status_code is None:
+        return result.get('error_code') in RETRYABLE_ERROR_CODES
+    return status_code in RETRYABLE_STATUS_CODES
+
+class RetryPolicy:
+    """Exponential backoff với jitter"""
+
+    def __init__(self, max_retries=3, base_delay=5, max_delay=300, multiplier=2):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+
+    @classmethod
+    def from_context(cls, context, max_retries=None):
+        """
+        Build policy từ retry_count/retry_delay của device, api_config và
+        command template (theo thứ tự ưu tiên), giới hạn bởi max_retries
+        của CommandRequest
+        """
+        sources = [context.get('device'), context.get('api_config'), context.get('command_template')]
+        retry_count = next((s.get('retry_count') for s in sources if s and s.get('retry_count')), 3)
+        retry_delay = next((s.get('retry_delay') for s in sources if s and s.get('retry_delay')), 5)
+        if max_retries is not None:
+            retry_count = min(retry_count, max_retries)
+        return cls(max_retries=retry_count, base_delay=retry_delay)
+
+    def should_retry(self, attempt):
+        """attempt: số lần retry đã thực hiện"""
+        return attempt < self.max_retries
+
+    def next_delay(self, attempt):
+        """Delay (giây) trước retry thứ attempt + 1, với equal jitter"""
+        delay = min(self.max_delay, self.base_delay * (self.multiplier ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
@@ -0,0 +1,167 @@
+import heapq
+import itertools
+import threading
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from shared.kafka.topics import Topics, EventTypes
+from shared.kafka.publisher import EventPublisher
+from commands.dispatch import device_key, dispatch_command
+from commands.deadlines import publish_timeout
+from commands.models import CommandRequest
+from commands.status_cache import status_cache
+
+class CommandScheduler:
+    """
+    Dispatch các commands có scheduled_at khi tới hạn.
+
+    Mỗi poll claim một batch commands sắp tới hạn (trong `lookahead`) bằng
+    SELECT ... FOR UPDATE SKIP LOCKED và ghi một lease (claimed_until), nên
+    nhiều scheduler replicas có thể chạy song song mà không dispatch trùng.
+    Commands đã claim được giữ trong một heap và dispatch đúng thời điểm;
+    agents nhận prewarm event ngay khi claim để chuẩn bị device context.
+
+    Retry đang executing dưới lease của agent (claimed_until, xem
+    CommandResultConsumer) mà hết lease chưa có outcome cũng được claim và
+    dispatch lại ngay.
+    """
+
+    def __init__(self, batch_size=500, poll_interval=1.0, lookahead=5.0, lease=30.0):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lookahead = timedelta(seconds=lookahead)
+        self.lease = timedelta(seconds=lease)
+
+        self._heap = []
+        self._sequence = itertools.count()
+        self._stop_event = threading.Event()
+
+    def claim_due(self):
+        """Claim một batch commands sắp tới hạn"""
+        now = timezone.now()
+        with transaction.atomic():
+            commands = list(
+                CommandRequest.objects
+                .select_for_update(skip_locked=True)
+                .filter(
+                    Q(status='scheduled', scheduled_at__lte=now + self.lookahead)
+                    & (Q(claimed_until__isnull=True) | Q(claimed_until__lt=now))
+                    | Q(status='executing', claimed_until__lt=now)
+                )
+                .order_by('scheduled_at')[:self.batch_size]
+            )
+            if commands:
+                CommandRequest.objects.filter(
+                    id__in=[command.id for command in commands]
+                ).update(claimed_until=now + self.lease)
+
+        for command in commands:
+            # Retry mất lease: dispatch lại ngay
+            due_at = command.scheduled_at if command.status == 'scheduled' else now
+            heapq.heappush(self._heap, (due_at, next(self._sequence), command))
+            if due_at > now:
+                self.prewarm(command)
+
+        return len(commands)
+
+    def prewarm(self, command):
+        """Báo agent chuẩn bị device context trước khi command tới hạn"""
+        EventPublisher.publish_event(
+            Topics.DEVICE_COMMANDS,
+            EventTypes.DEVICE_COMMAND_PREWARM,
+            {
+                'command_id': str(command.id),
+                'device_id': command.device_id,
+                'command_type': command.command_type,
+                'scheduled_at': command.scheduled_at.isoformat()
+            },
+            key=device_key(command.device_id)
+        )
+
+    def dispatch_due(self):
+        """Dispatch các commands trong heap đã tới hạn"""
+        now = timezone.now()
+        due = []
+        first_due_at = self._heap[0][0] if self._heap else None
+        while self._heap and self._heap[0][0] <= now:
+            due.append(heapq.heappop(self._heap)[2])
+        if not due:
+            return 0
+
+        # Chỉ dispatch các commands vẫn còn 'scheduled' (chưa bị cancel) hoặc
+        # vẫn executing dưới lease (chưa có outcome); commands đã quá deadline
+        # được đánh dấu timeout thay vì dispatch
+        with transaction.atomic():
+            pending_ids = set(
+                CommandRequest.objects
+                .select_for_update()
+                .filter(id__in=[command.id for command in due])
+                .filter(Q(status='scheduled') | Q(status='executing', claimed_until__isnull=False))
+                .values_list('id', flat=True)
+            )
+            expired_ids = {
+                command.id for command in due
+                if command.id in pending_ids and command.deadline and command.deadline <= now
+            }
+            ready_ids = pending_ids - expired_ids
+            CommandRequest.objects.filter(id__in=ready_ids).update(
+                status='queued', claimed_until=None, updated_at=now
+            )
+            CommandRequest.objects.filter(id__in=expired_ids).update(
+                status='timeout', claimed_until=None, updated_at=now
+            )
+        status_cache.update_existing({
+            command_id: {'status': 'timeout' if command_id in expired_ids else 'queued', 'updated_at': now}
+            for command_id in pending_ids
+        })
+
+        for command in due:
+            if command.id in expired_ids:
+                publish_timeout(self.command_data(command), stage='scheduling')
+            if command.id not in ready_ids:
+                continue
+            dispatch_command(self.command_data(command))
+
+        lag = (timezone.now() - first_due_at).total_seconds()
+        print(f"Dispatched {len(ready_ids)} scheduled commands (max jitter {lag:.3f}s)")
+        return len(ready_ids)
+
+    @staticmethod
+    def command_data(command):
+        """Execution event data của một scheduled command"""
+        return {
+            'command_id': str(command.id),
+            'device_id': command.device_id,
+            'command_type': command.command_type,
+            'command_params': command.command_params,
+            'user_id': command.user_id,
+            'max_retries': command.max_retries,
+            # Retry được lưu lại (agent dừng trước khi chạy) giữ số attempt đã dùng
+            'attempt': command.retry_count,
+            'scheduled_at': command.scheduled_at.isoformat(),
+            'created_at': command.created_at.isoformat(),
+            'deadline': command.deadline.isoformat() if command.deadline else None,
+            'priority': command.priority or None
+        }
+
+    def run(self):
+        """Scheduler loop - MUST BLOCK"""
+        next_poll = timezone.now()
+        while not self._stop_event.is_set():
+            now = timezone.now()
+            if now >= next_poll:
+                claimed = self.claim_due()
+                # Batch đầy: còn commands tới hạn, poll lại ngay
+                if claimed < self.batch_size:
+                    next_poll = now + timedelta(seconds=self.poll_interval)
+
+            self.dispatch_due()
+
+            wake_at = next_poll
+            if self._heap:
+                wake_at = min(wake_at, self._heap[0][0])
+            self._stop_event.wait(max(0, (wake_at - timezone.now()).total_seconds()))
+
+    def stop(self):
+        self._stop_event.set()
@@ -13,16 +13,21 @@ class CommandExecutionSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 class CommandRequestSerializer(serializers.ModelSerializer):
-    execution = CommandExecutionSerializer(read_only=True, source='commandexecution_set.first')
+    execution = serializers.SerializerMethodField()
     
     class Meta:
         model = CommandRequest
         fields = [
             'id', 'device_id', 'command_type', 'command_params',
-            'user_id', 'scheduled_at', 'retry_count', 'max_retries',
-            'status', 'created_at', 'updated_at', 'execution'
+            'user_id', 'scheduled_at', 'deadline', 'priority', 'retry_count', 'max_retries',
+            'status', 'superseded_by', 'created_at', 'updated_at', 'execution'
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
+    
+    def get_execution(self, obj):
+        """Execution mới nhất; dùng prefetch 'executions' nếu queryset đã prefetch"""
+        execution = max(obj.executions.all(), key=lambda e: e.completed_at, default=None)
+        return CommandExecutionSerializer(execution).data if execution else None
 
 class CommandRequestCreateSerializer(serializers.ModelSerializer):
     """Serializer for creating command requests"""
@@ -0,0 +1,159 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+
+EXECUTION_SUMMARY_FIELDS = ('agent_id', 'started_at', 'completed_at', 'execution_time', 'result', 'response_data')
+
+def execution_summary(execution):
+    """Execution summary cho status (từ CommandExecution hoặc execution dict trong event)"""
+    if isinstance(execution, dict):
+        return {
+            'execution_id': str(execution.get('id')),
+            **{field: execution.get(field) for field in EXECUTION_SUMMARY_FIELDS},
+        }
+    return {
+        'execution_id': str(execution.id),
+        **{field: getattr(execution, field) for field in EXECUTION_SUMMARY_FIELDS},
+    }
+
+def command_snapshot(command, execution=None):
+    """Status snapshot của một CommandRequest (shape của GET /commands/{id}/status/)"""
+    snapshot = {
+        'command_id': str(command.id),
+        # Owner: dùng để check quyền khi trả snapshot mà không đọc DB
+        'user_id': command.user_id,
+        'status': command.status,
+        'device_id': command.device_id,
+        'command_type': command.command_type,
+        'created_at': command.created_at,
+        'updated_at': command.updated_at,
+    }
+    if command.deadline:
+        snapshot['deadline'] = command.deadline
+    if command.superseded_by_id:
+        snapshot['superseded_by'] = str(command.superseded_by_id)
+    if execution:
+        snapshot['execution'] = execution_summary(execution)
+    return snapshot
+
+class CommandStatusCache:
+    """
+    Latest status + execution summary của commands, hai tầng:
+    - in-process LRU với TTL ngắn: đọc lặp lại trong process không tốn round-trip
+    - shared Django cache (Redis khi có REDIS_URL): dùng chung giữa API,
+      consumers, scheduler và result writer
+
+    Được ghi bởi stage cập nhật status; lỗi của shared cache được coi như
+    cache miss để caller fallback về DB.
+    """
+
+    KEY_PREFIX = 'command-status:'
+
+    def __init__(self, alias='default', ttl=3600, local_size=10000, local_ttl=2):
+        self.alias = alias
+        self.ttl = ttl
+        self.local_size = local_size
+        self.local_ttl = local_ttl
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0, 'errors': 0}
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def key(self, command_id):
+        return f"{self.KEY_PREFIX}{command_id}"
+
+    def _local_get(self, command_id):
+        with self._lock:
+            entry = self._local.get(command_id)
+            if entry is None:
+                return None
+            snapshot, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._local[command_id]
+                return None
+            self._local.move_to_end(command_id)
+            return dict(snapshot)
+
+    def _local_set(self, snapshots):
+        expires_at = time.monotonic() + self.local_ttl
+        with self._lock:
+            for command_id, snapshot in snapshots.items():
+                self._local.pop(command_id, None)
+                self._local[command_id] = (snapshot, expires_at)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+
+    def get(self, command_id):
+        command_id = str(command_id)
+        snapshot = self._local_get(command_id)
+        if snapshot is not None:
+            self._stats['local_hits'] += 1
+            return snapshot
+
+        try:
+            snapshot = self.cache.get(self.key(command_id))
+        except Exception as e:
+            self._stats['errors'] += 1
+            print(f"Command status cache get error: {e}")
+            snapshot = None
+
+        if snapshot is None:
+            self._stats['misses'] += 1
+            return None
+        self._stats['shared_hits'] += 1
+        self._local_set({command_id: snapshot})
+        return dict(snapshot)
+
+    def set(self, command_id, snapshot):
+        self.set_many({str(command_id): snapshot})
+
+    def set_many(self, snapshots):
+        """Ghi snapshots (command_id -> snapshot) vào cả hai tầng"""
+        snapshots = {str(command_id): snapshot for command_id, snapshot in snapshots.items()}
+        if not snapshots:
+            return
+        self._local_set(snapshots)
+        try:
+            self.cache.set_many({self.key(command_id): s for command_id, s in snapshots.items()}, self.ttl)
+        except Exception as e:
+            self._stats['errors'] += 1
+            print(f"Command status cache set error: {e}")
+
+    def update_existing(self, updates):
+        """
+        Merge fields (command_id -> fields) vào snapshots đã có trong shared
+        cache. Commands chưa có trong cache bị bỏ qua - status view sẽ load
+        đầy đủ từ DB.
+        """
+        updates = {str(command_id): fields for command_id, fields in updates.items()}
+        if not updates:
+            return 0
+        try:
+            current = self.cache.get_many([self.key(command_id) for command_id in updates])
+        except Exception as e:
+            self._stats['errors'] += 1
+            print(f"Command status cache get error: {e}")
+            return 0
+
+        merged = {}
+        for command_id, fields in updates.items():
+            snapshot = current.get(self.key(command_id))
+            if snapshot is not None:
+                merged[command_id] = {**snapshot, **fields}
+        self.set_many(merged)
+        return len(merged)
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'local_size': len(self._local)}
+
+status_cache = CommandStatusCache(
+    ttl=settings.COMMAND_STATUS_CACHE_TTL,
+    local_size=settings.COMMAND_STATUS_LOCAL_CACHE_SIZE,
+    local_ttl=settings.COMMAND_STATUS_LOCAL_CACHE_TTL
+)
@@ -0,0 +1,248 @@
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.utils import timezone
+from shared.kafka import kafka_service
+from shared.kafka.topics import Topics, EventTypes
+from commands.models import CommandBatch
+from commands.status_cache import execution_summary
+
+class CommandStatusHub:
+    """
+    Status snapshot của commands trong process, fed bởi một subscription
+    duy nhất vào COMMAND_RESULTS và fan-out tới mọi client đang chờ
+    (SSE stream / long-poll).
+
+    Mỗi snapshot có `version` tăng dần; client chờ version khác version đã
+    thấy. Mỗi command có Condition riêng nên một event chỉ đánh thức các
+    clients của command đó.
+    """
+
+    STATUS_BY_EVENT = {
+        EventTypes.DEVICE_COMMAND_STARTED: 'executing',
+        EventTypes.DEVICE_COMMAND_RETRY_SCHEDULED: 'scheduled',
+        EventTypes.DEVICE_COMMAND_COMPLETED: 'completed',
+        EventTypes.DEVICE_COMMAND_FAILED: 'failed',
+        EventTypes.DEVICE_COMMAND_SUPERSEDED: 'superseded',
+        EventTypes.DEVICE_COMMAND_TIMEOUT: 'timeout',
+    }
+
+    # Thử lại subscription sau khoảng này nếu Kafka chưa sẵn sàng
+    START_RETRY_INTERVAL = 30
+
+    def __init__(self, max_entries=10000, ttl=600, seed_ttl=10, max_waiters=0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.seed_ttl = seed_ttl
+        # Số SSE streams / long-polls đồng thời của process (0 = không giới hạn)
+        self.max_waiters = max_waiters
+        # Mỗi web process nhận tất cả results (broadcast), chỉ cần events mới
+        self.group_id = f'command-status-hub-{socket.gethostname()}-{os.getpid()}'
+
+        self._entries = OrderedDict()
+        self._conditions = {}
+        self._lock = threading.Lock()
+        self._version = 0
+        self._started = False
+        self._next_start = 0
+        self._waiters = 0
+        self._stats = {'hits': 0, 'misses': 0, 'events': 0, 'waiting': 0, 'rejected_waiters': 0}
+
+    def start(self):
+        """
+        Start Kafka subscription một lần cho mỗi process. Trả về False nếu
+        không subscribe được - khi đó snapshots sẽ không được cập nhật nên
+        caller phải đọc status từ DB.
+        """
+        if self._started:
+            return True
+        if time.monotonic() < self._next_start:
+            return False
+        with self._lock:
+            if not self._started and time.monotonic() >= self._next_start:
+                self._next_start = time.monotonic() + self.START_RETRY_INTERVAL
+                self._started = bool(kafka_service.create_consumer(
+                    topics=[Topics.COMMAND_RESULTS],
+                    group_id=self.group_id,
+                    message_handler=self.handle_event,
+                    offset_reset='latest'
+                ))
+        return self._started
+
+    def stop(self):
+        kafka_service.stop_consumer(self.group_id)
+        self._started = False
+
+    def handle_event(self, message):
+        try:
+            event_type = message.get('event_type')
+            data = message.get('data', {})
+            command_id = data.get('command_id')
+            status = data.get('status') or self.STATUS_BY_EVENT.get(event_type)
+            if not command_id or not status:
+                return
+
+            fields = {
+                key: data[key] for key in ('device_id', 'command_type', 'superseded_by') if data.get(key)
+            }
+            execution = data.get('execution')
+            if execution:
+                fields['execution'] = execution_summary(execution)
+            self._stats['events'] += 1
+            self.publish(command_id, status, **fields)
+        except Exception as e:
+            print(f"Error processing command status event: {e}")
+
+    def publish(self, command_id, status, **fields):
+        """
+        Cập nhật snapshot đã seed và đánh thức các clients đang chờ command này.
+
+        Event của command chưa có snapshot không tạo entry (thiếu các fields
+        từ DB và đẩy các entries đang được dùng ra khỏi hub); clients đang
+        chờ command đó (snapshot vừa hết hạn) được đánh thức để load lại.
+        """
+        command_id = str(command_id)
+        with self._lock:
+            snapshot = self._get(command_id)
+            if snapshot is None:
+                self._notify(command_id)
+                return
+            del self._entries[command_id]
+            snapshot.update(fields)
+            self._store(command_id, snapshot, status)
+
+    def seed(self, command_id, snapshot):
+        """
+        Snapshot load từ DB khi hub chưa biết command. Không ghi đè nếu
+        event mới hơn đã tới trong lúc đọc DB.
+
+        Snapshot chưa final chỉ được giữ `seed_ttl` giây (trừ khi có event
+        cập nhật): event có thể đã bị lỡ trước khi subscription được assign.
+        """
+        command_id = str(command_id)
+        with self._lock:
+            current = self._get(command_id)
+            if current is not None:
+                return current
+            status = snapshot['status']
+            ttl = self.ttl if status in CommandBatch.FINISHED_STATUSES else self.seed_ttl
+            self._store(command_id, {**snapshot, 'command_id': command_id}, status, ttl)
+            return self._get(command_id)
+
+    def _store(self, command_id, snapshot, status, ttl=None):
+        """Caller giữ lock"""
+        self._version += 1
+        snapshot.update({
+            'status': status,
+            'version': self._version,
+            'updated_at': timezone.now(),
+        })
+        self._entries[command_id] = (snapshot, time.monotonic() + (ttl or self.ttl))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._notify(command_id)
+
+    def _notify(self, command_id):
+        """Caller giữ lock"""
+        condition = self._conditions.get(command_id)
+        if condition is not None:
+            condition[0].notify_all()
+
+    def _get(self, command_id):
+        """Caller giữ lock"""
+        entry = self._entries.get(command_id)
+        if entry is None:
+            return None
+        snapshot, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[command_id]
+            return None
+        return dict(snapshot)
+
+    def get(self, command_id):
+        with self._lock:
+            snapshot = self._get(str(command_id))
+            self._stats['hits' if snapshot else 'misses'] += 1
+            return snapshot
+
+    def wait_for_change(self, command_id, version, timeout):
+        """
+        Block tới khi snapshot có version khác `version` hoặc hết timeout.
+        Trả về snapshot hiện tại (có thể không đổi nếu timeout), None nếu
+        snapshot đã hết hạn - caller load lại status.
+        """
+        command_id = str(command_id)
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            condition = self._conditions.get(command_id)
+            if condition is None:
+                condition = self._conditions[command_id] = [threading.Condition(self._lock), 0]
+            condition[1] += 1
+            self._stats['waiting'] += 1
+            try:
+                while True:
+                    snapshot = self._get(command_id)
+                    remaining = deadline - time.monotonic()
+                    if snapshot is None or snapshot['version'] != version or remaining <= 0:
+                        return snapshot
+                    condition[0].wait(remaining)
+            finally:
+                condition[1] -= 1
+                self._stats['waiting'] -= 1
+                if condition[1] == 0:
+                    self._conditions.pop(command_id, None)
+
+    def acquire_waiter(self):
+        """
+        Giữ một waiter slot cho SSE stream / long-poll (client giữ một worker
+        thread tới khi xong). False nếu process đã có max_waiters clients.
+        """
+        with self._lock:
+            if self.max_waiters and self._waiters >= self.max_waiters:
+                self._stats['rejected_waiters'] += 1
+                return False
+            self._waiters += 1
+            return True
+
+    def release_waiter(self):
+        with self._lock:
+            self._waiters -= 1
+
+    @staticmethod
+    def is_final(snapshot):
+        return snapshot['status'] in CommandBatch.FINISHED_STATUSES
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'waiters': self._waiters, 'size': len(self._entries), 'started': self._started}
+
+class WaiterStream:
+    """
+    Streaming content của SSE response giữ một waiter slot của hub. Django
+    close response (cả khi client ngắt trước khi stream bắt đầu) nên slot
+    luôn được trả.
+    """
+
+    def __init__(self, hub, events):
+        self.hub = hub
+        self.events = events
+        self._released = False
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def close(self):
+        self.events.close()
+        if not self._released:
+            self._released = True
+            self.hub.release_waiter()
+
+status_hub = CommandStatusHub(
+    max_entries=settings.COMMAND_STATUS_HUB_SIZE,
+    ttl=settings.COMMAND_STATUS_HUB_TTL,
+    seed_ttl=settings.COMMAND_STATUS_SEED_TTL,
+    max_waiters=settings.COMMAND_STATUS_MAX_WAITERS
+)
@@ -0,0 +1,48 @@
+import os
+import shutil
+from django.utils.module_loading import import_string
+
+class LocalFileStorage:
+    """Files trên local filesystem (hoặc volume mount); names dùng '/' làm separator"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, name):
+        return os.path.join(self.root, *name.split('/'))
+
+    def _open_for_write(self, name):
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path, f"{path}.tmp"
+
+    def write(self, name, data):
+        """Ghi atomic: file tạm rồi rename"""
+        path, tmp_path = self._open_for_write(name)
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def write_file(self, name, fileobj):
+        """Như write() nhưng copy từ file object theo chunks"""
+        path, tmp_path = self._open_for_write(name)
+        with open(tmp_path, 'wb') as f:
+            shutil.copyfileobj(fileobj, f)
+        os.replace(tmp_path, path)
+
+    def read(self, name):
+        with open(self._path(name), 'rb') as f:
+            return f.read()
+
+    def exists(self, name):
+        return os.path.exists(self._path(name))
+
+    def listdir(self, prefix=''):
+        path = self._path(prefix) if prefix else self.root
+        if not os.path.isdir(path):
+            return []
+        return sorted(os.listdir(path))
+
+def load_storage(backend, root):
+    """Khởi tạo storage backend từ dotted path (pluggable qua settings)"""
+    return import_string(backend)(root=root)
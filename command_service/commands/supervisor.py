@@ -0,0 +1,321 @@
+import multiprocessing
+import signal
+import sys
+import threading
+import time
+from shared.kafka import metrics_aggregator
+
+# agent_type -> agent class (import trong worker process sau django.setup())
+AGENT_CLASSES = {
+    'device': 'commands.agents.device_command_agent.DeviceCommandAgent',
+    'test': 'commands.agents.api_test_agent.APITestAgent',
+}
+
+class WorkerSpec:
+    """
+    Mô tả một agent worker: tên (agent_id), loại agent và kwargs cho agent.
+    agent_class (dotted path) thay class mặc định của agent_type.
+    """
+
+    def __init__(self, name, agent_type, options=None, agent_class=None):
+        if agent_class is None and agent_type not in AGENT_CLASSES:
+            raise ValueError(f"Unknown agent type: {agent_type}")
+        self.name = name
+        self.agent_type = agent_type
+        self.options = options or {}
+        self.agent_class = agent_class or AGENT_CLASSES[agent_type]
+
+def run_worker(spec, heartbeat, latency, stop_event, heartbeat_interval):
+    """
+    Entry point của worker process. Mỗi worker chạy một agent với Kafka
+    consumer, gRPC channel và event loop riêng; heartbeat chỉ được ghi
+    khi agent báo healthy. Handler latency (nếu agent có) được báo cùng
+    heartbeat cho autoscaler.
+    """
+    import django
+    django.setup()
+    from django.utils.module_loading import import_string
+
+    # Supervisor điều phối shutdown: Ctrl-C gửi SIGINT tới cả process group
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+
+    agent = import_string(spec.agent_class)(agent_id=spec.name, **spec.options)
+    thread = threading.Thread(target=agent.start_consumer, name=f"agent-{spec.name}", daemon=True)
+    thread.start()
+
+    exit_code = 0
+    while not stop_event.is_set():
+        if not thread.is_alive():
+            print(f"Agent worker {spec.name} consumer exited")
+            exit_code = 1
+            break
+        if agent.is_healthy():
+            heartbeat.value = time.monotonic()
+            if hasattr(agent, 'handler_latency_ms'):
+                latency.value = agent.handler_latency_ms() or 0.0
+        stop_event.wait(heartbeat_interval)
+
+    agent.stop()
+    sys.exit(exit_code)
+
+class WorkerProcess:
+    """Một process đang chạy của worker slot"""
+
+    def __init__(self, process, heartbeat, latency, stop_event):
+        self.process = process
+        self.heartbeat = heartbeat
+        self.latency = latency
+        self.stop_event = stop_event
+        self.started_at = time.monotonic()
+        self.stopping_since = None
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def last_heartbeat(self):
+        return self.heartbeat.value or None
+
+    def latency_ms(self):
+        return self.latency.value or None
+
+    def stop(self):
+        """Yêu cầu worker dừng (agent drain in-flight commands)"""
+        if self.stopping_since is None:
+            self.stopping_since = time.monotonic()
+            self.stop_event.set()
+
+class WorkerSlot:
+    """Vị trí của một worker trong supervisor (giữ qua các lần restart)"""
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.current = None
+        self.failures = 0
+        self.restart_at = 0
+
+class AgentSupervisor:
+    """
+    Prefork supervisor cho command agents.
+
+    Mỗi agent chạy trong process riêng (spawn) nên CPU work của các agents
+    không tranh GIL. Supervisor:
+    - theo dõi heartbeat của từng worker; worker không heartbeat trong
+      `heartbeat_timeout` (hoặc chưa healthy sau `startup_timeout`) bị stop
+    - restart worker đã chết với exponential backoff; backoff reset khi
+      worker chạy ổn định được `stable_after` giây
+    - rolling restart (SIGHUP): lần lượt start worker mới, chờ nó healthy
+      rồi mới stop worker cũ, nên capacity không giảm
+    - autoscalers (tuỳ chọn): thay đổi số workers của một agent type theo
+      consumer lag/latency; worker bị scale down được drain trước khi dừng
+    """
+
+    def __init__(self, specs, heartbeat_interval=5, heartbeat_timeout=30, startup_timeout=60,
+                 stop_timeout=45, backoff_base=1, backoff_max=60, stable_after=60, autoscalers=None):
+        self.slots = [WorkerSlot(spec) for spec in specs]
+        self.retiring = []
+        self.autoscalers = autoscalers or []
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.startup_timeout = startup_timeout
+        self.stop_timeout = stop_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stable_after = stable_after
+
+        self.ctx = multiprocessing.get_context('spawn')
+        self.running = False
+        self._rolling_restart_requested = False
+
+    def spawn(self, spec):
+        heartbeat = self.ctx.Value('d', 0.0, lock=False)
+        latency = self.ctx.Value('d', 0.0, lock=False)
+        stop_event = self.ctx.Event()
+        process = self.ctx.Process(
+            target=run_worker,
+            args=(spec, heartbeat, latency, stop_event, self.heartbeat_interval),
+            name=f"agent-{spec.name}"
+        )
+        process.start()
+        print(f"Agent supervisor started worker {spec.name} (pid {process.pid})")
+        return WorkerProcess(process, heartbeat, latency, stop_event)
+
+    def run(self):
+        """Start tất cả workers và supervise tới khi stop()"""
+        self.running = True
+        for slot in self.slots:
+            slot.current = self.spawn(slot.spec)
+
+        while self.running:
+            if self._rolling_restart_requested:
+                self._rolling_restart_requested = False
+                self.rolling_restart()
+            self.check_workers()
+            for autoscaler in self.autoscalers:
+                autoscaler.check(self)
+            time.sleep(1)
+
+        self.shutdown()
+
+    def stop(self):
+        self.running = False
+
+    def request_rolling_restart(self):
+        """An toàn để gọi từ signal handler; thực hiện trong supervise loop"""
+        self._rolling_restart_requested = True
+
+    def worker_count(self, agent_type):
+        return sum(1 for slot in self.slots if slot.spec.agent_type == agent_type)
+
+    def handler_latency_ms(self, agent_type):
+        """Latency trung bình của các workers đang chạy (None nếu chưa có số liệu)"""
+        values = [
+            slot.current.latency_ms() for slot in self.slots
+            if slot.spec.agent_type == agent_type and slot.current is not None
+        ]
+        values = [value for value in values if value]
+        return sum(values) / len(values) if values else None
+
+    def scale(self, agent_type, count):
+        """
+        Đưa số workers của agent_type về `count`. Workers mới dùng options của
+        worker hiện có cùng type; scale down dừng các workers mới nhất trước.
+        """
+        slots = [slot for slot in self.slots if slot.spec.agent_type == agent_type]
+        if not slots:
+            raise ValueError(f"No workers of type {agent_type} to scale")
+
+        if count > len(slots):
+            used = {slot.spec.name for slot in self.slots}
+            index = 0
+            for _ in range(count - len(slots)):
+                while f"{agent_type}-{index}" in used:
+                    index += 1
+                spec = WorkerSpec(f"{agent_type}-{index}", agent_type, slots[0].spec.options, slots[0].spec.agent_class)
+                used.add(spec.name)
+                slot = WorkerSlot(spec)
+                slot.current = self.spawn(spec)
+                self.slots.append(slot)
+        else:
+            for slot in slots[count:]:
+                self.slots.remove(slot)
+                if slot.current is not None:
+                    print(f"Agent supervisor retiring worker {slot.spec.name} (pid {slot.current.pid})")
+                    slot.current.stop()
+                    self.retiring.append(slot.current)
+
+        metrics_aggregator.set_gauge('agent_workers', count, agent_type=agent_type)
+
+    def check_workers(self, exclude=None):
+        now = time.monotonic()
+        for worker in list(self.retiring):
+            if not worker.process.is_alive():
+                worker.process.join()
+                self.retiring.remove(worker)
+            elif now - worker.stopping_since > self.stop_timeout:
+                print(f"Agent worker {worker.process.name} (pid {worker.pid}) did not stop, killing")
+                worker.process.kill()
+
+        for slot in self.slots:
+            if slot is exclude:
+                continue
+            worker = slot.current
+
+            if worker is None:
+                if self.running and now >= slot.restart_at:
+                    slot.current = self.spawn(slot.spec)
+                continue
+
+            if not worker.process.is_alive():
+                worker.process.join()
+                slot.current = None
+                if worker.stopping_since is not None and not self.running:
+                    continue
+                slot.failures += 1
+                delay = min(self.backoff_base * 2 ** (slot.failures - 1), self.backoff_max)
+                slot.restart_at = now + delay
+                print(f"Agent worker {slot.spec.name} (pid {worker.pid}) exited with code "
+                      f"{worker.process.exitcode}, restarting in {delay:g}s")
+                continue
+
+            if worker.stopping_since is not None:
+                # Worker không dừng kịp (drain bị treo): kill
+                if now - worker.stopping_since > self.stop_timeout:
+                    print(f"Agent worker {slot.spec.name} (pid {worker.pid}) did not stop, killing")
+                    worker.process.kill()
+                continue
+
+            last_heartbeat = worker.last_heartbeat()
+            if last_heartbeat is None:
+                if now - worker.started_at > self.startup_timeout:
+                    print(f"Agent worker {slot.spec.name} (pid {worker.pid}) not healthy after "
+                          f"{self.startup_timeout}s, stopping")
+                    worker.stop()
+            elif now - last_heartbeat > self.heartbeat_timeout:
+                print(f"Agent worker {slot.spec.name} (pid {worker.pid}) missed heartbeats "
+                      f"for {now - last_heartbeat:.0f}s, stopping")
+                worker.stop()
+            elif slot.failures and now - worker.started_at > self.stable_after:
+                slot.failures = 0
+
+    def rolling_restart(self):
+        """Thay lần lượt từng worker: worker mới healthy rồi mới stop worker cũ"""
+        print("Agent supervisor rolling restart")
+        for slot in list(self.slots):
+            if not self.running:
+                return
+            old = slot.current
+            replacement = self.spawn(slot.spec)
+
+            deadline = time.monotonic() + self.startup_timeout
+            while self.running and replacement.process.is_alive() and replacement.last_heartbeat() is None:
+                if time.monotonic() > deadline:
+                    break
+                self.check_workers(exclude=slot)
+                time.sleep(0.5)
+
+            if replacement.last_heartbeat() is None:
+                print(f"Agent worker {slot.spec.name} replacement not healthy, aborting rolling restart")
+                self._stop_and_wait([replacement])
+                return
+
+            slot.current = replacement
+            if old is not None:
+                self._stop_and_wait([old])
+        print("Agent supervisor rolling restart completed")
+
+    def shutdown(self):
+        """Stop tất cả workers, kill các worker không dừng trong stop_timeout"""
+        workers = [slot.current for slot in self.slots if slot.current is not None] + self.retiring
+        self._stop_and_wait(workers)
+        for slot in self.slots:
+            slot.current = None
+        self.retiring = []
+        print("Agent supervisor stopped")
+
+    def _stop_and_wait(self, workers):
+        for worker in workers:
+            worker.stop()
+        deadline = time.monotonic() + self.stop_timeout
+        for worker in workers:
+            worker.process.join(max(deadline - time.monotonic(), 0))
+            if worker.process.is_alive():
+                print(f"Agent worker {worker.process.name} (pid {worker.pid}) did not stop, killing")
+                worker.process.kill()
+                worker.process.join()
+
+    def stats(self):
+        now = time.monotonic()
+        workers = {}
+        for slot in self.slots:
+            worker = slot.current
+            last_heartbeat = worker.last_heartbeat() if worker else None
+            workers[slot.spec.name] = {
+                'pid': worker.pid if worker else None,
+                'alive': bool(worker and worker.process.is_alive()),
+                'heartbeat_age': round(now - last_heartbeat, 1) if last_heartbeat else None,
+                'latency_ms': worker.latency_ms() if worker else None,
+                'failures': slot.failures,
+            }
+        return workers
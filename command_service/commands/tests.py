@@ -0,0 +1,1874 @@
+import asyncio
+import http.client
+import io
+import json
+import multiprocessing
+import os
+import signal
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock, skipUnless
+import requests
+import urllib3
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import OperationalError, close_old_connections, connection, connections, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+from shared.kafka.metrics import LATENCY_BUCKETS_MS, LatencyHistogram, MetricsAggregator
+from shared.kafka.service import KafkaService, TopicPartition
+from shared.kafka.topics import EventTypes
+from commands.agents.device_command_agent import DeviceCommandAgent
+from commands.agents.device_queues import DeviceCommandQueues
+from commands.agents.execution_engine import AsyncExecutionEngine
+from commands.autoscaling import Autoscaler, LagSource, LocalLagSource, ScalingPolicy
+from commands.archive import CommandArchiver
+from commands.blob_store import BlobStore
+from commands.circuit_breaker import CIRCUIT_OPEN, CircuitBreakerRegistry
+from commands.consumers.command_result_consumer import CommandResultConsumer
+from commands.consumers.context_invalidation_consumer import ContextInvalidationConsumer
+from commands.context_cache import CommandContextCache
+from commands.idempotency import IdempotencyConflict, IdempotencyStore, request_fingerprint
+from commands.models import CommandBatch, CommandExecution, CommandRequest
+from commands.partitioning import PARTITIONED_TABLES, is_partitioned, partition_name, plan_relations
+from commands.status_cache import status_cache
+from commands.status_hub import CommandStatusHub, status_hub
+from commands.views import CommandRequestViewSet
+from commands.storage import LocalFileStorage
+from commands.protocol_handlers import AsyncHTTPHandler
+from commands.protocol_handlers.async_http_handler import AIOHTTP_AVAILABLE
+from commands.protocol_handlers.execution_plan import ExecutionPlanCache, compile_plan, plan_key
+from commands.protocol_handlers.http_handler import CONNECTION_ERROR, TIMEOUT, HTTPHandler
+from commands.protocol_handlers.response_capture import ResponseCapture
+from commands.protocol_handlers.session_manager import SessionManager
+from commands.protocol_handlers.template_renderer import TemplateRenderer
+from commands.rate_limit import LocalTokenBucket, RateLimited, RateLimiter, RedisTokenBucket
+from commands.retry import is_retryable
+from commands.scheduler import CommandScheduler
+from commands.supervisor import AgentSupervisor, WorkerSpec
+from commands.write_behind import WriteBehindBuffer
+from command_service.management.commands.benchmark_templates import DEMO_TEMPLATES, RegexTemplateRenderer
+
+class MetricsAggregatorTests(SimpleTestCase):
+    def setUp(self):
+        self.aggregator = MetricsAggregator(flush_interval=3600, command_scope='vendor', event_sample_rate=0)
+        self.addCleanup(self.aggregator._stop_event.set)
+
+    def test_counters_and_gauges_are_aggregated_per_label_set(self):
+        self.aggregator.increment('throttled', command_type='turn_on')
+        self.aggregator.increment('throttled', 2, command_type='turn_on')
+        self.aggregator.increment('throttled', command_type='zoom')
+        self.aggregator.increment('consumed', lane='high')
+        self.aggregator.set_gauge('lag', 10, lane='high')
+        self.aggregator.set_gauge('lag', 4, lane='high')
+        self.aggregator.set_gauge('lag', 7, lane='low')
+
+        summary = self.aggregator.snapshot()
+        counters = {(c['name'], tuple(c['labels'].items())): c['value'] for c in summary['counters']}
+        self.assertEqual(counters, {
+            ('throttled', (('command_type', 'turn_on'),)): 3,
+            ('throttled', (('command_type', 'zoom'),)): 1,
+            ('consumed', (('lane', 'high'),)): 1,
+        })
+        gauges = {g['labels']['lane']: g['value'] for g in summary['gauges']}
+        self.assertEqual(gauges, {'high': 4, 'low': 7})
+
+    def test_commands_are_grouped_by_type_and_scope(self):
+        self.aggregator.record_command('turn_on', True, 0.02, device_id='d1', vendor_id='v1')
+        self.aggregator.record_command('turn_on', False, 0.2, device_id='d2', vendor_id='v1')
+        # Không có vendor: gom theo device
+        self.aggregator.record_command('turn_on', True, 0.01, device_id='d3')
+
+        commands = {(c['scope'], c['scope_id']): c for c in self.aggregator.snapshot()['commands']}
+        self.assertEqual(set(commands), {('vendor', 'v1'), ('device', 'd3')})
+        self.assertEqual((commands['vendor', 'v1']['success'], commands['vendor', 'v1']['failure']), (1, 1))
+        self.assertEqual(commands['vendor', 'v1']['latency']['count'], 2)
+
+    def test_histogram_buckets_and_quantiles(self):
+        histogram = LatencyHistogram()
+        for value in [3] * 50 + [40] * 45 + [700] * 5:
+            histogram.observe(value)
+        summary = histogram.to_dict()
+
+        self.assertEqual(summary['bounds_ms'], list(LATENCY_BUCKETS_MS))
+        self.assertEqual(summary['buckets'][LATENCY_BUCKETS_MS.index(5)], 50)
+        self.assertEqual(summary['buckets'][LATENCY_BUCKETS_MS.index(50)], 45)
+        self.assertEqual(summary['buckets'][LATENCY_BUCKETS_MS.index(1000)], 5)
+        self.assertEqual((summary['count'], summary['min_ms'], summary['max_ms']), (100, 3, 700))
+        # Quantile nằm trong bucket chứa rank và trong [min, max]
+        self.assertTrue(3 <= summary['p50_ms'] <= 5)
+        self.assertTrue(25 < summary['p95_ms'] <= 50)
+        self.assertTrue(500 < summary['p99_ms'] <= 700)
+
+        overflow = LatencyHistogram()
+        overflow.observe(45000)
+        self.assertEqual(overflow.buckets[-1], 1)
+        self.assertEqual(overflow.quantile(0.99), 45000)
+        self.assertIsNone(LatencyHistogram().quantile(0.5))
+
+    def test_sampling_rate(self):
+        self.assertFalse(any(self.aggregator.should_sample() for _ in range(1000)))
+        self.assertTrue(all(self.aggregator.should_sample(1.0) for _ in range(1000)))
+        with mock.patch('shared.kafka.metrics.random.random', side_effect=[0.05, 0.15] * 500):
+            sampled = sum(self.aggregator.should_sample(0.1) for _ in range(1000))
+        self.assertEqual(sampled, 500)
+
+    def test_flush_publishes_summary_and_resets_window(self):
+        self.aggregator.increment('consumed', lane='high')
+        self.aggregator.record_command('turn_on', True, 0.02, vendor_id='v1')
+        self.aggregator.set_gauge('lag', 3)
+        with mock.patch('shared.kafka.metrics.kafka_service') as kafka:
+            self.aggregator.flush()
+            window_end = kafka.send_event.call_args[1]['data']['window_end']
+            self.assertEqual(kafka.send_event.call_args[1]['event_type'], EventTypes.METRICS_SUMMARY)
+
+            summary = self.aggregator.snapshot()
+            # Counters / commands về 0, gauge giữ giá trị cuối
+            self.assertEqual((summary['counters'], summary['commands']), ([], []))
+            self.assertEqual([g['value'] for g in summary['gauges']], [3])
+            self.assertEqual(summary['window_start'], window_end)
+
+class BlobStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.store = BlobStore(LocalFileStorage(tempfile.mkdtemp()))
+
+    def test_offloaded_body_ref_is_in_metadata(self):
+        capture = ResponseCapture(inline_bytes=10)
+        capture.feed(b'x' * 100)
+        response, meta = capture.finish(self.store)
+        self.assertNotIn('blob', response)
+        self.assertEqual(self.store.get(meta['response_blob']), b'x' * 100)
+
+    def test_inline_body_is_not_a_reference(self):
+        capture = ResponseCapture()
+        capture.feed(b'{"blob": "sha256:../../etc/passwd"}')
+        response, meta = capture.finish(self.store)
+        self.assertEqual(response, {'blob': 'sha256:../../etc/passwd'})
+        self.assertNotIn('response_blob', meta)
+
+    def test_rejects_invalid_refs(self):
+        for ref in ('sha256:../../../../etc/passwd', 'sha256:' + 'A' * 64, 'md5:' + 'a' * 64, None):
+            with self.assertRaises(ValueError):
+                self.store.get(ref)
+
+class FakeMessage:
+    def __init__(self, topic, partition, offset):
+        self._topic, self._partition, self._offset = topic, partition, offset
+
+    def error(self):
+        return None
+
+    def topic(self):
+        return self._topic
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def value(self):
+        return json.dumps({'lane': self._topic, 'offset': self._offset}).encode()
+
+class FakeConsumer:
+    """Một consumer subscribe mọi lanes; consume() trả về messages theo thứ tự produce"""
+
+    def __init__(self, backlog):
+        self.backlog = list(backlog)
+        self.paused = set()
+        self.stored = []
+
+    def assignment(self):
+        return [TopicPartition(topic, 0) for topic in {msg.topic() for msg in self.backlog} | self.paused]
+
+    def pause(self, partitions):
+        self.paused |= {partition.topic for partition in partitions}
+
+    def resume(self, partitions):
+        self.paused -= {partition.topic for partition in partitions}
+
+    def consume(self, num_messages, timeout):
+        out = [msg for msg in self.backlog if msg.topic() not in self.paused][:num_messages]
+        for msg in out:
+            self.backlog.remove(msg)
+        return out
+
+    def store_offsets(self, message=None, offsets=None):
+        if message is not None:
+            self.stored.append((message.topic(), message._offset))
+        for partition in offsets or []:
+            # Offset được commit là offset kế tiếp cần đọc
+            self.stored.append((partition.topic, partition.offset - 1))
+
+    def close(self):
+        pass
+
+class WeightedConsumerTests(SimpleTestCase):
+    def run_loop(self, backlog, limit, buffer_size=50):
+        service = KafkaService.__new__(KafkaService)
+        consumer = FakeConsumer(backlog)
+        handled = []
+
+        def handler(message):
+            handled.append(message)
+            if len(handled) >= limit:
+                info['active'] = False
+
+        info = {
+            'consumer': consumer, 'handler': handler, 'active': True, 'paused': set(),
+            'lanes': [('high', 8), ('normal', 3), ('low', 1)],
+            'buffers': {'high': deque(), 'normal': deque(), 'low': deque()},
+        }
+        service.consumers = {'lanes': info}
+        service._weighted_consumer_loop('lanes', 0.01, buffer_size)
+        return handled, consumer
+
+    def test_weights_split_throughput_when_all_lanes_have_backlog(self):
+        # Low lane produce trước: pause lane đầy để đọc được các lanes khác
+        backlog = [FakeMessage(lane, 0, i) for lane in ('low', 'normal', 'high') for i in range(1000)]
+        handled, _ = self.run_loop(backlog, 600)
+        counts = Counter(message['lane'] for message in handled)
+        # ~8:3:1 (vòng đầu chỉ lane low đã được fetch)
+        self.assertAlmostEqual(counts['high'], 400, delta=5)
+        self.assertAlmostEqual(counts['normal'], 150, delta=5)
+        self.assertAlmostEqual(counts['low'], 50, delta=5)
+
+    def test_empty_lanes_do_not_starve_others(self):
+        backlog = [FakeMessage('normal', 0, i) for i in range(10)] + [FakeMessage('low', 0, i) for i in range(100)]
+        handled, consumer = self.run_loop(backlog, 110)
+        self.assertEqual(Counter(message['lane'] for message in handled), {'normal': 10, 'low': 100})
+        # Thứ tự trong lane giữ nguyên, offset store sau khi xử lý
+        self.assertEqual([m['offset'] for m in handled if m['lane'] == 'low'], list(range(100)))
+        self.assertEqual(len(consumer.stored), 110)
+
+    def test_manual_ack_stores_only_contiguous_acked_offsets(self):
+        service = KafkaService.__new__(KafkaService)
+        consumer = FakeConsumer([])
+        info = {'consumer': consumer, 'in_flight': {}, 'ack_lock': threading.Lock()}
+        acks = {}
+
+        def handler(message, ack):
+            acks[message['offset']] = ack
+
+        for offset in range(4):
+            service._process_acked_message(info, FakeMessage('normal', 0, offset), handler)
+
+        # Command 1 xong trước command 0 (device khác): chưa được commit
+        acks[1]()
+        service._store_acked(info)
+        self.assertEqual(consumer.stored, [])
+
+        acks[0]()
+        acks[0]()
+        service._store_acked(info)
+        self.assertEqual(consumer.stored, [('normal', 1)])
+
+        acks[3]()
+        acks[2]()
+        service._store_acked(info)
+        self.assertEqual(consumer.stored, [('normal', 1), ('normal', 3)])
+
+    def test_manual_ack_handler_error_does_not_block_partition(self):
+        service = KafkaService.__new__(KafkaService)
+        consumer = FakeConsumer([])
+        info = {'consumer': consumer, 'in_flight': {}, 'ack_lock': threading.Lock()}
+
+        def handler(message, ack):
+            raise ValueError('bad message')
+
+        service._process_acked_message(info, FakeMessage('normal', 0, 0), handler)
+        service._store_acked(info)
+        self.assertEqual(consumer.stored, [('normal', 0)])
+
+class StatusAccessTests(TestCase):
+    class User:
+        is_authenticated = True
+
+        def __init__(self, user_id, role):
+            self.id, self.role = user_id, role
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.status_view = CommandRequestViewSet.as_view({'get': 'status'}, **CommandRequestViewSet.status.kwargs)
+        self.command = CommandRequest.objects.create(device_id='dev-1', command_type='turn_on', user_id='owner')
+
+    def get_status(self, user_id, role='operator'):
+        request = self.factory.get(f'/commands/{self.command.id}/status/')
+        force_authenticate(request, user=self.User(user_id, role))
+        return self.status_view(request, pk=str(self.command.id))
+
+    def test_cached_snapshot_is_only_returned_to_owner_or_admin(self):
+        self.assertEqual(self.get_status('owner').status_code, 200)
+        # Snapshot giờ nằm trong status cache: vẫn phải check owner
+        self.assertIsNotNone(status_cache.get(self.command.id))
+        self.assertEqual(self.get_status('someone-else').status_code, 404)
+        self.assertEqual(self.get_status('admin-user', role='admin').status_code, 200)
+
+    def test_hub_snapshot_is_only_returned_to_owner_or_admin(self):
+        with mock.patch.object(status_hub, 'start', return_value=True):
+            self.assertEqual(self.get_status('owner').status_code, 200)
+            self.assertIsNotNone(status_hub.get(self.command.id))
+            self.assertEqual(self.get_status('someone-else').status_code, 404)
+            self.assertEqual(self.get_status('admin-user', role='admin').status_code, 200)
+
+class StatusWaiterLimitTests(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.command = CommandRequest.objects.create(device_id='dev-1', command_type='turn_on', user_id='owner')
+        for patcher in (mock.patch.object(status_hub, 'start', return_value=True),
+                        mock.patch.object(status_hub, 'max_waiters', 1)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # response.close() gửi request_finished: giữ DB connection của test như test Client
+        request_finished.disconnect(close_old_connections)
+        self.addCleanup(request_finished.connect, close_old_connections)
+
+    def get(self, action, **params):
+        view = CommandRequestViewSet.as_view({'get': action}, **getattr(CommandRequestViewSet, action).kwargs)
+        request = self.factory.get(f'/commands/{self.command.id}/{action}/', params)
+        force_authenticate(request, user=StatusAccessTests.User('owner', 'operator'))
+        return view(request, pk=str(self.command.id))
+
+    def test_waiters_beyond_cap_get_503_with_retry_after(self):
+        stream = self.get('stream')
+        self.assertEqual(stream.status_code, 200)
+        self.assertEqual(status_hub.stats()['waiters'], 1)
+
+        for response in (self.get('stream'), self.get('status', wait=5)):
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], str(settings.COMMAND_STATUS_BUSY_RETRY_AFTER))
+        # Không long-poll thì không cần slot
+        self.assertEqual(self.get('status').status_code, 200)
+
+        # Client ngắt trước khi stream bắt đầu: Django close response, slot được trả
+        stream.close()
+        self.assertEqual(status_hub.stats()['waiters'], 0)
+        self.assertEqual(self.get('stream').status_code, 200)
+
+    def test_long_poll_releases_slot_and_wait_is_capped(self):
+        with mock.patch.object(status_hub, 'wait_for_change', return_value=None) as wait_for_change:
+            self.assertEqual(self.get('status', wait=3600).status_code, 200)
+        self.assertEqual(wait_for_change.call_args.args[2], settings.COMMAND_STATUS_MAX_WAIT)
+        self.assertEqual(status_hub.stats()['waiters'], 0)
+
+    def test_stream_releases_slot_when_finished(self):
+        stream = self.get('stream')
+        with mock.patch.object(status_hub, 'wait_for_change',
+                               side_effect=lambda *args: {**status_hub.get(self.command.id), 'status': 'completed',
+                                                          'version': 10 ** 9}):
+            events = b''.join(stream.streaming_content)
+        self.assertIn(b'completed', events)
+        stream.close()
+        self.assertEqual(status_hub.stats()['waiters'], 0)
+
+class BatchProgressAccessTests(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = CommandRequestViewSet.as_view(
+            {'get': 'batch_progress'}, **CommandRequestViewSet.batch_progress.kwargs
+        )
+        self.batch = CommandBatch.objects.create(command_type='turn_on', total=1, user_id='owner')
+
+    def get_progress(self, user_id, role='operator'):
+        request = self.factory.get(f'/commands/batches/{self.batch.id}/')
+        force_authenticate(request, user=StatusAccessTests.User(user_id, role))
+        return self.view(request, batch_id=str(self.batch.id))
+
+    def test_batch_progress_is_only_returned_to_owner_or_admin(self):
+        self.assertEqual(self.get_progress('owner').status_code, 200)
+        self.assertEqual(self.get_progress('someone-else').status_code, 404)
+        self.assertEqual(self.get_progress('admin-user', role='admin').status_code, 200)
+
+class TimelineTests(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = CommandRequestViewSet.as_view({'get': 'timeline'}, **CommandRequestViewSet.timeline.kwargs)
+        self.now = timezone.now().replace(microsecond=0)
+
+    def command(self, created_at, status='completed', device_id='dev-1'):
+        command = CommandRequest.objects.create(device_id=device_id, command_type='turn_on', user_id='owner', status=status)
+        CommandRequest.objects.filter(pk=command.pk).update(created_at=created_at)
+        command.created_at = created_at
+        return command
+
+    def execution(self, command, completed_at, agent_id='agent-1'):
+        return CommandExecution.objects.create(
+            command_request=command, agent_id=agent_id, protocol='http',
+            started_at=completed_at - timedelta(seconds=1), completed_at=completed_at
+        )
+
+    def get_timeline(self, **params):
+        request = self.factory.get('/commands/timeline/', {'device_id': 'dev-1', **params})
+        force_authenticate(request, user=StatusAccessTests.User('owner', 'operator'))
+        return self.view(request)
+
+    def all_pages(self, **params):
+        ids, cursor = [], None
+        while True:
+            response = self.get_timeline(**params, **({'cursor': cursor} if cursor else {}))
+            self.assertEqual(response.status_code, 200)
+            ids += [row['id'] for row in response.data['results']]
+            cursor = response.data['next_cursor']
+            if cursor is None:
+                return ids
+
+    def test_keyset_pages_are_stable_across_equal_created_at(self):
+        commands = [self.command(self.now) for _ in range(5)]
+        commands.append(self.command(self.now - timedelta(hours=1)))
+        commands.append(self.command(self.now + timedelta(hours=1)))
+        self.command(self.now, device_id='dev-2')
+        expected = [str(c.id) for c in sorted(commands, key=lambda c: (c.created_at, c.id), reverse=True)]
+
+        self.assertEqual(self.all_pages(limit=2), expected)
+        # Rows mới được tạo giữa các pages không làm trùng/mất rows cũ
+        first = self.get_timeline(limit=3)
+        self.command(self.now + timedelta(hours=2))
+        second = self.get_timeline(limit=10, cursor=first.data['next_cursor'])
+        self.assertEqual([row['id'] for row in first.data['results'] + second.data['results']], expected)
+
+    def test_status_and_time_filters(self):
+        old = self.command(self.now - timedelta(hours=2))
+        failed = self.command(self.now - timedelta(hours=1), status='failed')
+        pending = self.command(self.now, status='pending')
+        latest = self.command(self.now + timedelta(hours=1))
+
+        self.assertEqual(self.all_pages(status='completed,failed'), [str(latest.id), str(failed.id), str(old.id)])
+        # start inclusive, end exclusive
+        window = {'start': (self.now - timedelta(hours=1)).isoformat(), 'end': (self.now + timedelta(hours=1)).isoformat()}
+        self.assertEqual(self.all_pages(**window), [str(pending.id), str(failed.id)])
+        self.assertEqual(self.all_pages(status='failed', **window), [str(failed.id)])
+
+        self.assertEqual(self.get_timeline(start='yesterday').status_code, 400)
+        self.assertEqual(self.get_timeline(limit=0).status_code, 400)
+        self.assertEqual(self.get_timeline(cursor='not-a-cursor').status_code, 400)
+        request = self.factory.get('/commands/timeline/')
+        force_authenticate(request, user=StatusAccessTests.User('owner', 'operator'))
+        self.assertEqual(self.view(request).status_code, 400)
+
+    def test_latest_execution_per_row(self):
+        newer = self.command(self.now)
+        older = self.command(self.now - timedelta(hours=1))
+        self.execution(newer, self.now + timedelta(seconds=5), agent_id='first')
+        self.execution(newer, self.now + timedelta(seconds=30), agent_id='retry')
+        self.execution(older, self.now - timedelta(minutes=30))
+        pending = self.command(self.now - timedelta(hours=2), status='pending')
+
+        # Một query cho commands, một query cho executions của cả page
+        with self.assertNumQueries(2):
+            response = self.get_timeline()
+        executions = {row['id']: row['execution'] for row in response.data['results']}
+        self.assertEqual(executions[str(newer.id)]['agent_id'], 'retry')
+        self.assertEqual(executions[str(older.id)]['agent_id'], 'agent-1')
+        self.assertIsNone(executions[str(pending.id)])
+
+    def test_execution_prefetch_is_bounded_by_last_created_at(self):
+        newer = self.command(self.now)
+        older = self.command(self.now - timedelta(hours=1))
+        self.execution(newer, self.now + timedelta(seconds=5))
+        # completed_at trước created_at của row cuối page: nằm ngoài giới hạn
+        # dưới của prefetch (thực tế không xảy ra) nên không được load
+        self.execution(older, self.now - timedelta(hours=2))
+
+        response = self.get_timeline()
+        self.assertIsNotNone(response.data['results'][0]['execution'])
+        self.assertIsNone(response.data['results'][1]['execution'])
+
+class ArchiveQueryTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.factory = APIRequestFactory()
+        self.view = CommandRequestViewSet.as_view({'get': 'archive'}, **CommandRequestViewSet.archive.kwargs)
+        now = timezone.now()
+        for index, user_id in enumerate(['owner', 'owner', 'other']):
+            command = CommandRequest.objects.create(
+                device_id='dev-1', command_type='turn_on', user_id=user_id, status='completed',
+                command_params={'index': index}
+            )
+            CommandExecution.objects.create(
+                command_request=command, agent_id='agent-1', protocol='http',
+                started_at=now, completed_at=now + timedelta(seconds=index), response_data={'index': index}
+            )
+        with override_settings(COMMAND_ARCHIVE_ROOT=self.root):
+            stats = CommandArchiver().archive_before(now + timedelta(seconds=1))
+        self.assertEqual(stats['requests'], 3)
+
+    def get_archive(self, user_id, role='operator', **params):
+        request = self.factory.get('/commands/archive/', {'device_id': 'dev-1', **params})
+        force_authenticate(request, user=StatusAccessTests.User(user_id, role))
+        with override_settings(COMMAND_ARCHIVE_ROOT=self.root):
+            return self.view(request)
+
+    def test_non_admin_only_sees_own_archived_rows(self):
+        response = self.get_archive('owner')
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual({row['user_id'] for row in response.data['results']}, {'owner'})
+        executions = self.get_archive('owner', type='executions').data['results']
+        self.assertEqual(sorted(row['response_data']['index'] for row in executions), [0, 1])
+        self.assertEqual(self.get_archive('someone-else').data['count'], 0)
+
+    def test_admin_sees_all_archived_rows(self):
+        self.assertEqual(self.get_archive('admin-user', role='admin').data['count'], 3)
+        self.assertEqual(self.get_archive('admin-user', role='admin', type='executions').data['count'], 3)
+
+    def test_limit_is_bounded(self):
+        self.assertEqual(self.get_archive('owner', limit=-5).status_code, 400)
+        self.assertEqual(self.get_archive('owner', limit=0).status_code, 400)
+        response = self.get_archive('admin-user', role='admin', type='executions', limit=1)
+        self.assertEqual([row['response_data']['index'] for row in response.data['results']], [2])
+        with override_settings(COMMAND_ARCHIVE_QUERY_MAX_LIMIT=2):
+            self.assertEqual(self.get_archive('admin-user', role='admin', limit=100).data['count'], 2)
+
+class ArchiveSegmentScanTests(TestCase):
+    def test_limit_stops_reading_older_segments(self):
+        storage = LocalFileStorage(tempfile.mkdtemp())
+        archiver = CommandArchiver(storage=storage, shards=1, segment_rows=1)
+        base = timezone.now() - timedelta(minutes=1)
+        for index in range(4):
+            command = CommandRequest.objects.create(device_id='dev-1', command_type='turn_on', user_id='owner',
+                                                    status='completed', command_params={'index': index})
+            # Archive lưu timestamps tới millisecond: tách created_at rõ ràng
+            CommandRequest.objects.filter(id=command.id).update(created_at=base + timedelta(seconds=index))
+        archiver.archive_before(timezone.now() + timedelta(seconds=1))
+        with mock.patch.object(storage, 'read', wraps=storage.read) as read:
+            results = archiver.query('dev-1', limit=1)
+        self.assertEqual(results[0]['command_params'], {'index': 3})
+        segment_reads = [call for call in read.call_args_list if not call.args[0].endswith('manifest.json')]
+        # Segment mới nhất đủ limit; segment kế tiếp được so max_time rồi bỏ qua
+        self.assertEqual(len(segment_reads), 1)
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        self.store = IdempotencyStore(ttl=3600)
+        self.store.cache.clear()
+
+    def test_db_duplicate_repairs_cache_claim(self):
+        original_id, fresh_id = str(uuid.uuid4()), str(uuid.uuid4())
+        fingerprint = request_fingerprint(device_id='dev-1', command_type='turn_on')
+        self.assertIsNone(self.store.record('u1', 'key-1', fingerprint, original_id))
+        # Cache entry bị evict: request mới claim được key với command_id mới
+        self.store.cache.clear()
+        self.assertIsNone(self.store.claim('u1', 'key-1', fingerprint, fresh_id))
+        self.assertEqual(self.store.record('u1', 'key-1', fingerprint, fresh_id), original_id)
+        # Retry sau đó replay command gốc, không phải command chưa từng được tạo
+        self.assertEqual(self.store.claim('u1', 'key-1', fingerprint, str(uuid.uuid4())), original_id)
+
+    def test_db_conflict_repairs_cache_claim(self):
+        original_id = str(uuid.uuid4())
+        fingerprint = request_fingerprint(device_id='dev-1', command_type='turn_on')
+        other = request_fingerprint(device_id='dev-2', command_type='turn_on')
+        self.store.record('u1', 'key-2', fingerprint, original_id)
+        self.store.cache.clear()
+        self.assertIsNone(self.store.claim('u1', 'key-2', other, str(uuid.uuid4())))
+        with self.assertRaises(IdempotencyConflict):
+            self.store.record('u1', 'key-2', other, str(uuid.uuid4()))
+        with self.assertRaises(IdempotencyConflict):
+            self.store.claim('u1', 'key-2', other, str(uuid.uuid4()))
+        self.assertEqual(self.store.claim('u1', 'key-2', fingerprint, str(uuid.uuid4())), original_id)
+
+class FakeBatchMessage(FakeMessage):
+    def __init__(self, topic, offset, payload):
+        super().__init__(topic, 0, offset)
+        self.payload = payload
+
+    def value(self):
+        return self.payload
+
+    def key(self):
+        return None
+
+    def offset(self):
+        return self._offset
+
+class FakeProducer:
+    def __init__(self):
+        self.produced = []
+
+    def produce(self, topic, key=None, value=None, headers=None):
+        self.produced.append((topic, value, dict(headers)))
+
+    def flush(self, timeout=None):
+        return 0
+
+class BatchConsumerDeadLetterTests(SimpleTestCase):
+    def run_batch(self, payloads, handler, transient_errors=(), max_loops=None):
+        service = KafkaService.__new__(KafkaService)
+        service.producer = FakeProducer()
+        messages = [FakeBatchMessage('results', i, payload) for i, payload in enumerate(payloads)]
+        info = {
+            'handler': handler, 'active': True, 'max_attempts': 3,
+            'dead_letter_topic': 'results-dlq', 'transient_errors': transient_errors,
+        }
+        commits = []
+
+        class Consumer:
+            def consume(self, num_messages, timeout):
+                batch, messages[:] = list(messages), []
+                return batch
+
+            def commit(self, asynchronous=True):
+                commits.append(True)
+                info['active'] = False
+
+            def close(self):
+                pass
+
+        info['consumer'] = Consumer()
+        service.consumers = {'results': info}
+        sleeps = []
+
+        def sleep(delay):
+            sleeps.append(delay)
+            if max_loops and len(sleeps) >= max_loops:
+                info['active'] = False
+
+        with mock.patch('shared.kafka.service.time.sleep', sleep):
+            service._batch_consumer_loop('results', 10, 0.1)
+        return service.producer.produced, commits
+
+    def test_poison_message_is_dead_lettered_and_batch_committed(self):
+        applied = []
+
+        def handler(batch):
+            if any(message.get('poison') for message in batch):
+                raise ValueError('invalid command_id')
+            applied.extend(message['n'] for message in batch)
+
+        payloads = [json.dumps({'n': 1}).encode(), json.dumps({'poison': True}).encode(), b'not json',
+                    json.dumps({'n': 2}).encode()]
+        produced, commits = self.run_batch(payloads, handler)
+        self.assertEqual(commits, [True])
+        self.assertEqual(sorted(set(applied)), [1, 2])
+        self.assertEqual([value for _, value, _ in produced], [b'not json', json.dumps({'poison': True}).encode()])
+        self.assertTrue(all(topic == 'results-dlq' for topic, _, _ in produced))
+
+    def test_transient_errors_are_retried_not_dead_lettered(self):
+        def handler(batch):
+            raise ConnectionError('database unavailable')
+
+        produced, commits = self.run_batch(
+            [json.dumps({'n': 1}).encode()], handler, transient_errors=(ConnectionError,), max_loops=6
+        )
+        self.assertEqual(produced, [])
+        self.assertEqual(commits, [])
+
+class RetryableErrorTests(SimpleTestCase):
+    def test_only_transport_errors_without_status_are_retried(self):
+        self.assertTrue(is_retryable({'success': False, 'error_code': CONNECTION_ERROR}))
+        self.assertTrue(is_retryable({'success': False, 'error_code': TIMEOUT}))
+        self.assertTrue(is_retryable({'success': False, 'error_code': CIRCUIT_OPEN}))
+        self.assertFalse(is_retryable({'success': False, 'error': 'No base URL provided', 'error_code': None}))
+        self.assertTrue(is_retryable({'success': False, 'status_code': 503}))
+        self.assertFalse(is_retryable({'success': False, 'status_code': 400}))
+
+    def test_handler_classifies_wrapped_errors(self):
+        handler = AsyncHTTPHandler()
+
+        def wrapped(error):
+            try:
+                try:
+                    raise error
+                except Exception as e:
+                    raise Exception(f"HTTP command execution failed: {e}") from e
+            except Exception as e:
+                return e
+
+        self.assertEqual(handler.error_code(wrapped(requests.ConnectionError('refused'))), CONNECTION_ERROR)
+        self.assertEqual(handler.error_code(wrapped(requests.ReadTimeout('slow'))), TIMEOUT)
+        self.assertEqual(handler.error_code(wrapped(asyncio.TimeoutError())), TIMEOUT)
+        self.assertIsNone(handler.error_code(wrapped(Exception('No base URL provided'))))
+
+class WriteBehindBufferTests(TestCase):
+    def setUp(self):
+        self.commands = [
+            CommandRequest.objects.create(device_id=f'dev-{i}', command_type='turn_on', user_id='owner')
+            for i in range(3)
+        ]
+
+    def execution(self, command):
+        now = timezone.now()
+        return {
+            'id': uuid.uuid4(), 'command_request_id': command.id, 'agent_id': 'agent-1',
+            'protocol': 'http', 'started_at': now, 'completed_at': now,
+        }
+
+    def test_updates_are_batched_by_field_set(self):
+        buffer = WriteBehindBuffer()
+        for command in self.commands:
+            buffer.update_status(command.id, status='completed')
+            buffer.add_execution(**self.execution(command))
+        buffer.update_status(self.commands[0].id, status='completed', retry_count=2)
+
+        self.assertEqual(buffer.flush(), 6)
+        # Hai field sets -> hai bulk_update, một bulk_create cho mọi executions
+        self.assertEqual(buffer.stats()['queries'], 3)
+        self.assertEqual(
+            list(CommandRequest.objects.order_by('device_id').values_list('status', 'retry_count')),
+            [('completed', 2), ('completed', 0), ('completed', 0)]
+        )
+        self.assertEqual(CommandExecution.objects.count(), 3)
+
+    def test_repeated_status_updates_of_a_command_are_coalesced(self):
+        buffer = WriteBehindBuffer()
+        command = self.commands[0]
+        buffer.update_status(command.id, status='executing')
+        buffer.update_status(command.id, status='scheduled', retry_count=1)
+        buffer.update_status(command.id, status='executing')
+        buffer.update_status(str(command.id), status='completed')
+        self.assertEqual(buffer.pending(), 1)
+
+        self.assertEqual(buffer.flush(), 1)
+        command.refresh_from_db()
+        self.assertEqual((command.status, command.retry_count), ('completed', 1))
+
+    def test_rewritten_execution_is_not_duplicated(self):
+        buffer = WriteBehindBuffer()
+        execution = self.execution(self.commands[0])
+        buffer.add_execution(**execution)
+        buffer.flush()
+        # Batch được xử lý lại sau lỗi: cùng execution record
+        buffer.add_execution(**execution)
+        buffer.flush()
+        self.assertEqual(CommandExecution.objects.count(), 1)
+
+    def test_flushes_when_max_rows_is_reached(self):
+        buffer = WriteBehindBuffer(max_rows=3)
+        buffer.update_status(self.commands[0].id, status='completed')
+        buffer.update_status(self.commands[1].id, status='completed')
+        self.assertEqual(buffer.pending(), 2)
+        self.assertFalse(CommandRequest.objects.filter(status='completed').exists())
+
+        buffer.update_status(self.commands[2].id, status='completed')
+        self.assertEqual(buffer.pending(), 0)
+        self.assertEqual(CommandRequest.objects.filter(status='completed').count(), 3)
+
+    def test_failed_flush_keeps_rows_for_next_flush(self):
+        buffer = WriteBehindBuffer()
+        buffer.update_status(self.commands[0].id, status='completed')
+        buffer.add_execution(**self.execution(self.commands[0]))
+        with mock.patch.object(CommandRequest.objects, 'bulk_update', side_effect=OperationalError('db down')):
+            with self.assertRaises(OperationalError):
+                buffer.flush()
+        self.assertEqual(buffer.pending(), 2)
+
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(buffer.pending(), 0)
+        self.assertEqual(CommandExecution.objects.count(), 1)
+
+class SchedulerClaimTests(TestCase):
+    def create(self, offset=-1, **fields):
+        return CommandRequest.objects.create(
+            device_id='dev-1', command_type='turn_on', user_id='owner', status='scheduled',
+            scheduled_at=timezone.now() + timedelta(seconds=offset), **fields
+        )
+
+    def dispatch(self, scheduler):
+        with mock.patch('commands.scheduler.dispatch_command') as dispatch, \
+                mock.patch('commands.scheduler.EventPublisher'), \
+                mock.patch('commands.scheduler.publish_timeout') as timeout:
+            scheduler.dispatch_due()
+        return [call[0][0]['command_id'] for call in dispatch.call_args_list], timeout
+
+    def test_claimed_rows_are_leased_to_one_scheduler(self):
+        commands = [self.create() for _ in range(3)]
+        first, second = CommandScheduler(), CommandScheduler()
+        self.assertEqual(first.claim_due(), 3)
+        # Lease còn hạn: replica khác không claim lại
+        self.assertEqual(second.claim_due(), 0)
+        dispatched, _ = self.dispatch(first)
+        self.assertEqual(sorted(dispatched), sorted(str(command.id) for command in commands))
+
+    def test_expired_lease_is_reclaimed(self):
+        command = self.create()
+        crashed = CommandScheduler(lease=30)
+        self.assertEqual(crashed.claim_due(), 1)
+        # Replica claim rồi chết trước khi dispatch: lease hết hạn
+        CommandRequest.objects.filter(id=command.id).update(claimed_until=timezone.now() - timedelta(seconds=1))
+
+        other = CommandScheduler()
+        self.assertEqual(other.claim_due(), 1)
+        dispatched, _ = self.dispatch(other)
+        self.assertEqual(dispatched, [str(command.id)])
+
+    def test_future_rows_outside_lookahead_are_not_claimed(self):
+        self.create(offset=60)
+        self.assertEqual(CommandScheduler(lookahead=5).claim_due(), 0)
+
+    def test_canceled_before_dispatch_is_skipped(self):
+        kept, canceled = self.create(), self.create()
+        scheduler = CommandScheduler()
+        self.assertEqual(scheduler.claim_due(), 2)
+        CommandRequest.objects.filter(id=canceled.id).update(status='cancelled')
+
+        dispatched, _ = self.dispatch(scheduler)
+        self.assertEqual(dispatched, [str(kept.id)])
+        canceled.refresh_from_db()
+        self.assertEqual(canceled.status, 'cancelled')
+
+    def test_past_deadline_becomes_timeout(self):
+        expired = self.create(deadline=timezone.now() - timedelta(seconds=1))
+        scheduler = CommandScheduler()
+        scheduler.claim_due()
+        dispatched, timeout = self.dispatch(scheduler)
+
+        self.assertEqual(dispatched, [])
+        self.assertEqual(timeout.call_args[0][0]['command_id'], str(expired.id))
+        self.assertEqual(timeout.call_args[1]['stage'], 'scheduling')
+        expired.refresh_from_db()
+        self.assertEqual((expired.status, expired.claimed_until), ('timeout', None))
+
+class SchedulerSkipLockedTests(TransactionTestCase):
+    def test_rows_locked_by_another_claimer_are_skipped(self):
+        commands = [
+            CommandRequest.objects.create(device_id='dev-1', command_type='turn_on', user_id='owner',
+                                          status='scheduled', scheduled_at=timezone.now())
+            for _ in range(4)
+        ]
+        locked = threading.Event()
+        release = threading.Event()
+        held = {str(command.id) for command in commands[:2]}
+
+        def other_claimer():
+            # Claimer khác đang ở giữa transaction claim (giữ row locks)
+            try:
+                with transaction.atomic():
+                    list(CommandRequest.objects.select_for_update().filter(id__in=held))
+                    locked.set()
+                    release.wait(5)
+            finally:
+                connections.close_all()
+
+        thread = threading.Thread(target=other_claimer)
+        thread.start()
+        self.assertTrue(locked.wait(5))
+        scheduler = CommandScheduler()
+        started = time.monotonic()
+        claimed = scheduler.claim_due()
+        # Không chờ row locks của claimer kia
+        self.assertLess(time.monotonic() - started, 2)
+        release.set()
+        thread.join()
+
+        self.assertEqual(claimed, 2)
+        self.assertTrue({str(command.id) for _, _, command in scheduler._heap}.isdisjoint(held))
+
+class RetryRecoveryTests(TestCase):
+    def setUp(self):
+        with mock.patch.object(CommandResultConsumer, 'setup_consumer'):
+            self.consumer = CommandResultConsumer(batch_size=10, batch_timeout=1)
+        self.command = CommandRequest.objects.create(
+            device_id='dev-1', command_type='turn_on', user_id='owner', status='executing'
+        )
+
+    def test_pending_retry_is_persisted_and_recovered_by_scheduler(self):
+        next_attempt_at = timezone.now() - timedelta(seconds=settings.COMMAND_RETRY_RECOVERY_GRACE + 1)
+        buffer = WriteBehindBuffer()
+        self.consumer.apply(buffer, EventTypes.DEVICE_COMMAND_RETRY_SCHEDULED, {
+            'command_id': str(self.command.id),
+            'retry_count': 2,
+            'next_attempt_at': next_attempt_at.isoformat(),
+        })
+        buffer.flush()
+        self.command.refresh_from_db()
+        self.assertEqual(self.command.status, 'scheduled')
+        self.assertEqual(self.command.retry_count, 2)
+
+        # Agent dừng trước khi chạy retry: scheduler dispatch lại với attempt đã dùng
+        scheduler = CommandScheduler()
+        with mock.patch('commands.scheduler.dispatch_command') as dispatch, \
+                mock.patch('commands.scheduler.EventPublisher'):
+            self.assertEqual(scheduler.claim_due(), 1)
+            self.assertEqual(scheduler.dispatch_due(), 1)
+        self.assertEqual(dispatch.call_args[0][0]['attempt'], 2)
+
+    def test_retry_started_by_agent_is_not_recovered(self):
+        buffer = WriteBehindBuffer()
+        data = {'command_id': str(self.command.id), 'retry_count': 1, 'next_attempt_at': timezone.now().isoformat()}
+        self.consumer.apply(buffer, EventTypes.DEVICE_COMMAND_RETRY_SCHEDULED, data)
+        self.consumer.apply(buffer, EventTypes.DEVICE_COMMAND_STARTED, {'command_id': str(self.command.id)})
+        buffer.flush()
+        self.command.refresh_from_db()
+        self.assertEqual(self.command.status, 'executing')
+        with mock.patch('commands.scheduler.dispatch_command') as dispatch:
+            CommandScheduler(lookahead=3600).claim_due()
+        dispatch.assert_not_called()
+
+    def start_leased_retry(self, lease_until):
+        buffer = WriteBehindBuffer()
+        data = {'command_id': str(self.command.id), 'retry_count': 1, 'next_attempt_at': timezone.now().isoformat()}
+        self.consumer.apply(buffer, EventTypes.DEVICE_COMMAND_RETRY_SCHEDULED, data)
+        self.consumer.apply(buffer, EventTypes.DEVICE_COMMAND_STARTED, {
+            'command_id': str(self.command.id), 'lease_until': lease_until.isoformat()
+        })
+        buffer.flush()
+
+    def test_executing_retry_is_recovered_when_lease_expires(self):
+        # Agent chết khi đang chạy retry (message đã ack): không có outcome
+        self.start_leased_retry(timezone.now() - timedelta(seconds=1))
+        scheduler = CommandScheduler()
+        with mock.patch('commands.scheduler.dispatch_command') as dispatch, \
+                mock.patch('commands.scheduler.EventPublisher'):
+            self.assertEqual(scheduler.claim_due(), 1)
+            self.assertEqual(scheduler.dispatch_due(), 1)
+        self.assertEqual(dispatch.call_args[0][0]['attempt'], 1)
+        self.command.refresh_from_db()
+        self.assertEqual(self.command.status, 'queued')
+
+    def test_executing_retry_within_lease_is_not_recovered(self):
+        self.start_leased_retry(timezone.now() + timedelta(seconds=30))
+        with mock.patch('commands.scheduler.dispatch_command') as dispatch:
+            self.assertEqual(CommandScheduler(lookahead=3600).claim_due(), 0)
+        dispatch.assert_not_called()
+
+    def test_outcome_after_claim_skips_recovery(self):
+        self.start_leased_retry(timezone.now() - timedelta(seconds=1))
+        scheduler = CommandScheduler()
+        with mock.patch('commands.scheduler.dispatch_command') as dispatch, \
+                mock.patch('commands.scheduler.EventPublisher'):
+            self.assertEqual(scheduler.claim_due(), 1)
+            # Outcome của agent tới muộn (agent vẫn sống, chỉ chậm)
+            CommandRequest.objects.filter(id=self.command.id).update(status='completed')
+            self.assertEqual(scheduler.dispatch_due(), 0)
+        dispatch.assert_not_called()
+
+def command_context(device_id, command_type, template_id='tpl-1', api_config_id='cfg-1'):
+    return {
+        'device': {'id': device_id},
+        'device_command': {'id': f'dc-{device_id}-{command_type}'},
+        'command_template': {'id': template_id},
+        'api_config': {'id': api_config_id},
+    }
+
+class ContextCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = CommandContextCache(max_size=3, ttl=60)
+        self.consumer = ContextInvalidationConsumer(cache=self.cache)
+        self.cache.set('dev-1', 'turn_on', command_context('dev-1', 'turn_on'))
+        self.cache.set('dev-1', 'zoom', command_context('dev-1', 'zoom', template_id='tpl-2', api_config_id='cfg-2'))
+        self.cache.set('dev-2', 'turn_on', command_context('dev-2', 'turn_on'))
+
+    def cached(self):
+        return {key for key in [('dev-1', 'turn_on'), ('dev-1', 'zoom'), ('dev-2', 'turn_on')]
+                if self.cache.get(*key) is not None}
+
+    def test_template_event_invalidates_contexts_using_template(self):
+        self.consumer.handle_event({'event_type': EventTypes.COMMAND_TEMPLATE_UPDATED, 'data': {
+            'template_id': 'tpl-2', 'affected_device_commands': [{'id': 'dc-dev-2-turn_on'}]
+        }})
+        self.assertEqual(self.cached(), {('dev-1', 'turn_on')})
+
+    def test_api_config_event_invalidates_contexts_using_config(self):
+        self.consumer.handle_event({'event_type': EventTypes.API_CONFIG_UPDATED, 'data': {'api_config_id': 'cfg-1'}})
+        self.assertEqual(self.cached(), {('dev-1', 'zoom')})
+
+    def test_device_event_invalidates_contexts_of_device(self):
+        self.consumer.handle_event({'event_type': EventTypes.DEVICE_DELETED, 'data': {'device_id': 'dev-1'}})
+        self.assertEqual(self.cached(), {('dev-2', 'turn_on')})
+
+    def test_device_command_event_invalidates_one_context(self):
+        self.consumer.handle_event({'event_type': EventTypes.DEVICE_COMMAND_UPDATED, 'data': {
+            'device_command_id': 'dc-dev-1-zoom', 'device_id': 'dev-1', 'command_type': 'zoom'
+        }})
+        self.assertEqual(self.cached(), {('dev-1', 'turn_on'), ('dev-2', 'turn_on')})
+        # Index của entry đã xoá cũng được dọn
+        self.assertNotIn(('template', 'tpl-2'), self.cache._index)
+
+    def test_load_racing_with_invalidation_is_not_cached(self):
+        cache = CommandContextCache()
+
+        def loader(device_id, command_type):
+            # Vendor đổi template trong lúc gRPC load đang chạy
+            cache.invalidate('template', 'tpl-1')
+            return command_context(device_id, command_type)
+
+        self.assertIsNotNone(cache.load('dev-3', 'turn_on', loader))
+        self.assertIsNone(cache.get('dev-3', 'turn_on'))
+        # Load không bị race thì được cache
+        cache.load('dev-3', 'turn_on', lambda device_id, command_type: command_context(device_id, command_type))
+        self.assertIsNotNone(cache.get('dev-3', 'turn_on'))
+
+    def test_expired_entry_is_removed_with_its_index(self):
+        now = time.monotonic()
+        with mock.patch('commands.context_cache.time.monotonic', return_value=now + 61):
+            self.assertIsNone(self.cache.get('dev-1', 'zoom'))
+        self.assertEqual(self.cache.stats()['stale'], 1)
+        self.assertNotIn(('template', 'tpl-2'), self.cache._index)
+        self.assertNotIn(('device_command', 'dc-dev-1-zoom'), self.cache._index)
+        self.assertEqual(self.cache._index[('device', 'dev-1')], {('dev-1', 'turn_on')})
+
+    def test_lru_eviction_cleans_index(self):
+        # Dùng dev-1/turn_on để entry cũ nhất là dev-1/zoom
+        self.cache.get('dev-1', 'turn_on')
+        self.cache.set('dev-3', 'turn_on', command_context('dev-3', 'turn_on'))
+
+        self.assertIsNone(self.cache.get('dev-1', 'zoom'))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+        self.assertNotIn(('template', 'tpl-2'), self.cache._index)
+        self.assertNotIn(('api_config', 'cfg-2'), self.cache._index)
+        # Invalidate sau eviction chỉ chạm entries còn lại
+        self.assertEqual(self.cache.invalidate('api_config', 'cfg-1'), 3)
+        self.assertEqual(self.cache._index, {})
+
+class DeviceQueueRetryTests(SimpleTestCase):
+    def run_queue(self, commands, fail_first, coalesce=False, gap=0):
+        executed, superseded = [], []
+
+        async def execute(command_data, context=None):
+            executed.append((command_data['command_id'], command_data.get('attempt', 0)))
+            if command_data['command_id'] in fail_first and not command_data.get('attempt'):
+                return {**command_data, 'attempt': 1}, 0.01
+            return None
+
+        async def supersede(command_data, newer):
+            superseded.append((command_data['command_id'], newer['command_id']))
+
+        async def is_coalescing(command_data, context=None):
+            return coalesce
+
+        async def main():
+            queues = DeviceCommandQueues(execute, supersede, is_coalescing)
+            for command_data in commands:
+                await queues.submit(command_data, ack=lambda c=command_data: executed.append(('ack', c['command_id'])))
+                await asyncio.sleep(gap)
+            await queues.drain()
+
+        asyncio.run(main())
+        # executed chứa cả các lần ack (theo thứ tự xảy ra)
+        return [entry for entry in executed if entry[0] != 'ack'], superseded, executed
+
+    def test_retry_runs_before_later_commands_of_device(self):
+        commands = [
+            {'command_id': 'a', 'device_id': 'dev-1', 'command_type': 'set_temp', 'created_at': '2026-01-01T00:00:00'},
+            {'command_id': 'b', 'device_id': 'dev-1', 'command_type': 'turn_off', 'created_at': '2026-01-01T00:00:01'},
+        ]
+        executed, _, _ = self.run_queue(commands, fail_first={'a'})
+        self.assertEqual(executed, [('a', 0), ('a', 1), ('b', 0)])
+
+    def test_message_is_acked_once_first_attempt_is_handed_off(self):
+        commands = [
+            {'command_id': 'a', 'device_id': 'dev-1', 'command_type': 'set_temp', 'created_at': '2026-01-01T00:00:00'},
+            {'command_id': 'b', 'device_id': 'dev-1', 'command_type': 'turn_off', 'created_at': '2026-01-01T00:00:01'},
+        ]
+        # Retry của 'a' đã persist: ack không chờ retry chạy xong
+        _, _, log = self.run_queue(commands, fail_first={'a'})
+        self.assertEqual(log, [('a', 0), ('ack', 'a'), ('a', 1), ('b', 0), ('ack', 'b')])
+
+    def test_retry_of_coalesced_command_is_superseded_by_newer_command(self):
+        commands = [
+            {'command_id': 'a', 'device_id': 'dev-1', 'command_type': 'set_temp', 'created_at': '2026-01-01T00:00:00'},
+            {'command_id': 'b', 'device_id': 'dev-1', 'command_type': 'set_temp', 'created_at': '2026-01-01T00:00:01'},
+        ]
+        # 'b' vào queue khi 'a' đang chờ retry: retry của 'a' bị thay bởi 'b'
+        executed, superseded, _ = self.run_queue(commands, fail_first={'a'}, coalesce=True, gap=0.001)
+        self.assertEqual(executed, [('a', 0), ('b', 0)])
+        self.assertEqual(superseded, [('a', 'b')])
+
+class SetCookieAdapter(requests.adapters.BaseAdapter):
+    """Adapter trả về response có Set-Cookie, không gọi network"""
+
+    def send(self, request, **kwargs):
+        message = http.client.HTTPMessage()
+        message['Set-Cookie'] = 'session=tenant-a; Path=/'
+        response = requests.Response()
+        response.status_code = 200
+        response.url = request.url
+        response.request = request
+        response.raw = urllib3.HTTPResponse(
+            body=io.BytesIO(b''), headers=dict(message), status=200, preload_content=False,
+            original_response=mock.Mock(msg=message)
+        )
+        return response
+
+    def close(self):
+        pass
+
+class TemplateRendererTests(SimpleTestCase):
+    PARAMS = {
+        'device_id': 'CAM-001', 'zoom_level': 3, 'enabled': True, 'ratio': '2.5',
+        'device': {'id': 'dev-9', 'tags': ['north', 'gate']},
+    }
+
+    def setUp(self):
+        self.renderer = TemplateRenderer()
+
+    def test_whole_value_placeholder_keeps_native_type(self):
+        render = self.renderer.render_template
+        self.assertEqual(render('{zoom_level}', self.PARAMS), 3)
+        self.assertIs(render('{enabled}', self.PARAMS), True)
+        self.assertEqual(render('{device.tags}', self.PARAMS), ['north', 'gate'])
+        self.assertEqual(render('{ratio:float}', self.PARAMS), 2.5)
+        self.assertEqual(render('{ratio:int}', self.PARAMS), 2)
+        # Nhúng trong string thì format như renderer cũ
+        self.assertEqual(render('zoom={zoom_level}', self.PARAMS), 'zoom=3')
+        self.assertEqual(render('on={enabled:bool}', self.PARAMS), 'on=true')
+
+    def test_defaults_and_missing_params(self):
+        render = self.renderer.render_template
+        self.assertEqual(render('{speed|50}', self.PARAMS), '50')
+        self.assertEqual(render('{zoom_level|1}', self.PARAMS), 3)
+        self.assertEqual(render('{device.name|unnamed}', self.PARAMS), 'unnamed')
+        # Param thiếu, function không tồn tại, convert lỗi: giữ nguyên placeholder
+        self.assertEqual(render('{missing}', self.PARAMS), '{missing}')
+        self.assertEqual(render('a/{missing}/b', self.PARAMS), 'a/{missing}/b')
+        self.assertEqual(render('{nope()}', self.PARAMS), '{nope()}')
+        self.assertEqual(render('{device_id:int}', self.PARAMS), '{device_id:int}')
+
+    def test_nested_templates_match_regex_renderer(self):
+        template = {
+            'command': 'zoom',
+            'target': {'id': '{device.id}', 'path': 'cams/{device_id}/{device.tags.1}'},
+            'steps': ['{zoom_level|1}x', {'ratio': 'r={ratio:float}', 'json': '{device.tags:json}'}],
+            'fallback': '{missing|none}',
+            'literal': 7,
+        }
+        baseline = RegexTemplateRenderer()
+        self.assertEqual(self.renderer.render_template(template, self.PARAMS),
+                         baseline.render_template(template, self.PARAMS))
+        for demo in DEMO_TEMPLATES:
+            for key in ('url_template', 'body_template'):
+                expected = baseline.render_template(demo[key], demo['params'])
+                rendered = self.renderer.render_template(demo[key], demo['params'])
+                # Whole-value placeholder giữ native type (zoom level là int)
+                if isinstance(rendered, dict):
+                    rendered = {k: str(v) if isinstance(expected[k], str) else v for k, v in rendered.items()}
+                self.assertEqual(rendered, expected)
+
+    def test_template_mutated_in_place_is_recompiled(self):
+        template = {'command': 'turn_on', 'intensity': '{level}'}
+        self.assertEqual(self.renderer.render_template(template, {'level': 5}), {'command': 'turn_on', 'intensity': 5})
+        template['command'] = 'turn_off'
+        self.assertEqual(self.renderer.render_template(template, {'level': 0}), {'command': 'turn_off', 'intensity': 0})
+
+    def test_cache_is_keyed_by_content(self):
+        first = self.renderer.compile({'a': '{x}', 'b': [1, 2]})
+        self.assertIs(self.renderer.compile({'a': '{x}', 'b': [1, 2]}), first)
+        self.assertTrue(all(isinstance(key, str) for key in self.renderer._object_cache))
+
+class ExecutionPlanTests(SimpleTestCase):
+    def setUp(self):
+        self.api_config = {
+            'id': 'cfg-1', 'updated_at': '2026-01-01T00:00:00Z', 'base_url': 'https://vendor.example.com/',
+            'headers_template': {'X-Source': 'cmd', 'X-Region': '{region}'},
+            'auth_type': 'bearer', 'auth_config': {'token': 'secret'}, 'timeout': 15,
+        }
+        self.template = {
+            'id': 'tpl-1', 'updated_at': '2026-01-01T00:00:00Z', 'method': 'PUT',
+            'url_template': 'api/v2/cameras/{device_id}/zoom',
+            'headers_template': {'X-Source': 'template'},
+            'body_template': {'command': 'zoom', 'level': '{zoom_level}'},
+        }
+        self.device = {'id': 'dev-1', 'updated_at': '2026-01-01T00:00:00Z', 'body_template': {'channel': 2}}
+
+    def test_compile_plan_merges_context_and_renders_only_slots(self):
+        plan = compile_plan(self.api_config, self.template, self.device)
+        self.assertTrue(plan.url_dynamic)
+        self.assertEqual([key for key, _, dynamic in plan.body_slots if dynamic], ['level'])
+
+        request = plan.render(TemplateRenderer(), {'device_id': 'CAM-1', 'zoom_level': 3, 'region': 'eu'})
+        self.assertEqual(request['method'], 'PUT')
+        self.assertEqual(request['url'], 'https://vendor.example.com/api/v2/cameras/CAM-1/zoom')
+        # Api config override template; auth áp dụng sau cùng
+        self.assertEqual(request['headers'], {'X-Source': 'cmd', 'X-Region': 'eu', 'Authorization': 'Bearer secret'})
+        self.assertEqual(request['body'], {'command': 'zoom', 'level': 3, 'channel': 2})
+        self.assertEqual(request['timeout'], 15)
+
+    def test_plan_key_tracks_versions(self):
+        key = plan_key(self.api_config, self.template, self.device)
+        updated = {**self.template, 'updated_at': '2026-02-01T00:00:00Z'}
+        self.assertNotEqual(plan_key(self.api_config, updated, self.device), key)
+        self.assertIsNone(plan_key({**self.api_config, 'id': None}, self.template, self.device))
+        self.assertIsNone(plan_key(self.api_config, {**self.template, 'updated_at': None}))
+
+    def test_cache_reuses_plan_until_context_changes(self):
+        cache = ExecutionPlanCache()
+        plan = cache.get_plan(self.api_config, self.template, self.device)
+        self.assertIs(cache.get_plan(self.api_config, self.template, self.device), plan)
+
+        # Template được sửa (updated_at mới): plan mới với body mới
+        updated = {**self.template, 'updated_at': '2026-02-01T00:00:00Z', 'body_template': {'command': 'zoom_in'}}
+        new_plan = cache.get_plan(self.api_config, updated, self.device)
+        self.assertIsNot(new_plan, plan)
+        self.assertEqual(new_plan.render(TemplateRenderer(), {'device_id': 'CAM-1'})['body'],
+                         {'command': 'zoom_in', 'channel': 2})
+        self.assertEqual((cache.stats()['hits'], cache.stats()['misses']), (1, 2))
+
+    def test_context_without_ids_is_not_cached(self):
+        cache = ExecutionPlanCache()
+        api_config = {key: value for key, value in self.api_config.items() if key != 'id'}
+        first = cache.get_plan(api_config, self.template, self.device)
+        self.assertIsNot(cache.get_plan(api_config, self.template, self.device), first)
+        self.assertEqual(cache.stats()['uncacheable'], 2)
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_lru_eviction(self):
+        cache = ExecutionPlanCache(max_size=2)
+        for version in range(3):
+            cache.get_plan(self.api_config, {**self.template, 'updated_at': f'v{version}'})
+        self.assertEqual(cache.stats()['size'], 2)
+        cache.get_plan(self.api_config, {**self.template, 'updated_at': 'v0'})
+        self.assertEqual(cache.stats()['misses'], 4)
+
+class PooledSessionCookieTests(SimpleTestCase):
+    def test_pooled_session_does_not_keep_vendor_cookies(self):
+        manager = SessionManager()
+        session = manager.get_session('https://vendor.example.com/api')
+        session.mount('https://', SetCookieAdapter())
+        session.get('https://vendor.example.com/api/a')
+        self.assertEqual(len(session.cookies), 0)
+        request = session.prepare_request(requests.Request('GET', 'https://vendor.example.com/api/b'))
+        self.assertNotIn('Cookie', request.headers)
+
+    def test_plain_session_would_keep_cookies(self):
+        session = requests.Session()
+        session.mount('https://', SetCookieAdapter())
+        session.get('https://vendor.example.com/api/a')
+        self.assertEqual(session.cookies.get('session'), 'tenant-a')
+
+@skipUnless(AIOHTTP_AVAILABLE, 'aiohttp not installed')
+class AsyncSessionCookieTests(SimpleTestCase):
+    def test_shared_client_session_does_not_keep_cookies(self):
+        from yarl import URL
+
+        async def main():
+            handler = AsyncHTTPHandler()
+            session = handler._get_session()
+            session.cookie_jar.update_cookies({'session': 'tenant-a'}, URL('https://vendor.example.com/'))
+            cookies = session.cookie_jar.filter_cookies(URL('https://vendor.example.com/api'))
+            await handler.close()
+            return cookies
+
+        self.assertEqual(len(asyncio.run(main())), 0)
+
+class LocalTokenBucketTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 100.0
+        patcher = mock.patch('commands.rate_limit.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_then_wait_for_next_token(self):
+        bucket = LocalTokenBucket()
+        self.assertEqual([bucket.acquire('v', 2, 3) for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(bucket.acquire('v', 2, 3), 0.5)
+        # Bucket khác không bị ảnh hưởng
+        self.assertEqual(bucket.acquire('other', 2, 3), 0)
+
+    def test_tokens_refill_at_rate_up_to_burst(self):
+        bucket = LocalTokenBucket()
+        for _ in range(3):
+            bucket.acquire('v', 2, 3)
+        self.now += 1
+        self.assertEqual([bucket.acquire('v', 2, 3) for _ in range(2)], [0, 0])
+        self.assertGreater(bucket.acquire('v', 2, 3), 0)
+
+        # Nghỉ lâu cũng chỉ refill tới burst
+        self.now += 60
+        self.assertEqual([bucket.acquire('v', 2, 3) for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(bucket.acquire('v', 2, 3), 0.5)
+
+class FailingBucket:
+    def acquire(self, key, rate, burst, tokens=1):
+        raise ConnectionError('redis down')
+
+class RateLimiterTests(SimpleTestCase):
+    def test_limit_from_api_config_or_defaults(self):
+        limiter = RateLimiter(LocalTokenBucket(), default_rate=0)
+        self.assertIsNone(limiter.limit_for({'id': 1}))
+        self.assertEqual(limiter.limit_for({'id': 1, 'rate_limit': 2.5}), (2.5, 3))
+        self.assertEqual(limiter.limit_for({'id': 1, 'rate_limit': 5, 'rate_limit_burst': 10}), (5, 10))
+        self.assertEqual(RateLimiter(LocalTokenBucket(), default_rate=1, default_burst=4).limit_for({}), (1, 4))
+
+    def test_bucket_per_api_config_and_host(self):
+        limiter = RateLimiter(LocalTokenBucket())
+        config = {'id': 7, 'rate_limit': 1, 'rate_limit_burst': 1}
+        limiter.acquire(config, 'https://Vendor.example.com/a')
+        with self.assertRaises(RateLimited) as raised:
+            limiter.acquire(config, 'https://vendor.example.com/b')
+        self.assertEqual(raised.exception.key, '7:vendor.example.com')
+        self.assertGreater(raised.exception.retry_after, 0)
+        limiter.acquire(config, 'https://other.example.com/a')
+        limiter.acquire({**config, 'id': 8}, 'https://vendor.example.com/a')
+        self.assertEqual(limiter.stats(), {'allowed': 3, 'throttled': 1, 'errors': 0})
+
+    def test_backend_error_fails_open(self):
+        limiter = RateLimiter(FailingBucket())
+        limiter.acquire({'id': 1, 'rate_limit': 1}, 'https://vendor.example.com/a')
+        self.assertEqual(limiter.stats()['errors'], 1)
+
+def acquire_shared_tokens(url, key, start, results):
+    """Chạy trong process riêng: lấy token từ Redis bucket dùng chung"""
+    bucket = RedisTokenBucket(url)
+    start.wait()
+    results.put(sum(1 for _ in range(10) if bucket.acquire(key, 0.01, 5) == 0))
+
+@skipUnless(settings.REDIS_URL, 'REDIS_URL not configured')
+class RedisTokenBucketTests(SimpleTestCase):
+    def test_bucket_is_shared_across_processes(self):
+        key = f"test-{uuid.uuid4()}"
+        context = multiprocessing.get_context('fork')
+        start, results = context.Event(), context.Queue()
+        processes = [
+            context.Process(target=acquire_shared_tokens, args=(settings.REDIS_URL, key, start, results))
+            for _ in range(3)
+        ]
+        for process in processes:
+            process.start()
+        start.set()
+        allowed = [results.get(timeout=30) for _ in processes]
+        for process in processes:
+            process.join(10)
+        # 3 processes x 10 requests chỉ lấy được burst tokens
+        self.assertEqual(sum(allowed), 5)
+
+class ScriptedRateLimiter:
+    """Trả lần lượt các retry_after (0 = được gửi)"""
+
+    def __init__(self, *waits):
+        self.waits = list(waits)
+        self.calls = 0
+
+    def acquire(self, api_config, url):
+        self.calls += 1
+        wait = self.waits.pop(0)
+        if wait:
+            raise RateLimited('vendor', wait)
+
+@override_settings(VENDOR_RATE_LIMIT_MAX_WAIT=1)
+class HTTPRateLimitWaitTests(SimpleTestCase):
+    request = {'url': 'https://vendor.example.com/a', 'method': 'GET'}
+
+    def wait(self, limiter, deadline=None):
+        handler = HTTPHandler(rate_limiter=limiter)
+        with mock.patch('commands.protocol_handlers.http_handler.time.sleep') as sleep:
+            handler.wait_for_rate_limit({'id': 1}, self.request, deadline)
+        return [call.args[0] for call in sleep.call_args_list]
+
+    def test_waits_for_short_retry_after(self):
+        limiter = ScriptedRateLimiter(0.2, 0.3, 0)
+        self.assertEqual(self.wait(limiter), [0.2, 0.3])
+        self.assertEqual(limiter.calls, 3)
+
+    def test_raises_when_wait_exceeds_max_wait(self):
+        with self.assertRaises(RateLimited):
+            self.wait(ScriptedRateLimiter(5))
+
+    def test_total_wait_is_bounded(self):
+        now = [0.0]
+        with mock.patch('commands.protocol_handlers.http_handler.time.monotonic', side_effect=lambda: now[0]), \
+                mock.patch('commands.protocol_handlers.http_handler.time.sleep',
+                           side_effect=lambda seconds: now.__setitem__(0, now[0] + seconds)) as sleep:
+            with self.assertRaises(RateLimited):
+                HTTPHandler(rate_limiter=ScriptedRateLimiter(*[0.4] * 10)).wait_for_rate_limit({'id': 1}, self.request)
+        self.assertEqual(sleep.call_count, 2)
+
+    def test_does_not_wait_past_deadline(self):
+        deadline = datetime.now(dt_timezone.utc) + timedelta(seconds=0.2)
+        with self.assertRaises(RateLimited):
+            self.wait(ScriptedRateLimiter(0.5), deadline)
+
+    def test_execute_command_raises_rate_limited_without_sending(self):
+        handler = HTTPHandler(rate_limiter=ScriptedRateLimiter(5))
+        handler.send_request = mock.Mock()
+        template = {'method': 'GET', 'url_template': 'a'}
+        with self.assertRaises(RateLimited):
+            handler.execute_command({'id': 1, 'base_url': 'https://vendor.example.com'}, template, {})
+        handler.send_request.assert_not_called()
+
+class CircuitBreakerTests(SimpleTestCase):
+    api_config = {'id': 1, 'base_url': 'https://vendor.example.com'}
+    template = {'method': 'GET', 'url_template': 'a'}
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('commands.circuit_breaker.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.registry = CircuitBreakerRegistry(window=60, min_requests=4, error_rate=0.5,
+                                               open_duration=30, half_open_calls=1)
+        self.breakers = self.registry.breakers_for(self.api_config, 'https://vendor.example.com/a')
+
+    def call(self, success):
+        self.assertIsNone(self.registry.acquire(self.breakers))
+        self.registry.record(self.breakers, success)
+
+    def open_circuit(self):
+        for success in (True, True, False, False):
+            self.call(success)
+
+    def states(self):
+        return [breaker.state for breaker in self.breakers]
+
+    def test_opens_at_error_threshold(self):
+        self.call(False)
+        self.call(False)
+        # Chưa đủ min_requests
+        self.call(True)
+        self.assertEqual(self.states(), ['closed', 'closed'])
+        self.call(False)
+        self.assertEqual(self.states(), ['open', 'open'])
+        self.assertEqual(self.registry.acquire(self.breakers), ('host', 'vendor.example.com', 30))
+
+    def test_half_open_allows_single_probe(self):
+        self.open_circuit()
+        self.now += 30
+        self.assertIsNone(self.registry.acquire(self.breakers))
+        self.assertEqual(self.states(), ['half_open', 'half_open'])
+        # Probe đang chạy: request khác vẫn bị chặn
+        self.assertEqual(self.registry.acquire(self.breakers)[:2], ('host', 'vendor.example.com'))
+
+        self.registry.record(self.breakers, True)
+        self.assertEqual(self.states(), ['closed', 'closed'])
+
+    def test_failed_probe_reopens(self):
+        self.open_circuit()
+        self.now += 30
+        self.call(False)
+        self.assertEqual(self.states(), ['open', 'open'])
+        self.assertEqual(self.registry.acquire(self.breakers)[2], 30)
+
+    def test_check_circuit_fast_fail_result(self):
+        self.open_circuit()
+        self.now += 10
+        handler = HTTPHandler(circuit_breakers=self.registry)
+        handler.send_request = mock.Mock()
+        result = handler.execute_command(self.api_config, self.template, {})
+        self.assertEqual(result, {
+            'success': False,
+            'error_code': CIRCUIT_OPEN,
+            'error': 'Circuit open for host vendor.example.com, retry after 20s',
+            'retry_after': 20,
+            'url': 'https://vendor.example.com/a',
+            'method': 'GET',
+        })
+        self.assertTrue(is_retryable(result))
+        handler.send_request.assert_not_called()
+
+    def test_rate_limited_async_request_releases_half_open_probe(self):
+        self.open_circuit()
+        self.now += 30
+        handler = AsyncHTTPHandler(rate_limiter=ScriptedRateLimiter(5, 0), circuit_breakers=self.registry)
+        sent = lambda request: handler.build_result(request, 200, {})
+        handler.send_request = mock.Mock(side_effect=sent)
+        handler._send_async = mock.AsyncMock(side_effect=sent)
+
+        with self.assertRaises(RateLimited):
+            asyncio.run(handler.execute_command_async(self.api_config, self.template, {}))
+        # Probe chưa được gửi nên slot half-open được trả lại cho request sau
+        self.assertEqual(self.states(), ['half_open', 'half_open'])
+        result = asyncio.run(handler.execute_command_async(self.api_config, self.template, {}))
+        self.assertTrue(result['success'])
+        self.assertEqual(self.states(), ['closed', 'closed'])
+
+@skipUnless(connection.vendor == 'postgresql', 'partitioning requires PostgreSQL')
+class PartitionPruningTests(TestCase):
+    def explain(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        return plan_relations(json.loads(plan) if isinstance(plan, str) else plan)
+
+    def test_migration_partitions_command_tables(self):
+        with connection.cursor() as cursor:
+            for table in PARTITIONED_TABLES:
+                self.assertTrue(is_partitioned(cursor, table), table)
+
+    def test_month_range_query_scans_only_that_partition(self):
+        current = timezone.now()
+        start = datetime(current.year, current.month, 1, tzinfo=dt_timezone.utc)
+        end = start + timedelta(days=1)
+        queries = {
+            'commands_commandrequest': CommandRequest.objects.filter(
+                device_id='dev-1', created_at__gte=start, created_at__lt=end
+            ),
+            'commands_commandexecution': CommandExecution.objects.filter(
+                completed_at__gte=start, completed_at__lt=end
+            ),
+        }
+        for table, queryset in queries.items():
+            self.assertEqual(self.explain(queryset), {partition_name(table, start)})
+
+class SupervisedAgent:
+    """Agent tối giản chạy trong worker process của supervisor tests"""
+
+    def __init__(self, agent_id, crash=False, healthy_for=None, hang_on_stop=0):
+        self.agent_id = agent_id
+        self.crash, self.healthy_for, self.hang_on_stop = crash, healthy_for, hang_on_stop
+        self.started = time.monotonic()
+        self.running = threading.Event()
+
+    def start_consumer(self):
+        if self.crash:
+            raise RuntimeError('consumer failed')
+        self.running.set()
+        while self.running.is_set():
+            time.sleep(0.05)
+
+    def is_healthy(self):
+        return self.running.is_set() and (self.healthy_for is None or time.monotonic() - self.started < self.healthy_for)
+
+    def handler_latency_ms(self):
+        return 12.5
+
+    def stop(self):
+        time.sleep(self.hang_on_stop)
+        self.running.clear()
+
+class AgentSupervisorTests(SimpleTestCase):
+    """Supervisor thật với spawn workers chạy SupervisedAgent"""
+
+    def supervisor(self, **options):
+        spec = WorkerSpec('test-0', 'test', options.pop('agent', {}), agent_class='commands.tests.SupervisedAgent')
+        supervisor = AgentSupervisor([spec], **{'heartbeat_interval': 0.05, 'stop_timeout': 10, **options})
+        self.addCleanup(supervisor.shutdown)
+        return supervisor
+
+    def start(self, supervisor):
+        supervisor.running = True
+        for slot in supervisor.slots:
+            slot.current = supervisor.spawn(slot.spec)
+
+    def wait_for(self, supervisor, condition, timeout=30):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            self.assertLess(time.monotonic(), deadline, 'supervisor condition not reached')
+            supervisor.check_workers()
+            time.sleep(0.05)
+
+    def healthy(self, slot):
+        return lambda: slot.current is not None and slot.current.last_heartbeat() is not None
+
+    def test_crashed_worker_is_restarted_with_backoff(self):
+        supervisor = self.supervisor(agent={'crash': True}, backoff_base=0.2, backoff_max=0.4)
+        slot = supervisor.slots[0]
+        self.start(supervisor)
+
+        delays, pids = [], set()
+        while len(delays) < 3:
+            failures = slot.failures
+            deadline = time.monotonic() + 30
+            while slot.failures == failures:
+                self.assertLess(time.monotonic(), deadline)
+                if slot.current is not None:
+                    pids.add(slot.current.pid)
+                time.sleep(0.05)
+                checked_at = time.monotonic()
+                supervisor.check_workers()
+            delays.append(round(slot.restart_at - checked_at, 1))
+        # 0.2, 0.4 rồi giữ ở backoff_max
+        self.assertEqual(delays, [0.2, 0.4, 0.4])
+        self.assertEqual(len(pids), 3)
+
+    def test_worker_missing_heartbeats_is_stopped_then_killed(self):
+        supervisor = self.supervisor(agent={'healthy_for': 1, 'hang_on_stop': 60},
+                                     heartbeat_timeout=0.3, stop_timeout=0.5, backoff_base=60)
+        slot = supervisor.slots[0]
+        self.start(supervisor)
+        self.wait_for(supervisor, self.healthy(slot))
+        worker = slot.current
+
+        # Agent hết healthy: supervisor stop, drain bị treo nên kill
+        self.wait_for(supervisor, lambda: slot.failures == 1)
+        self.assertIsNotNone(worker.stopping_since)
+        self.assertEqual(worker.process.exitcode, -signal.SIGKILL)
+        self.assertIsNone(slot.current)
+
+    def test_scale_up_then_retire_worker(self):
+        supervisor = self.supervisor()
+        self.start(supervisor)
+        self.wait_for(supervisor, self.healthy(supervisor.slots[0]))
+
+        supervisor.scale('test', 2)
+        self.assertEqual([slot.spec.name for slot in supervisor.slots], ['test-0', 'test-1'])
+        self.assertEqual(supervisor.slots[1].spec.agent_class, 'commands.tests.SupervisedAgent')
+        self.wait_for(supervisor, self.healthy(supervisor.slots[1]))
+        self.assertEqual(supervisor.handler_latency_ms('test'), 12.5)
+
+        retired = supervisor.slots[1].current
+        supervisor.scale('test', 1)
+        self.assertEqual(supervisor.retiring, [retired])
+        # Worker bị scale down được drain (dừng bình thường), không tính là failure
+        self.wait_for(supervisor, lambda: not supervisor.retiring)
+        self.assertEqual(retired.process.exitcode, 0)
+        self.assertEqual(supervisor.slots[0].failures, 0)
+
+    def test_sighup_rolling_restart_replaces_healthy_worker(self):
+        supervisor = self.supervisor(startup_timeout=30)
+        slot = supervisor.slots[0]
+        previous = signal.signal(signal.SIGHUP, lambda signum, frame: supervisor.request_rolling_restart())
+        self.addCleanup(signal.signal, signal.SIGHUP, previous)
+        thread = threading.Thread(target=supervisor.run)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(supervisor.stop)
+
+        deadline = time.monotonic() + 30
+        while not (slot.current and slot.current.last_heartbeat()):
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.05)
+        old = slot.current
+
+        os.kill(os.getpid(), signal.SIGHUP)
+        while slot.current is old or old.process.is_alive():
+            self.assertLess(time.monotonic(), deadline + 30)
+            time.sleep(0.05)
+        # Worker mới healthy trước khi worker cũ được stop
+        self.assertIsNotNone(slot.current.last_heartbeat())
+        self.assertEqual(old.process.exitcode, 0)
+
+class FakeSupervisor:
+    def __init__(self, workers):
+        self.workers = workers
+        self.latency_ms = None
+        self.scaled = []
+
+    def worker_count(self, agent_type):
+        return self.workers
+
+    def handler_latency_ms(self, agent_type):
+        return self.latency_ms
+
+    def scale(self, agent_type, count):
+        self.scaled.append(count)
+        self.workers = count
+
+class AutoscalerTests(SimpleTestCase):
+    def setUp(self):
+        self.source = LocalLagSource(partitions=12)
+        self.supervisor = FakeSupervisor(workers=2)
+
+    def autoscaler(self, **policy):
+        policy = {'target_lag': 100, 'scale_up_after': 30, 'scale_down_after': 300, 'cooldown': 60, **policy}
+        return Autoscaler('device', ScalingPolicy(min_workers=1, max_workers=10, **policy), self.source, interval=10)
+
+    def run_checks(self, autoscaler, start, end):
+        for now in range(start, end + 1, 10):
+            autoscaler.check(self.supervisor, now=now)
+
+    def set_lag(self, lag):
+        self.source.consume(self.source.produced)
+        self.source.produce(lag)
+
+    def test_lag_source_requires_lag(self):
+        with self.assertRaises(TypeError):
+            LagSource()
+
+    def test_scales_up_only_after_sustained_lag(self):
+        autoscaler = self.autoscaler()
+        self.set_lag(500)
+        self.run_checks(autoscaler, 0, 20)
+        self.assertEqual(self.supervisor.scaled, [])
+        autoscaler.check(self.supervisor, now=30)
+        # Nhảy thẳng tới số workers để lag/worker về target
+        self.assertEqual(self.supervisor.scaled, [5])
+
+    def test_short_spike_does_not_scale_up(self):
+        autoscaler = self.autoscaler()
+        self.set_lag(500)
+        self.run_checks(autoscaler, 0, 20)
+        self.set_lag(100)
+        self.run_checks(autoscaler, 30, 100)
+        self.assertEqual(self.supervisor.scaled, [])
+
+    def test_hysteresis_band_keeps_worker_count(self):
+        autoscaler = self.autoscaler()
+        # 2 workers: lag/worker 60..100 nằm giữa ngưỡng down (30) và up (100)
+        for lag in (200, 120, 80, 150, 60):
+            self.set_lag(lag)
+            self.run_checks(autoscaler, 0, 1000)
+            autoscaler._next_check = 0
+        self.assertEqual(self.supervisor.scaled, [])
+
+    def test_scales_down_one_worker_at_a_time(self):
+        self.supervisor.workers = 5
+        autoscaler = self.autoscaler()
+        self.set_lag(0)
+        self.run_checks(autoscaler, 0, 290)
+        self.assertEqual(self.supervisor.scaled, [])
+        autoscaler.check(self.supervisor, now=300)
+        self.assertEqual(self.supervisor.scaled, [4])
+        # Lag vẫn thấp: pressure được đo lại từ check kế tiếp (310), chỉ bớt một worker nữa
+        self.run_checks(autoscaler, 310, 600)
+        self.assertEqual(self.supervisor.scaled, [4])
+        autoscaler.check(self.supervisor, now=610)
+        self.assertEqual(self.supervisor.scaled, [4, 3])
+
+    def test_cooldown_delays_next_scale_up(self):
+        autoscaler = self.autoscaler(scale_up_after=0, cooldown=60)
+        self.set_lag(400)
+        autoscaler.check(self.supervisor, now=0)
+        self.assertEqual(self.supervisor.scaled, [4])
+        self.set_lag(800)
+        self.run_checks(autoscaler, 10, 50)
+        self.assertEqual(self.supervisor.scaled, [4])
+        autoscaler.check(self.supervisor, now=60)
+        self.assertEqual(self.supervisor.scaled, [4, 8])
+
+    def test_never_scales_past_partition_count(self):
+        self.source.partitions = 3
+        autoscaler = self.autoscaler(scale_up_after=0)
+        self.set_lag(10000)
+        self.run_checks(autoscaler, 0, 300)
+        self.assertEqual(self.supervisor.scaled, [3])
+
+class StatusHubTests(SimpleTestCase):
+    def setUp(self):
+        self.hub = CommandStatusHub(max_entries=2, ttl=60, seed_ttl=60)
+
+    def seed(self, command_id):
+        return self.hub.seed(command_id, {'status': 'queued', 'user_id': 'owner', 'device_id': 'dev-1'})
+
+    def test_events_of_unseeded_commands_do_not_evict_entries(self):
+        self.seed('a')
+        self.seed('b')
+        for command_id in ('c', 'd', 'e'):
+            self.hub.publish(command_id, 'executing')
+        self.assertIsNone(self.hub.get('c'))
+        self.assertEqual(self.hub.get('a')['status'], 'queued')
+        self.assertEqual(self.hub.get('b')['status'], 'queued')
+
+    def test_event_updates_seeded_snapshot(self):
+        version = self.seed('a')['version']
+        self.hub.publish('a', 'completed', execution={'id': 'x'})
+        snapshot = self.hub.get('a')
+        self.assertEqual(snapshot['status'], 'completed')
+        self.assertEqual(snapshot['user_id'], 'owner')
+        self.assertGreater(snapshot['version'], version)
+
+    def test_waiter_slots_are_capped(self):
+        hub = CommandStatusHub(max_waiters=2)
+        self.assertEqual([hub.acquire_waiter() for _ in range(3)], [True, True, False])
+        hub.release_waiter()
+        self.assertTrue(hub.acquire_waiter())
+        self.assertEqual(hub.stats()['waiters'], 2)
+        self.assertEqual(hub.stats()['rejected_waiters'], 1)
+
+    def test_waiter_on_expired_snapshot_is_woken_to_reload(self):
+        version = self.seed('a')['version']
+        result = []
+        waiter = threading.Thread(target=lambda: result.append(self.hub.wait_for_change('a', version, 5)))
+        waiter.start()
+        while not self.hub.stats()['waiting']:
+            time.sleep(0.001)
+        with self.hub._lock:
+            del self.hub._entries['a']
+        self.hub.publish('a', 'executing')
+        waiter.join(1)
+        self.assertEqual(result, [None])
+        self.assertIsNone(self.hub.get('a'))
+
+class DeviceAgentLatencyTests(SimpleTestCase):
+    CONTEXT = {
+        'api_config': {'id': 'cfg-1', 'vendor_id': 'vendor-1'},
+        'command_template': {},
+        'device': {},
+        'device_command': {},
+    }
+
+    def test_slow_vendor_call_raises_handler_latency(self):
+        agent = DeviceCommandAgent('latency-test', concurrency=4)
+
+        async def slow_vendor(*args, **kwargs):
+            await asyncio.sleep(0.05)
+            return {'success': True, 'status_code': 200}
+
+        async def main():
+            # Engine worker chỉ enqueue vào device queue; latency đo quanh attempt
+            await agent.execute_device_command({'command_id': 'c1', 'device_id': 'dev-1', 'command_type': 'turn_on'},
+                                               self.CONTEXT)
+            await agent.device_queues.drain()
+
+        with mock.patch.object(agent.handler, 'execute_command_async', side_effect=slow_vendor), \
+                mock.patch('commands.agents.device_command_agent.EventPublisher'):
+            asyncio.run(main())
+        self.assertGreaterEqual(agent.handler_latency_ms(), 50)
+
+class RetryLeaseRenewalTests(TestCase):
+    GRACE = 0.4
+
+    def setUp(self):
+        with mock.patch.object(CommandResultConsumer, 'setup_consumer'):
+            self.consumer = CommandResultConsumer(batch_size=10, batch_timeout=1)
+        self.command = CommandRequest.objects.create(
+            device_id='dev-1', command_type='turn_on', user_id='owner', status='executing'
+        )
+
+    def test_retry_waiting_for_slot_past_grace_is_not_redispatched(self):
+        agent = DeviceCommandAgent('lease-test', concurrency=1)
+        command_data = {'command_id': str(self.command.id), 'device_id': 'dev-1', 'command_type': 'turn_on',
+                        'attempt': 1}
+        published = []
+
+        def publish(event_type, data):
+            published.append((time.monotonic(), event_type, data))
+
+        async def vendor(*args, **kwargs):
+            return {'success': True, 'status_code': 200}
+
+        async def main():
+            # Retry đã persist và tới hạn, nhưng mọi command slots đang bận lâu hơn grace
+            agent._command_slots = asyncio.Semaphore(1)
+            await agent._command_slots.acquire()
+            publish(EventTypes.DEVICE_COMMAND_RETRY_SCHEDULED,
+                    {'command_id': command_data['command_id'], 'retry_count': 1,
+                     'next_attempt_at': timezone.now().isoformat()})
+            agent._leases[command_data['command_id']] = time.monotonic() + self.GRACE
+            task = asyncio.ensure_future(agent._run_device_command(command_data, DeviceAgentLatencyTests.CONTEXT))
+            await asyncio.sleep(self.GRACE * 3)
+            agent._command_slots.release()
+            await task
+
+        with override_settings(COMMAND_RETRY_RECOVERY_GRACE=self.GRACE), \
+                mock.patch('commands.agents.device_command_agent.EventPublisher') as publisher, \
+                mock.patch.object(agent.handler, 'execute_command_async', side_effect=vendor):
+            publisher.publish_command_result.side_effect = publish
+            asyncio.run(main())
+
+            # Recovery lease không lúc nào hết trước khi retry chạy
+            leased_until = None
+            for at, event_type, data in published:
+                if leased_until is not None:
+                    self.assertLess(at, leased_until)
+                if event_type == EventTypes.DEVICE_COMMAND_RETRY_SCHEDULED:
+                    leased_until = at + self.GRACE
+                elif event_type == EventTypes.DEVICE_COMMAND_STARTED:
+                    self.assertIn('lease_until', data)
+                    break
+            renewals = [data for _, _, data in published if data.get('lease')]
+            self.assertGreaterEqual(len(renewals), 2)
+
+            # Áp từng event như result consumer: scheduler không dispatch lại
+            scheduler = CommandScheduler(lookahead=0)
+            for _, event_type, data in published:
+                buffer = WriteBehindBuffer()
+                self.consumer.apply(buffer, event_type, data)
+                buffer.flush()
+                if event_type == EventTypes.DEVICE_COMMAND_STARTED:
+                    break
+            with mock.patch('commands.scheduler.dispatch_command') as dispatch:
+                self.assertEqual(scheduler.claim_due(), 0)
+            dispatch.assert_not_called()
+
+class ExecutionEngineStopTests(SimpleTestCase):
+    def test_cleanup_runs_when_drain_exceeds_budget(self):
+        engine = AsyncExecutionEngine('stop-test', concurrency=1)
+        closed = threading.Event()
+
+        async def slow_drain(timeout):
+            await asyncio.sleep(60)
+
+        async def close():
+            closed.set()
+
+        engine.on_drain(slow_drain)
+        engine.on_stop(close)
+        engine.start()
+        started = time.monotonic()
+        engine.stop(drain_timeout=0.2)
+        self.assertTrue(closed.is_set())
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertFalse(engine.is_alive())
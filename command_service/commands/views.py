@@ -2,12 +2,32 @@ from rest_framework import viewsets, status, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from .models import CommandRequest, CommandExecution
+from rest_framework.renderers import JSONRenderer
+from .models import CommandBatch, CommandRequest, CommandExecution
 from .serializers import CommandRequestSerializer, CommandExecutionSerializer
+from .dispatch import device_key, dispatch_batch
+from .pagination import keyset_page
+from .archive import DATASETS, CommandArchiver
+from .blob_store import BlobStore
+from .renderers import EventStreamRenderer, format_sse
+from .status_cache import command_snapshot, status_cache
+from .status_hub import WaiterStream, status_hub
+from .deadlines import command_deadline
+from .priority import normalize_priority
+from .idempotency import IdempotencyConflict, idempotency_store, request_fingerprint
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django_filters.rest_framework import DjangoFilterBackend
 from shared.kafka.publisher import EventPublisher
 from shared.kafka.topics import Topics, EventTypes
+from shared.grpc.services.vendor_service import VendorServiceClient
+import time
 import uuid
 from shared.permissions import (
     IsAdminUser,
@@ -25,6 +45,22 @@ class CommandRequestViewSet(PermissionRequiredMixin, OrganizationFilterMixin, vi
     queryset = CommandRequest.objects.all()
     serializer_class = CommandRequestSerializer
     
+    def filter_queryset_by_organization(self, queryset):
+        """Commands không có organization: chỉ admin và owner (user_id) thấy command"""
+        user = self.request.user
+        if not user or not user.is_authenticated:
+            return queryset.none()
+        if user.role == 'admin':
+            return queryset
+        return queryset.filter(user_id=str(user.id))
+    
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve'):
+            # Serializer nest execution mới nhất: một query cho cả page
+            queryset = queryset.prefetch_related('executions')
+        return queryset
+    
     @action(detail=False, methods=['post'], url_path='execute')
     def execute_command(self, request):
         """Execute a command on a device"""
@@ -37,16 +73,74 @@ class CommandRequestViewSet(PermissionRequiredMixin, OrganizationFilterMixin, vi
                 {'error': 'device_id and command_type are required'}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
-        # Create command request
+        
+        try:
+            scheduled_at = self._parse_datetime(request.data.get('scheduled_at'), 'scheduled_at')
+            is_scheduled = scheduled_at is not None and scheduled_at > timezone.now()
+            deadline = self._parse_deadline(request.data, scheduled_at if is_scheduled else timezone.now())
+            priority = normalize_priority(request.data.get('priority'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        idempotency_key = request.headers.get('Idempotency-Key')
+        if idempotency_key is not None and not 0 < len(idempotency_key) <= 255:
+            return Response(
+                {'error': 'Idempotency-Key must be 1-255 characters'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
         command_id = str(uuid.uuid4())
-        command_request = CommandRequest.objects.create(
-            id=command_id,
-            device_id=device_id,
-            command_type=command_type,
-            command_params=params,
-            user_id=str(request.user.id),
-            status='queued'
-        )
+        user_id = str(request.user.id)
+        
+        # Retry với cùng Idempotency-Key trả về command gốc: không insert, không publish
+        if idempotency_key:
+            fingerprint = request_fingerprint(
+                device_id=device_id, command_type=command_type, params=params, scheduled_at=scheduled_at
+            )
+            try:
+                original_id = idempotency_store.claim(user_id, idempotency_key, fingerprint, command_id)
+            except IdempotencyConflict as e:
+                return Response({'error': str(e)}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if original_id:
+                return self._replayed(original_id)
+        
+        # Create command request
+        try:
+            with transaction.atomic():
+                original_id = None
+                if idempotency_key:
+                    original_id = idempotency_store.record(user_id, idempotency_key, fingerprint, command_id)
+                if original_id is None:
+                    command_request = CommandRequest.objects.create(
+                        id=command_id,
+                        device_id=device_id,
+                        command_type=command_type,
+                        command_params=params,
+                        user_id=user_id,
+                        scheduled_at=scheduled_at,
+                        deadline=deadline,
+                        priority=priority or '',
+                        status='scheduled' if is_scheduled else 'queued'
+                    )
+        except IdempotencyConflict as e:
+            return Response({'error': str(e)}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        except Exception:
+            if idempotency_key:
+                idempotency_store.release(user_id, idempotency_key)
+            raise
+        if original_id:
+            return self._replayed(original_id)
+        status_cache.set(command_id, command_snapshot(command_request))
+        
+        # Command scheduler sẽ dispatch khi tới scheduled_at
+        if is_scheduled:
+            return Response({
+                'success': True,
+                'command_id': command_id,
+                'scheduled_at': scheduled_at,
+                'deadline': deadline,
+                'message': 'Command scheduled'
+            })
         
         # Publish command request event
         EventPublisher.publish_event(
@@ -57,50 +151,428 @@ class CommandRequestViewSet(PermissionRequiredMixin, OrganizationFilterMixin, vi
                 'device_id': device_id,
                 'command_type': command_type,
                 'command_params': params,
-                'user_id': str(request.user.id)
-            }
+                'user_id': user_id,
+                'deadline': deadline.isoformat() if deadline else None,
+                'priority': priority
+            },
+            key=device_key(device_id)
         )
         
         return Response({
             'success': True,
             'command_id': command_id,
+            'deadline': deadline,
             'message': 'Command execution initiated'
         })
     
+    def _replayed(self, command_id):
+        """Response cho request trùng Idempotency-Key: command_id + status của command gốc"""
+        snapshot = status_cache.get(command_id)
+        if snapshot is not None:
+            command_status = snapshot['status']
+        else:
+            # None khi request gốc chưa commit xong
+            command_status = CommandRequest.objects.filter(id=command_id).values_list('status', flat=True).first()
+        return Response({
+            'success': True,
+            'command_id': command_id,
+            'status': command_status,
+            'message': 'Duplicate request, returning original command'
+        }, headers={'Idempotent-Replayed': 'true'})
+    
+    @action(detail=False, methods=['post'], url_path='execute-bulk')
+    def execute_bulk(self, request):
+        """Execute một command trên nhiều devices (device_ids hoặc filter)"""
+        command_type = request.data.get('command_type')
+        params = request.data.get('params', {})
+        device_ids = request.data.get('device_ids')
+        device_filter = request.data.get('filter') or {}
+        
+        if not command_type or not (device_ids or device_filter):
+            return Response(
+                {'error': 'command_type and device_ids or filter are required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if device_ids is not None and not isinstance(device_ids, list):
+            return Response(
+                {'error': 'device_ids must be a list'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            scheduled_at = self._parse_datetime(request.data.get('scheduled_at'), 'scheduled_at')
+            is_scheduled = scheduled_at is not None and scheduled_at > timezone.now()
+            deadline = self._parse_deadline(request.data, scheduled_at if is_scheduled else timezone.now())
+            # Bulk mặc định vào lane low để không chặn commands tương tác
+            priority = normalize_priority(request.data.get('priority')) or settings.BULK_COMMAND_DEFAULT_LANE
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        max_devices = settings.BULK_COMMAND_MAX_DEVICES
+        if not device_ids:
+            # Resolve filter qua vendor service
+            try:
+                device_ids = VendorServiceClient().list_device_ids(
+                    command_type=command_type,
+                    vendor_id=device_filter.get('vendor_id'),
+                    model=device_filter.get('model'),
+                    api_config_id=device_filter.get('api_config_id'),
+                    limit=max_devices + 1
+                )
+            except Exception as e:
+                return Response(
+                    {'error': f'Failed to resolve device filter: {e}'},
+                    status=status.HTTP_502_BAD_GATEWAY
+                )
+        
+        device_ids = list(dict.fromkeys(str(device_id) for device_id in device_ids if device_id))
+        if not device_ids:
+            return Response(
+                {'error': 'No devices matched'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(device_ids) > max_devices:
+            return Response(
+                {'error': f'Bulk commands are limited to {max_devices} devices'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        user_id = str(request.user.id)
+        
+        with transaction.atomic():
+            batch = CommandBatch.objects.create(
+                command_type=command_type,
+                command_params=params,
+                device_filter=device_filter,
+                total=len(device_ids),
+                user_id=user_id,
+                scheduled_at=scheduled_at
+            )
+            commands = CommandRequest.objects.bulk_create([
+                CommandRequest(
+                    id=uuid.uuid4(),
+                    device_id=device_id,
+                    command_type=command_type,
+                    command_params=params,
+                    user_id=user_id,
+                    batch=batch,
+                    scheduled_at=scheduled_at,
+                    deadline=deadline,
+                    priority=priority,
+                    status='scheduled' if is_scheduled else 'queued'
+                )
+                for device_id in device_ids
+            ], batch_size=1000)
+        status_cache.set_many({command.id: command_snapshot(command) for command in commands})
+        
+        # Command scheduler sẽ dispatch từng command khi tới scheduled_at
+        if not is_scheduled:
+            dispatch_batch(batch.id, [
+                {
+                    'command_id': str(command.id),
+                    'device_id': command.device_id,
+                    'command_type': command_type,
+                    'command_params': params,
+                    'user_id': user_id,
+                    'batch_id': str(batch.id),
+                    'max_retries': command.max_retries,
+                    'created_at': command.created_at.isoformat(),
+                    'deadline': deadline.isoformat() if deadline else None
+                }
+                for command in commands
+            ], chunk_size=settings.BULK_COMMAND_CHUNK_SIZE, priority=priority)
+        
+        return Response({
+            'success': True,
+            'batch_id': str(batch.id),
+            'total': batch.total,
+            'scheduled_at': scheduled_at,
+            'priority': priority,
+            'progress': batch.progress(),
+            'message': 'Bulk command scheduled' if is_scheduled else 'Bulk command execution initiated'
+        })
+    
+    @action(detail=False, methods=['get'], url_path=r'batches/(?P<batch_id>[^/.]+)')
+    def batch_progress(self, request, batch_id=None):
+        """Get aggregate progress của một bulk batch (cùng owner scoping như commands)"""
+        try:
+            batch = get_object_or_404(self.filter_queryset_by_organization(CommandBatch.objects.all()), id=batch_id)
+        except ValidationError:
+            return Response({'error': 'Invalid batch_id'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(batch.progress())
+    
+    @action(detail=False, methods=['get'], url_path='archive')
+    def archive(self, request):
+        """Query command history đã archive theo device và time range (chỉ commands của user, trừ admin)"""
+        device_id = request.query_params.get('device_id')
+        dataset = request.query_params.get('type', 'requests')
+        if not device_id:
+            return Response({'error': 'device_id is required'}, status=status.HTTP_400_BAD_REQUEST)
+        if dataset not in DATASETS:
+            return Response(
+                {'error': f"type must be one of: {', '.join(DATASETS)}"}, status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            start = self._parse_datetime(request.query_params.get('start'), 'start')
+            end = self._parse_datetime(request.query_params.get('end'), 'end')
+            limit = min(
+                int(request.query_params.get('limit', settings.COMMAND_ARCHIVE_QUERY_LIMIT)),
+                settings.COMMAND_ARCHIVE_QUERY_MAX_LIMIT
+            )
+            if limit < 1:
+                raise ValueError('limit must be positive')
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Cùng owner scoping như commands còn trong DB
+        user = request.user
+        user_id = None if user.role == 'admin' else str(user.id)
+        results = CommandArchiver().query(
+            device_id, start=start, end=end, dataset=dataset, limit=limit, user_id=user_id
+        )
+        return Response({
+            'device_id': device_id,
+            'type': dataset,
+            'count': len(results),
+            'results': results
+        })
+    
+    @action(detail=False, methods=['get'], url_path='timeline')
+    def timeline(self, request):
+        """
+        Commands của một device (mới nhất trước) kèm execution mới nhất.
+        Filters: status (phân cách bởi dấu phẩy), start/end theo created_at;
+        page tiếp theo qua ?cursor= (next_cursor của page trước).
+        """
+        device_id = request.query_params.get('device_id')
+        if not device_id:
+            return Response({'error': 'device_id is required'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            start = self._parse_datetime(request.query_params.get('start'), 'start')
+            end = self._parse_datetime(request.query_params.get('end'), 'end')
+            limit = min(
+                int(request.query_params.get('limit', settings.COMMAND_TIMELINE_PAGE_SIZE)),
+                settings.COMMAND_TIMELINE_MAX_PAGE_SIZE
+            )
+            if limit < 1:
+                raise ValueError('limit must be positive')
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        queryset = self.get_queryset().filter(device_id=device_id)
+        statuses = [s for s in request.query_params.get('status', '').split(',') if s]
+        if statuses:
+            queryset = queryset.filter(status__in=statuses)
+        if start:
+            queryset = queryset.filter(created_at__gte=start)
+        if end:
+            queryset = queryset.filter(created_at__lt=end)
+        
+        try:
+            commands, next_cursor = keyset_page(queryset, request.query_params.get('cursor'), limit)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if commands:
+            # Executions của cả page trong một query; completed_at luôn sau
+            # created_at của command nên giới hạn dưới này prune các partitions cũ
+            prefetch_related_objects(commands, Prefetch(
+                'executions',
+                queryset=CommandExecution.objects.filter(completed_at__gte=commands[-1].created_at)
+            ))
+        
+        return Response({
+            'device_id': device_id,
+            'count': len(commands),
+            'next_cursor': next_cursor,
+            'results': CommandRequestSerializer(commands, many=True).data
+        })
+    
+    def _parse_datetime(self, value, field):
+        """Parse datetime (ISO 8601), None nếu không có"""
+        if not value:
+            return None
+        parsed = parse_datetime(str(value))
+        if parsed is None:
+            raise ValueError(f'{field} must be an ISO 8601 datetime')
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+    
+    def _parse_deadline(self, data, start):
+        """
+        Deadline của command: `deadline` (ISO 8601) hoặc `timeout` (giây tính
+        từ start = scheduled_at/now, mặc định COMMAND_DEFAULT_TIMEOUT, 0 =
+        không giới hạn)
+        """
+        deadline = self._parse_datetime(data.get('deadline'), 'deadline')
+        if deadline is not None:
+            if deadline <= start:
+                raise ValueError('deadline must be after scheduled_at and in the future')
+            return deadline
+        
+        try:
+            timeout = float(data.get('timeout', settings.COMMAND_DEFAULT_TIMEOUT))
+        except (TypeError, ValueError):
+            raise ValueError('timeout must be a number of seconds')
+        if not 0 <= timeout <= settings.COMMAND_MAX_TIMEOUT:
+            raise ValueError(f'timeout must be between 0 and {settings.COMMAND_MAX_TIMEOUT} seconds')
+        return command_deadline(start, timeout)
+    
     @action(detail=True, methods=['get'])
     def status(self, request, pk=None):
-        """Get command execution status"""
+        """Get command execution status (?wait=N: long-poll tới khi status thay đổi)"""
         try:
-            command = self.get_object()
-            
-            # Get the latest execution if available
-            execution = CommandExecution.objects.filter(
-                command_request_id=command.id
-            ).order_by('-completed_at').first()
-            
-            result = {
-                'command_id': str(command.id),
-                'status': command.status,
-                'device_id': command.device_id,
-                'command_type': command.command_type,
-                'created_at': command.created_at,
-                'updated_at': command.updated_at,
-            }
-            
-            if execution:
-                result['execution'] = {
-                    'execution_id': str(execution.id),
-                    'agent_id': execution.agent_id,
-                    'started_at': execution.started_at,
-                    'completed_at': execution.completed_at,
-                    'execution_time': execution.execution_time,
-                    'result': execution.result
-                }
-            
-            return Response(result)
+            wait = min(float(request.query_params.get('wait', 0)), settings.COMMAND_STATUS_MAX_WAIT)
+        except ValueError:
+            return Response({'error': 'wait must be a number of seconds'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            snapshot = self._current_status(pk)
+            if wait > 0 and status_hub.start() and not status_hub.is_final(snapshot):
+                if not status_hub.acquire_waiter():
+                    return self._waiters_busy()
+                try:
+                    snapshot = (
+                        status_hub.wait_for_change(pk, snapshot['version'], wait)
+                        or self._current_status(pk)
+                    )
+                finally:
+                    status_hub.release_waiter()
+            return Response(snapshot)
             
+        except Http404:
+            raise
         except Exception as e:
             return Response(
                 {'error': str(e)}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
\ No newline at end of file
+            )
+    
+    @action(detail=True, methods=['get'], renderer_classes=[JSONRenderer, EventStreamRenderer])
+    def stream(self, request, pk=None):
+        """Server-sent events: push status mỗi khi thay đổi, đóng stream khi command kết thúc"""
+        if not status_hub.start():
+            return Response({'error': 'Status stream unavailable'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        if not status_hub.acquire_waiter():
+            return self._waiters_busy()
+        
+        try:
+            snapshot = self._current_status(pk)
+        except Exception:
+            status_hub.release_waiter()
+            raise
+        events = WaiterStream(status_hub, self._status_events(pk, snapshot))
+        response = StreamingHttpResponse(events, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+    
+    def _waiters_busy(self):
+        """503 khi process đã đủ COMMAND_STATUS_MAX_WAITERS streams / long-polls"""
+        response = Response(
+            {'error': 'Too many status waiters, retry later'},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+        response['Retry-After'] = str(settings.COMMAND_STATUS_BUSY_RETRY_AFTER)
+        return response
+    
+    def _status_events(self, pk, snapshot):
+        deadline = time.monotonic() + settings.COMMAND_STATUS_STREAM_TIMEOUT
+        yield format_sse(snapshot, event='status', event_id=snapshot['version'])
+        
+        while not status_hub.is_final(snapshot):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            changed = status_hub.wait_for_change(
+                pk, snapshot['version'], min(settings.COMMAND_STATUS_KEEPALIVE, remaining)
+            )
+            if changed is None:
+                # Snapshot hết hạn trong hub: load lại (có thể đã lỡ event)
+                changed = self._current_status(pk)
+                if changed['status'] == snapshot['status']:
+                    snapshot = changed
+                    yield ': keepalive\n\n'
+                    continue
+            elif changed['version'] == snapshot['version']:
+                yield ': keepalive\n\n'
+                continue
+            snapshot = changed
+            yield format_sse(snapshot, event='status', event_id=snapshot['version'])
+    
+    def _current_status(self, pk):
+        """
+        Status snapshot: hub (push) → status cache → DB. Snapshot từ hub /
+        cache được check quyền theo owner trong snapshot như get_object();
+        snapshot không có owner (ghi bởi version cũ) được load lại từ DB.
+        """
+        hub_started = status_hub.start()
+        if hub_started:
+            snapshot = status_hub.get(pk)
+            if snapshot is not None and 'user_id' in snapshot:
+                return self._check_snapshot_access(snapshot)
+        
+        snapshot = status_cache.get(pk)
+        if snapshot is None or 'user_id' not in snapshot:
+            snapshot = self._load_status()
+            status_cache.set(pk, snapshot)
+        else:
+            self._check_snapshot_access(snapshot)
+        return status_hub.seed(pk, snapshot) if hub_started else snapshot
+    
+    def _check_snapshot_access(self, snapshot):
+        """Cùng filter + object permissions như get_object(), không query DB"""
+        command = CommandRequest(
+            id=snapshot['command_id'],
+            user_id=snapshot['user_id'],
+            device_id=snapshot.get('device_id'),
+            command_type=snapshot.get('command_type')
+        )
+        user = self.request.user
+        if not user or not user.is_authenticated or (user.role != 'admin' and str(command.user_id) != str(user.id)):
+            raise Http404
+        self.check_object_permissions(self.request, command)
+        return snapshot
+    
+    def _load_status(self):
+        """Load status snapshot từ DB"""
+        command = self.get_object()
+        
+        # Get the latest execution if available
+        execution = CommandExecution.objects.filter(
+            command_request_id=command.id
+        ).order_by('-completed_at').first()
+        
+        return command_snapshot(command, execution)
+    
+    @action(detail=True, methods=['get'])
+    def response(self, request, pk=None):
+        """Full vendor response của execution mới nhất (hoặc ?execution_id=)"""
+        command = self.get_object()
+        executions = CommandExecution.objects.filter(command_request_id=command.id)
+        execution_id = request.query_params.get('execution_id')
+        try:
+            execution = (
+                executions.filter(id=execution_id) if execution_id else executions.order_by('-completed_at')
+            ).first()
+        except ValidationError:
+            execution = None
+        if execution is None:
+            return Response({'error': 'Execution not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        response_data = execution.response_data
+        # Body lớn được offload vào blob store; ref do agent ghi vào result,
+        # không lấy từ response_data (nội dung của vendor)
+        blob_ref = (execution.result or {}).get('response_blob')
+        if not blob_ref:
+            return Response(response_data)
+        
+        try:
+            content = BlobStore().get(blob_ref)
+        except (FileNotFoundError, ValueError):
+            return Response({'error': 'Response body no longer available'}, status=status.HTTP_404_NOT_FOUND)
+        content_type = (response_data or {}).get('content_type') if isinstance(response_data, dict) else None
+        return HttpResponse(content, content_type=content_type or 'application/octet-stream')
@@ -0,0 +1,118 @@
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from shared.kafka import metrics_aggregator
+from commands.models import CommandExecution, CommandRequest
+
+class WriteBehindBuffer:
+    """
+    Gom status transitions của CommandRequest và CommandExecution records,
+    ghi bằng bulk_update/bulk_create khi caller gọi flush() (result consumer
+    flush mỗi Kafka batch trước khi commit offsets) hoặc khi buffer đủ
+    `max_rows` rows.
+
+    Các updates của cùng một command được merge theo thứ tự nhận (update sau
+    ghi đè field của update trước), nên thứ tự per-command được giữ nguyên.
+    Executions có id do agent sinh ra và được insert với ignore_conflicts,
+    nên ghi lại cùng một outcome là idempotent.
+    """
+
+    def __init__(self, max_rows=500):
+        self.max_rows = max_rows
+
+        self._updates = {}
+        self._executions = []
+        self._stats = {'flushes': 0, 'updates': 0, 'executions': 0, 'queries': 0, 'errors': 0}
+
+    def update_status(self, command_id, **fields):
+        """Buffer update cho một CommandRequest (ví dụ status, retry_count)"""
+        pending = self._updates.pop(str(command_id), {})
+        pending.update(fields)
+        # Re-insert để dict giữ thứ tự update cuối cùng
+        self._updates[str(command_id)] = pending
+        self._flush_if_full()
+
+    def add_execution(self, **fields):
+        """Buffer một CommandExecution record"""
+        self._executions.append(CommandExecution(**fields))
+        self._flush_if_full()
+
+    def _flush_if_full(self):
+        if self.pending() >= self.max_rows:
+            self.flush()
+
+    def pending(self):
+        return len(self._updates) + len(self._executions)
+
+    def flush(self):
+        """
+        Ghi tất cả buffered rows xuống DB.
+
+        Lỗi dữ liệu (IntegrityError) được xử lý bằng cách ghi từng row; lỗi
+        khác (ví dụ mất kết nối DB) đưa rows trở lại buffer rồi raise.
+        """
+        updates, self._updates = self._updates, {}
+        executions, self._executions = self._executions, []
+        if not updates and not executions:
+            return 0
+
+        try:
+            queries = self._write(updates, executions)
+        except IntegrityError as e:
+            print(f"Write-behind batch flush failed, retrying row by row: {e}")
+            self._stats['errors'] += 1
+            queries = self._write_rows(updates, executions)
+        except Exception:
+            self._stats['errors'] += 1
+            # Rows chưa ghi được giữ lại cho lần flush sau
+            self._updates, self._executions = updates, executions
+            raise
+
+        self._stats['flushes'] += 1
+        self._stats['updates'] += len(updates)
+        self._stats['executions'] += len(executions)
+        self._stats['queries'] += queries
+        metrics_aggregator.increment('write_behind_rows', len(updates) + len(executions))
+        metrics_aggregator.increment('write_behind_queries', queries)
+        return len(updates) + len(executions)
+
+    def _write(self, updates, executions):
+        """Một transaction: bulk_update theo từng field set và bulk_create executions"""
+        now = timezone.now()
+        by_fields = {}
+        for command_id, fields in updates.items():
+            by_fields.setdefault(tuple(sorted(fields)), []).append(
+                CommandRequest(id=command_id, updated_at=now, **fields)
+            )
+
+        queries = 0
+        with transaction.atomic():
+            for field_names, objs in by_fields.items():
+                CommandRequest.objects.bulk_update(objs, [*field_names, 'updated_at'], batch_size=self.max_rows)
+                queries += 1
+            if executions:
+                CommandExecution.objects.bulk_create(
+                    executions, batch_size=self.max_rows, ignore_conflicts=True
+                )
+                queries += 1
+        return queries
+
+    def _write_rows(self, updates, executions):
+        """Fallback: ghi từng row để một row lỗi không làm mất cả batch"""
+        queries = 0
+        for command_id, fields in updates.items():
+            try:
+                CommandRequest.objects.filter(id=command_id).update(updated_at=timezone.now(), **fields)
+            except Exception as e:
+                print(f"Write-behind failed to update command {command_id}: {e}")
+            queries += 1
+        for execution in executions:
+            try:
+                with transaction.atomic():
+                    CommandExecution.objects.bulk_create([execution], ignore_conflicts=True)
+            except Exception as e:
+                print(f"Write-behind dropped execution for command {execution.command_request_id}: {e}")
+            queries += 1
+        return queries
+
+    def stats(self):
+        return {**self._stats, 'pending': self.pending()}
@@ -54,6 +54,11 @@ class VendorServiceStub(object):
                 request_serializer=vendor__service__pb2.DeviceRequest.SerializeToString,
                 response_deserializer=vendor__service__pb2.GetDeviceResponse.FromString,
                 _registered_method=True)
+        self.ListDeviceIds = channel.unary_unary(
+                '/vendor.VendorService/ListDeviceIds',
+                request_serializer=vendor__service__pb2.ListDeviceIdsRequest.SerializeToString,
+                response_deserializer=vendor__service__pb2.ListDeviceIdsResponse.FromString,
+                _registered_method=True)
 
 
 class VendorServiceServicer(object):
@@ -83,6 +88,12 @@ class VendorServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def ListDeviceIds(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_VendorServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -106,6 +117,11 @@ def add_VendorServiceServicer_to_server(servicer, server):
                     request_deserializer=vendor__service__pb2.DeviceRequest.FromString,
                     response_serializer=vendor__service__pb2.GetDeviceResponse.SerializeToString,
             ),
+            'ListDeviceIds': grpc.unary_unary_rpc_method_handler(
+                    servicer.ListDeviceIds,
+                    request_deserializer=vendor__service__pb2.ListDeviceIdsRequest.FromString,
+                    response_serializer=vendor__service__pb2.ListDeviceIdsResponse.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'vendor.VendorService', rpc_method_handlers)
@@ -224,3 +240,30 @@ class VendorService(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def ListDeviceIds(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/vendor.VendorService/ListDeviceIds',
+            vendor__service__pb2.ListDeviceIdsRequest.SerializeToString,
+            vendor__service__pb2.ListDeviceIdsResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
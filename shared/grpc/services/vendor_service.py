@@ -107,6 +107,8 @@ class VendorServiceClient(BaseServiceClient):
                     'created_by': response.api_config.created_by,
                     'created_at': response.api_config.created_at,
                     'updated_at': response.api_config.updated_at,
+                    'rate_limit': response.api_config.rate_limit,
+                    'rate_limit_burst': response.api_config.rate_limit_burst,
                 }
                 print(f"Converted API config: {api_config_dict}")
                 return api_config_dict
@@ -144,6 +146,8 @@ class VendorServiceClient(BaseServiceClient):
                     'api_config_id': response.command_template.api_config_id,
                     'created_at': response.command_template.created_at,
                     'updated_at': response.command_template.updated_at,
+                    'coalesce': response.command_template.coalesce,
+                    'priority': response.command_template.priority,
                 }
                 print(f"Converted command template: {template_dict}")
                 return template_dict
@@ -193,6 +197,24 @@ class VendorServiceClient(BaseServiceClient):
         except Exception as e:
             raise Exception(f"Failed to get device: {str(e)}")
 
+    def list_device_ids(self, command_type, vendor_id='', model='', api_config_id='', limit=0):
+        """List IDs của devices hỗ trợ command_type, lọc theo vendor/model/api config"""
+        try:
+            request = vendor_service_pb2.ListDeviceIdsRequest(
+                command_type=command_type,
+                vendor_id=vendor_id or '',
+                model=model or '',
+                api_config_id=api_config_id or '',
+                limit=limit or 0
+            )
+            response = self.stub.ListDeviceIds(request)
+            return list(response.device_ids)
+            
+        except grpc.RpcError as e:
+            raise Exception(f"gRPC error: {e.details()}")
+        except Exception as e:
+            raise Exception(f"Failed to list devices: {str(e)}")
+
     def get_command_context(self, device_id, command_type):
         """Get command context for device"""
         try:
@@ -243,6 +265,8 @@ class VendorServiceClient(BaseServiceClient):
                     'created_by': response.api_config.created_by,
                     'created_at': response.api_config.created_at,
                     'updated_at': response.api_config.updated_at,
+                    'rate_limit': response.api_config.rate_limit,
+                    'rate_limit_burst': response.api_config.rate_limit_burst,
                 },
                 'command_template': {
                     'id': response.command_template.id,
@@ -262,6 +286,8 @@ class VendorServiceClient(BaseServiceClient):
                     'api_config_id': response.command_template.api_config_id,
                     'created_at': response.command_template.created_at,
                     'updated_at': response.command_template.updated_at,
+                    'coalesce': response.command_template.coalesce,
+                    'priority': response.command_template.priority,
                 },
                 'device_command': {
                     'id': response.device_command.id,
@@ -1,7 +1,8 @@
 from .service import KafkaService, kafka_service
 from .publisher import EventPublisher
 from .topics import Topics, EventTypes
-from .decorators import kafka_event, kafka_audit
+from .decorators import kafka_event, kafka_audit, kafka_command_tracking
+from .metrics import MetricsAggregator, metrics_aggregator
 
 from .publisher import (
     publish_vendor_created,
@@ -17,6 +18,9 @@ __all__ = [
     'EventTypes',
     'kafka_event',
     'kafka_audit',
+    'kafka_command_tracking',
+    'MetricsAggregator',
+    'metrics_aggregator',
     'publish_vendor_created',
     'publish_command_executed',
     'publish_command_failed',
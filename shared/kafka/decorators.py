@@ -4,6 +4,7 @@ import time
 from typing import Dict, Any, Callable, Optional
 from .publisher import EventPublisher
 from .topics import Topics, EventTypes
+from .metrics import metrics_aggregator
 
 def kafka_event(topic: str, event_type: str, 
                 data_extractor: Optional[Callable] = None,
@@ -128,65 +129,89 @@ def kafka_audit(resource_type: str, action: str = None,
         return wrapper
     return decorator
 
-def kafka_command_tracking(device_id_extractor: Callable = None):
+def kafka_command_tracking(device_id_extractor: Callable = None,
+                           vendor_id_extractor: Callable = None,
+                           sample_rate: Optional[float] = None):
     """
     Decorator để track command execution
+    
+    Metrics được gom vào metrics_aggregator và flush định kỳ lên
+    Topics.METRICS_EVENTS. Per-call events (COMMAND_EXECUTING/EXECUTED/FAILED)
+    chỉ được publish cho một phần nhỏ các lần gọi (sample_rate) để debug.
+    
+    Args:
+        device_id_extractor: Function để extract device ID từ args/kwargs
+        vendor_id_extractor: Function để extract vendor ID từ args/kwargs
+        sample_rate: Tỉ lệ publish per-call events (mặc định lấy từ
+            KAFKA_COMMAND_EVENT_SAMPLE_RATE, 0 = tắt)
     """
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            import time
-            
-            # Extract device ID
+            # Extract device/vendor ID
             device_id = None
             if device_id_extractor:
                 device_id = device_id_extractor(args, kwargs)
+            vendor_id = None
+            if vendor_id_extractor:
+                vendor_id = vendor_id_extractor(args, kwargs)
             
-            # Track command start
             start_time = time.time()
             command_type = kwargs.get('command_type', func.__name__)
+            sampled = metrics_aggregator.should_sample(sample_rate)
             
-            EventPublisher.publish_command_event(
-                EventTypes.COMMAND_EXECUTING,
-                {
-                    'device_id': device_id,
-                    'command_type': command_type,
-                    'start_time': start_time
-                }
-            )
+            if sampled:
+                EventPublisher.publish_command_event(
+                    EventTypes.COMMAND_EXECUTING,
+                    {
+                        'device_id': device_id,
+                        'command_type': command_type,
+                        'start_time': start_time
+                    }
+                )
             
             try:
                 # Execute command
                 result = func(*args, **kwargs)
                 execution_time = time.time() - start_time
                 
-                # Track success
-                EventPublisher.publish_command_event(
-                    EventTypes.COMMAND_EXECUTED,
-                    {
-                        'device_id': device_id,
-                        'command_type': command_type,
-                        'result': result,
-                        'execution_time': execution_time
-                    }
+                metrics_aggregator.record_command(
+                    command_type, True, execution_time,
+                    device_id=device_id, vendor_id=vendor_id
                 )
                 
+                if sampled:
+                    EventPublisher.publish_command_event(
+                        EventTypes.COMMAND_EXECUTED,
+                        {
+                            'device_id': device_id,
+                            'command_type': command_type,
+                            'result': result,
+                            'execution_time': execution_time
+                        }
+                    )
+                
                 return result
                 
             except Exception as e:
                 execution_time = time.time() - start_time
                 
-                # Track failure
-                EventPublisher.publish_command_event(
-                    EventTypes.COMMAND_FAILED,
-                    {
-                        'device_id': device_id,
-                        'command_type': command_type,
-                        'error': str(e),
-                        'execution_time': execution_time
-                    }
+                metrics_aggregator.record_command(
+                    command_type, False, execution_time,
+                    device_id=device_id, vendor_id=vendor_id
                 )
                 
+                if sampled:
+                    EventPublisher.publish_command_event(
+                        EventTypes.COMMAND_FAILED,
+                        {
+                            'device_id': device_id,
+                            'command_type': command_type,
+                            'error': str(e),
+                            'execution_time': execution_time
+                        }
+                    )
+                
                 raise
         
         return wrapper
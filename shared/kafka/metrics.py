@@ -0,0 +1,219 @@
+import logging
+import os
+import random
+import threading
+import time
+from typing import Dict, Any, Optional, Tuple
+
+from .service import kafka_service
+from .topics import Topics, EventTypes
+
+logger = logging.getLogger(__name__)
+
+# Bucket upper bounds (ms) cho latency histogram, bucket cuối là +Inf
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram (ms)"""
+
+    __slots__ = ('buckets', 'count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value_ms: float):
+        index = len(LATENCY_BUCKETS_MS)
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if value_ms <= bound:
+                index = i
+                break
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += value_ms
+        self.min = value_ms if self.min is None else min(self.min, value_ms)
+        self.max = value_ms if self.max is None else max(self.max, value_ms)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Ước lượng quantile (ms): nội suy tuyến tính trong bucket chứa rank"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            if count and seen + count >= rank:
+                lower = LATENCY_BUCKETS_MS[index - 1] if index > 0 else 0.0
+                upper = LATENCY_BUCKETS_MS[index] if index < len(LATENCY_BUCKETS_MS) else self.max
+                value = lower + (upper - lower) * (rank - seen) / count
+                return min(max(value, self.min), self.max)
+            seen += count
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        quantiles = {f'p{int(q * 100)}_ms': self.quantile(q) for q in (0.5, 0.95, 0.99)}
+        return {
+            'count': self.count,
+            'sum_ms': round(self.total, 3),
+            'min_ms': round(self.min, 3) if self.min is not None else None,
+            'max_ms': round(self.max, 3) if self.max is not None else None,
+            **{key: round(value, 3) if value is not None else None for key, value in quantiles.items()},
+            'bounds_ms': list(LATENCY_BUCKETS_MS),
+            'buckets': list(self.buckets),
+        }
+
+
+class MetricsAggregator:
+    """
+    In-process metrics aggregator.
+
+    Gom counters và latency histograms theo window, flush một summary gọn
+    lên Topics.METRICS_EVENTS mỗi `flush_interval` giây thay vì publish
+    một event cho mỗi lần gọi.
+    """
+
+    def __init__(self, flush_interval: Optional[float] = None,
+                 topic: str = Topics.METRICS_EVENTS,
+                 command_scope: Optional[str] = None,
+                 event_sample_rate: Optional[float] = None):
+        self.flush_interval = flush_interval or float(os.getenv('METRICS_FLUSH_INTERVAL', '10'))
+        self.topic = topic
+        # 'vendor' gom theo vendor (cardinality thấp), 'device' gom theo từng device
+        self.command_scope = command_scope or os.getenv('METRICS_COMMAND_SCOPE', 'vendor')
+        if event_sample_rate is None:
+            event_sample_rate = float(os.getenv('KAFKA_COMMAND_EVENT_SAMPLE_RATE', '0'))
+        self.event_sample_rate = event_sample_rate
+
+        self._lock = threading.Lock()
+        self._commands: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._gauges: Dict[Tuple[str, Tuple], float] = {}
+        self._window_start = time.time()
+
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def record_command(self, command_type: str, success: bool, latency: float,
+                       device_id: Optional[str] = None, vendor_id: Optional[str] = None):
+        """Record một command execution (latency tính bằng giây)"""
+        if self.command_scope == 'vendor' and vendor_id:
+            scope, scope_id = 'vendor', str(vendor_id)
+        else:
+            scope, scope_id = 'device', str(device_id or 'unknown')
+
+        key = (command_type or 'unknown', scope, scope_id)
+        with self._lock:
+            entry = self._commands.get(key)
+            if entry is None:
+                entry = {'success': 0, 'failure': 0, 'latency': LatencyHistogram()}
+                self._commands[key] = entry
+            entry['success' if success else 'failure'] += 1
+            entry['latency'].observe(latency * 1000.0)
+
+        self._ensure_started()
+
+    def increment(self, name: str, value: float = 1, **labels):
+        """Tăng counter trong window hiện tại"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        self._ensure_started()
+
+    def set_gauge(self, name: str, value: float, **labels):
+        """Set gauge (giữ giá trị cuối cùng qua các window)"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+        self._ensure_started()
+
+    def should_sample(self, sample_rate: Optional[float] = None) -> bool:
+        """Quyết định có publish per-call debug event hay không"""
+        rate = self.event_sample_rate if sample_rate is None else sample_rate
+        return rate > 0 and random.random() < rate
+
+    def snapshot(self, reset: bool = True) -> Dict[str, Any]:
+        """Lấy summary của window hiện tại"""
+        now = time.time()
+        with self._lock:
+            commands = self._commands
+            counters = self._counters
+            gauges = dict(self._gauges)
+            window_start = self._window_start
+            if reset:
+                self._commands = {}
+                self._counters = {}
+                self._window_start = now
+
+        return {
+            'window_start': window_start,
+            'window_end': now,
+            'source_pid': os.getpid(),
+            'commands': [
+                {
+                    'command_type': command_type,
+                    'scope': scope,
+                    'scope_id': scope_id,
+                    'success': entry['success'],
+                    'failure': entry['failure'],
+                    'latency': entry['latency'].to_dict(),
+                }
+                for (command_type, scope, scope_id), entry in commands.items()
+            ],
+            'counters': [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in counters.items()
+            ],
+            'gauges': [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in gauges.items()
+            ],
+        }
+
+    def flush(self) -> bool:
+        """Flush summary của window hiện tại lên Kafka"""
+        summary = self.snapshot(reset=True)
+        if not summary['commands'] and not summary['counters'] and not summary['gauges']:
+            return False
+
+        return kafka_service.send_event(
+            topic=self.topic,
+            event_type=EventTypes.METRICS_SUMMARY,
+            data=summary,
+            key=os.getenv('SERVICE_NAME', 'unknown')
+        )
+
+    def start(self):
+        """Start background flush thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop flush thread và flush phần còn lại"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=self.flush_interval)
+            self._thread = None
+        self.flush()
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self.start()
+
+    def _flush_loop(self):
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush metrics summary: {e}")
+
+
+# Global instance
+metrics_aggregator = MetricsAggregator()
@@ -79,6 +79,16 @@ class EventPublisher:
             key=command_data.get('device_id', command_data.get('command_id', ''))
         )
     
+    @staticmethod
+    def publish_command_result(event_type: str, result_data: Dict[str, Any]):
+        """Publish command outcome cho result ingestion (key theo command để giữ thứ tự)"""
+        kafka_service.send_event(
+            topic=Topics.COMMAND_RESULTS,
+            event_type=event_type,
+            data=serialize_for_kafka(result_data),
+            key=str(result_data.get('command_id', ''))
+        )
+    
     @staticmethod
     def publish_audit_event(action: str, resource_type: str, resource_id: str,
                            user_id: str, changes: Optional[Dict[str, Any]] = None):
@@ -128,6 +138,15 @@ class EventPublisher:
             headers=headers
         )
 
+    @staticmethod
+    def publish_events(topic: str, events: list):
+        """Publish nhiều events với một lần flush (events: list of {'event_type', 'data', 'key'})"""
+        print(f"Publishing {len(events)} events to topic {topic}")
+        return kafka_service.send_events(
+            topic=topic,
+            events=[{**event, 'data': serialize_for_kafka(event['data'])} for event in events]
+        )
+
 def publish_vendor_created(vendor_id: str, vendor_name: str, user_id: str):
     """Publish vendor created event"""
     EventPublisher.publish_vendor_event(
@@ -4,6 +4,7 @@ import threading
 import time
 import uuid
 import os
+from collections import deque
 from typing import Dict, Any, Optional, Callable
 from datetime import datetime
 
@@ -11,12 +12,12 @@ logger = logging.getLogger(__name__)
 
 # Check if confluent_kafka is available
 try:
-    from confluent_kafka import Producer, Consumer, KafkaError, KafkaException
+    from confluent_kafka import Producer, Consumer, KafkaError, KafkaException, TopicPartition
     KAFKA_AVAILABLE = True
 except ImportError:
     logger.warning("confluent-kafka not installed. Kafka functionality will be disabled.")
     KAFKA_AVAILABLE = False
-    Producer = Consumer = KafkaError = KafkaException = None
+    Producer = Consumer = KafkaError = KafkaException = TopicPartition = None
 
 class KafkaService:
     """
@@ -100,6 +101,56 @@ class KafkaService:
             logger.error(f"Failed to send event to Kafka: {e}")
             return False
     
+    def send_events(self, topic: str, events: list, flush_timeout: float = 10):
+        """
+        Gửi nhiều events tới Kafka topic với một lần flush.
+        
+        events: list of dict {'event_type', 'data', 'key' (optional)}.
+        Trả về số events đã được đưa vào producer.
+        """
+        if not self.kafka_enabled or not self.producer:
+            logger.debug(f"Kafka not available, skipping {len(events)} events")
+            return 0
+        
+        sent = 0
+        source_service = os.getenv('SERVICE_NAME', 'unknown')
+        try:
+            for event in events:
+                message = {
+                    'event_id': str(uuid.uuid4()),
+                    'event_type': event['event_type'],
+                    'timestamp': datetime.utcnow().isoformat(),
+                    'data': event['data'],
+                    'source_service': source_service
+                }
+                value = json.dumps(message)
+                
+                while True:
+                    try:
+                        self.producer.produce(
+                            topic=topic,
+                            key=event.get('key'),
+                            value=value,
+                            callback=self._delivery_report
+                        )
+                        break
+                    except BufferError:
+                        # Local queue đầy: chờ delivery reports rồi thử lại
+                        self.producer.poll(0.5)
+                sent += 1
+                self.producer.poll(0)
+            
+            remaining = self.producer.flush(timeout=flush_timeout)
+            if remaining:
+                logger.warning(f"{remaining} messages still pending after flush to {topic}")
+            
+            logger.info(f"{sent} events sent to topic {topic}")
+            return sent
+            
+        except Exception as e:
+            logger.error(f"Failed to send events to Kafka: {e}")
+            return sent
+    
     def _delivery_report(self, err, msg):
         """Callback cho delivery report"""
         if err is not None:
@@ -108,10 +159,18 @@ class KafkaService:
             logger.debug(f"Message delivered to {msg.topic()} [{msg.partition()}]")
     
     def create_consumer(self, topics: list, group_id: str, 
-                       message_handler: Callable[[Dict[str, Any]], None]):
+                       message_handler: Callable[[Dict[str, Any]], None],
+                       consumer_key: Optional[str] = None,
+                       offset_reset: str = 'earliest'):
         """
         Tạo Kafka consumer
+        
+        consumer_key dùng để đăng ký/stop consumer khi nhiều consumers
+        trong cùng process chia sẻ một group_id (mặc định là group_id).
+        offset_reset='latest' cho các consumers chỉ cần events mới
+        (ví dụ broadcast group riêng cho từng process).
         """
+        consumer_key = consumer_key or group_id
         if not self.kafka_enabled:
             logger.warning(f"Kafka not available, cannot create consumer for {group_id}")
             return False
@@ -120,7 +179,7 @@ class KafkaService:
             consumer_config = {
                 **self.kafka_config,
                 'group.id': group_id,
-                'auto.offset.reset': 'earliest',
+                'auto.offset.reset': offset_reset,
                 'enable.auto.commit': True,
                 'auto.commit.interval.ms': 1000,
             }
@@ -129,7 +188,7 @@ class KafkaService:
             consumer.subscribe(topics)
             
             # Store consumer
-            self.consumers[group_id] = {
+            self.consumers[consumer_key] = {
                 'consumer': consumer,
                 'handler': message_handler,
                 'topics': topics,
@@ -139,21 +198,193 @@ class KafkaService:
             # Start consumer thread
             thread = threading.Thread(
                 target=self._consumer_loop, 
-                args=(group_id,),
+                args=(consumer_key,),
                 daemon=True
             )
+            self.consumers[consumer_key]['thread'] = thread
             thread.start()
             
-            logger.info(f"Consumer created for group {group_id}, topics: {topics}")
+            logger.info(f"Consumer {consumer_key} created for group {group_id}, topics: {topics}")
             return True
             
         except Exception as e:
             logger.error(f"Failed to create consumer: {e}")
             return False
     
-    def _consumer_loop(self, group_id: str):
+    def create_batch_consumer(self, topics: list, group_id: str,
+                              batch_handler: Callable[[list], None],
+                              batch_size: int = 500, batch_timeout: float = 0.2,
+                              consumer_key: Optional[str] = None,
+                              max_attempts: int = 5, dead_letter_topic: Optional[str] = None,
+                              transient_errors: tuple = ()):
+        """
+        Tạo Kafka consumer xử lý messages theo batch.
+        
+        batch_handler nhận list messages (đúng thứ tự trong mỗi partition).
+        Offsets chỉ được commit sau khi handler thành công; nếu handler lỗi,
+        cùng batch được xử lý lại (at-least-once, handler phải idempotent).
+        
+        Batch lỗi `max_attempts` lần liên tiếp được xử lý lại từng message một;
+        message vẫn lỗi (và message không decode được) được gửi sang
+        `dead_letter_topic` rồi bỏ qua, để một message hỏng không chặn
+        partition. Lỗi thuộc `transient_errors` (ví dụ mất kết nối DB) không
+        phải lỗi của message: luôn retry cả batch, không dead-letter.
+        """
+        consumer_key = consumer_key or group_id
+        if not self.kafka_enabled:
+            logger.warning(f"Kafka not available, cannot create batch consumer for {group_id}")
+            return False
+        
+        try:
+            consumer_config = {
+                **self.kafka_config,
+                'group.id': group_id,
+                'auto.offset.reset': 'earliest',
+                'enable.auto.commit': False,
+            }
+            
+            consumer = Consumer(consumer_config)
+            consumer.subscribe(topics)
+            
+            self.consumers[consumer_key] = {
+                'consumer': consumer,
+                'handler': batch_handler,
+                'topics': topics,
+                'active': True
+            }
+            
+            consumer_info = self.consumers[consumer_key]
+            consumer_info.update({
+                'max_attempts': max(max_attempts, 1),
+                'dead_letter_topic': dead_letter_topic,
+                'transient_errors': tuple(transient_errors),
+            })
+            
+            thread = threading.Thread(
+                target=self._batch_consumer_loop,
+                args=(consumer_key, batch_size, batch_timeout),
+                daemon=True
+            )
+            self.consumers[consumer_key]['thread'] = thread
+            thread.start()
+            
+            logger.info(f"Batch consumer {consumer_key} created for group {group_id}, topics: {topics}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Failed to create batch consumer: {e}")
+            return False
+    
+    def _batch_consumer_loop(self, consumer_key: str, batch_size: int, batch_timeout: float):
+        """Batch consumer loop chạy trong background thread"""
+        consumer_info = self.consumers.get(consumer_key)
+        if not consumer_info:
+            return
+        
+        consumer = consumer_info['consumer']
+        handler = consumer_info['handler']
+        
+        try:
+            while consumer_info['active']:
+                msgs = consumer.consume(num_messages=batch_size, timeout=batch_timeout)
+                if not msgs:
+                    continue
+                
+                batch = []
+                undecodable = []
+                for msg in msgs:
+                    if msg.error():
+                        if msg.error().code() != KafkaError._PARTITION_EOF:
+                            logger.error(f"Consumer error: {msg.error()}")
+                        continue
+                    try:
+                        batch.append((msg, json.loads(msg.value().decode('utf-8'))))
+                    except Exception as e:
+                        logger.error(f"Skipping undecodable message from {msg.topic()}: {e}")
+                        undecodable.append((msg, e))
+                
+                # Retry batch tới khi thành công (hoặc đã dead-letter các
+                # messages lỗi), rồi mới commit offsets
+                delay = 0.5
+                attempts = 0
+                while consumer_info['active']:
+                    try:
+                        while undecodable:
+                            if not self._dead_letter(consumer_info, *undecodable[0]):
+                                raise RuntimeError("Failed to dead-letter undecodable message")
+                            undecodable.pop(0)
+                        if batch:
+                            handler([data for _, data in batch])
+                        consumer.commit(asynchronous=False)
+                        break
+                    except Exception as e:
+                        attempts += 1
+                        if (attempts >= consumer_info['max_attempts'] and batch
+                                and not isinstance(e, consumer_info['transient_errors'])):
+                            batch = self._handle_individually(consumer_info, batch)
+                            if not batch:
+                                continue
+                        logger.error(f"Error processing batch of {len(batch)} messages, retrying in {delay}s: {e}")
+                        time.sleep(delay)
+                        delay = min(delay * 2, 30)
+                    
+        except KafkaException as e:
+            logger.error(f"Kafka batch consumer error: {e}")
+        except Exception as e:
+            logger.error(f"Unexpected batch consumer error: {e}")
+        finally:
+            try:
+                consumer.close()
+            except:
+                pass
+    
+    def _handle_individually(self, consumer_info, batch):
+        """
+        Xử lý lại từng message của batch lỗi; message lỗi được dead-letter.
+        Trả về các messages còn phải retry (rỗng nếu đã xử lý hết).
+        """
+        handler = consumer_info['handler']
+        for index, (msg, data) in enumerate(batch):
+            try:
+                handler([data])
+            except consumer_info['transient_errors'] as e:
+                logger.error(f"Transient error processing message from {msg.topic()}: {e}")
+                return batch[index:]
+            except Exception as e:
+                if not self._dead_letter(consumer_info, msg, e):
+                    return batch[index:]
+        return []
+    
+    def _dead_letter(self, consumer_info, msg, error) -> bool:
+        """Gửi message gốc (kèm lỗi) sang dead-letter topic; False nếu gửi không được"""
+        topic = consumer_info.get('dead_letter_topic')
+        source = f"{msg.topic()}[{msg.partition()}]@{msg.offset()}"
+        if not topic:
+            logger.error(f"Dropping message {source}: {error}")
+            return True
+        if not self.producer:
+            return False
+        try:
+            self.producer.produce(
+                topic,
+                key=msg.key(),
+                value=msg.value(),
+                headers=[
+                    ('error', str(error)[:1000].encode('utf-8')),
+                    ('source', source.encode('utf-8')),
+                ]
+            )
+            if self.producer.flush(10) > 0:
+                return False
+        except Exception as e:
+            logger.error(f"Failed to dead-letter message {source}: {e}")
+            return False
+        logger.error(f"Dead-lettered message {source} to {topic}: {error}")
+        return True
+    
+    def _consumer_loop(self, consumer_key: str):
         """Consumer loop chạy trong background thread"""
-        consumer_info = self.consumers.get(group_id)
+        consumer_info = self.consumers.get(consumer_key)
         if not consumer_info:
             return
         
@@ -167,24 +398,7 @@ class KafkaService:
                 if msg is None:
                     continue
                 
-                if msg.error():
-                    if msg.error().code() == KafkaError._PARTITION_EOF:
-                        logger.debug(f"End of partition reached {msg.topic()}/{msg.partition()}")
-                    else:
-                        logger.error(f"Consumer error: {msg.error()}")
-                    continue
-                
-                try:
-                    # Parse message
-                    message_data = json.loads(msg.value().decode('utf-8'))
-                    
-                    # Call handler
-                    handler(message_data)
-                    
-                    logger.debug(f"Processed message from {msg.topic()}")
-                    
-                except Exception as e:
-                    logger.error(f"Error processing message: {e}")
+                self._process_message(msg, handler)
                     
         except KafkaException as e:
             logger.error(f"Kafka consumer error: {e}")
@@ -196,17 +410,283 @@ class KafkaService:
             except:
                 pass
     
-    def stop_consumer(self, group_id: str):
-        """Stop a specific consumer"""
-        if group_id in self.consumers:
-            self.consumers[group_id]['active'] = False
-            logger.info(f"Stopped consumer {group_id}")
+    def _process_message(self, msg, handler) -> bool:
+        """Decode một message và gọi handler; False nếu là error/EOF"""
+        if msg.error():
+            if msg.error().code() == KafkaError._PARTITION_EOF:
+                logger.debug(f"End of partition reached {msg.topic()}/{msg.partition()}")
+            else:
+                logger.error(f"Consumer error: {msg.error()}")
+            return False
+        
+        try:
+            # Parse message
+            message_data = json.loads(msg.value().decode('utf-8'))
+            
+            # Call handler
+            handler(message_data)
+            
+            logger.debug(f"Processed message from {msg.topic()}")
+            
+        except Exception as e:
+            logger.error(f"Error processing message: {e}")
+        return True
+    
+    def create_weighted_consumer(self, lanes: list, group_id: str,
+                                 message_handler: Callable[[Dict[str, Any]], None],
+                                 consumer_key: Optional[str] = None,
+                                 idle_timeout: float = 0.2, buffer_size: int = 500,
+                                 manual_ack: bool = False):
+        """
+        Tạo consumer đọc nhiều topics (lanes) theo weighted round-robin.
+        
+        lanes: list (topic, weight) theo thứ tự ưu tiên giảm dần. Một Consumer
+        subscribe mọi lanes với range assignor: các lanes có cùng số
+        partitions nên cùng partition number (cùng message key) của mọi lanes
+        luôn được assign cho cùng consumer.
+        
+        Messages được buffer theo lane; mỗi vòng xử lý tối đa `weight` messages
+        của từng lane, nên lane cao được phần lớn throughput khi mọi lane đều
+        có backlog nhưng lane thấp vẫn luôn được đọc (không bị starve). Lane có
+        buffer đầy (`buffer_size`) bị pause tới khi xử lý bớt, để backlog của
+        một lane không chặn việc fetch các lanes khác.
+        
+        Mặc định offset được store ngay khi handler return. Với `manual_ack`,
+        handler được gọi `handler(message, ack)` và offset chỉ được store khi
+        `ack()` (thread-safe, gọi nhiều lần không sao) đã được gọi cho message
+        đó và mọi message trước nó trong partition: handler có thể xử lý bất
+        đồng bộ mà agent dừng giữa chừng thì messages chưa ack được deliver lại
+        (at-least-once). Handler raise thì message được ack luôn (bị bỏ).
+        """
+        consumer_key = consumer_key or group_id
+        if not self.kafka_enabled:
+            logger.warning(f"Kafka not available, cannot create weighted consumer for {group_id}")
+            return False
+        
+        try:
+            consumer_config = {
+                **self.kafka_config,
+                'group.id': group_id,
+                'auto.offset.reset': 'earliest',
+                'enable.auto.commit': True,
+                'auto.commit.interval.ms': 1000,
+                'enable.auto.offset.store': False,
+                'partition.assignment.strategy': 'range',
+            }
+            
+            consumer = Consumer(consumer_config)
+            consumer_info = {
+                'consumer': consumer,
+                'lanes': [(topic, max(int(weight), 1)) for topic, weight in lanes],
+                'handler': message_handler,
+                'topics': [topic for topic, _ in lanes],
+                'buffers': {topic: deque() for topic, _ in lanes},
+                'paused': set(),
+                'manual_ack': manual_ack,
+                # (topic, partition) -> deque các [offset, acked] theo thứ tự nhận
+                'in_flight': {},
+                'ack_lock': threading.Lock(),
+                'draining': False,
+                'active': True
+            }
+            consumer.subscribe(
+                consumer_info['topics'],
+                on_revoke=lambda consumer, partitions: self._drop_revoked(consumer_info, partitions)
+            )
+            self.consumers[consumer_key] = consumer_info
+            
+            thread = threading.Thread(
+                target=self._weighted_consumer_loop,
+                args=(consumer_key, idle_timeout, buffer_size),
+                daemon=True
+            )
+            consumer_info['thread'] = thread
+            thread.start()
+            
+            logger.info(f"Weighted consumer {consumer_key} created for group {group_id}, lanes: {lanes}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Failed to create weighted consumer: {e}")
+            return False
+    
+    def _drop_revoked(self, consumer_info, partitions):
+        """Bỏ messages đã buffer của partitions bị revoke (consumer mới đọc lại từ committed offset)"""
+        revoked = {(partition.topic, partition.partition) for partition in partitions}
+        for topic, buffer in consumer_info['buffers'].items():
+            kept = [msg for msg in buffer if (msg.topic(), msg.partition()) not in revoked]
+            buffer.clear()
+            buffer.extend(kept)
+        # Assignment mới bắt đầu ở trạng thái resumed
+        consumer_info['paused'].clear()
+        # Messages chưa ack của partitions bị revoke sẽ được consumer mới đọc
+        # lại; ack muộn của chúng không còn tác dụng
+        with consumer_info['ack_lock']:
+            for key in revoked:
+                consumer_info['in_flight'].pop(key, None)
+    
+    def _weighted_consumer_loop(self, consumer_key: str, idle_timeout: float, buffer_size: int):
+        """Weighted round-robin giữa các lanes, chạy trong background thread"""
+        consumer_info = self.consumers.get(consumer_key)
+        if not consumer_info:
+            return
+        
+        consumer = consumer_info['consumer']
+        handler = consumer_info['handler']
+        buffers = consumer_info['buffers']
+        paused = consumer_info['paused']
+        
+        try:
+            while consumer_info['active']:
+                if consumer_info.get('manual_ack'):
+                    self._store_acked(consumer_info)
+                if consumer_info.get('draining'):
+                    # Chỉ store offsets của messages đang chạy nốt, không đọc thêm
+                    time.sleep(idle_timeout)
+                    continue
+                
+                # Chỉ chờ message mới khi không còn gì trong buffers
+                timeout = 0 if any(buffers.values()) else idle_timeout
+                for msg in consumer.consume(num_messages=buffer_size, timeout=timeout):
+                    if msg.error():
+                        self._process_message(msg, handler)
+                    else:
+                        buffers[msg.topic()].append(msg)
+                
+                for topic, buffer in buffers.items():
+                    if topic not in paused and len(buffer) >= buffer_size:
+                        self._set_lane_paused(consumer, topic, True)
+                        paused.add(topic)
+                    elif topic in paused and len(buffer) < buffer_size // 2:
+                        self._set_lane_paused(consumer, topic, False)
+                        paused.discard(topic)
+                
+                for topic, weight in consumer_info['lanes']:
+                    buffer = buffers[topic]
+                    for _ in range(min(weight, len(buffer))):
+                        if not consumer_info['active']:
+                            break
+                        msg = buffer.popleft()
+                        if consumer_info.get('manual_ack'):
+                            self._process_acked_message(consumer_info, msg, handler)
+                        else:
+                            self._process_message(msg, handler)
+                            consumer.store_offsets(message=msg)
+                    
+        except KafkaException as e:
+            logger.error(f"Kafka weighted consumer error: {e}")
+        except Exception as e:
+            logger.error(f"Unexpected weighted consumer error: {e}")
+        finally:
+            try:
+                if consumer_info.get('manual_ack'):
+                    self._store_acked(consumer_info)
+                consumer.close()
+            except:
+                pass
+    
+    def _process_acked_message(self, consumer_info, msg, handler):
+        """Gọi handler(message, ack); offset của message chờ tới khi được ack"""
+        entry = [msg.offset(), False]
+        lock = consumer_info['ack_lock']
+        with lock:
+            consumer_info['in_flight'].setdefault((msg.topic(), msg.partition()), deque()).append(entry)
+        
+        def ack():
+            with lock:
+                entry[1] = True
+        
+        try:
+            message_data = json.loads(msg.value().decode('utf-8'))
+            handler(message_data, ack)
+            logger.debug(f"Processed message from {msg.topic()}")
+        except Exception as e:
+            logger.error(f"Error processing message: {e}")
+            ack()
+    
+    @staticmethod
+    def _store_acked(consumer_info):
+        """Store offset sau đoạn messages đã ack liên tiếp từ đầu mỗi partition"""
+        offsets = []
+        with consumer_info['ack_lock']:
+            for (topic, partition), entries in consumer_info['in_flight'].items():
+                last = None
+                while entries and entries[0][1]:
+                    last = entries.popleft()[0]
+                if last is not None:
+                    offsets.append(TopicPartition(topic, partition, last + 1))
+        if offsets:
+            consumer_info['consumer'].store_offsets(offsets=offsets)
+    
+    def drain_consumer(self, consumer_key: str):
+        """Ngừng đọc messages mới nhưng vẫn store offsets của messages được ack sau đó"""
+        if consumer_key in self.consumers:
+            self.consumers[consumer_key]['draining'] = True
+    
+    @staticmethod
+    def _set_lane_paused(consumer, topic, paused):
+        partitions = [partition for partition in consumer.assignment() if partition.topic == topic]
+        if not partitions:
+            return
+        if paused:
+            consumer.pause(partitions)
+        else:
+            consumer.resume(partitions)
+    
+    def get_consumer_lag(self, group_id: str, topics: list) -> Optional[Dict[str, int]]:
+        """
+        Lag của consumer group trên các topics: tổng (high watermark -
+        committed offset) và số partitions. None nếu Kafka không khả dụng.
+        """
+        if not self.kafka_enabled:
+            return None
+        
+        consumer = None
+        try:
+            # Consumer không subscribe nên không tham gia rebalance của group
+            consumer = Consumer({**self.kafka_config, 'group.id': group_id, 'enable.auto.commit': False})
+            partitions = []
+            for topic in topics:
+                metadata = consumer.list_topics(topic, timeout=5).topics.get(topic)
+                if metadata is None or metadata.error:
+                    continue
+                partitions += [TopicPartition(topic, partition) for partition in metadata.partitions]
+            
+            lag = 0
+            for partition in consumer.committed(partitions, timeout=5):
+                low, high = consumer.get_watermark_offsets(partition, timeout=5)
+                committed = partition.offset if partition.offset >= 0 else low
+                lag += max(high - committed, 0)
+            return {'lag': lag, 'partitions': len(partitions)}
+        except Exception as e:
+            logger.error(f"Failed to get consumer lag for {group_id}: {e}")
+            return None
+        finally:
+            if consumer is not None:
+                consumer.close()
+    
+    def is_consumer_alive(self, consumer_key: str) -> bool:
+        """Consumer đang active và consumer thread còn chạy"""
+        consumer_info = self.consumers.get(consumer_key)
+        if not consumer_info or not consumer_info['active']:
+            return False
+        thread = consumer_info.get('thread')
+        return bool(thread and thread.is_alive())
+    
+    def stop_consumer(self, consumer_key: str, join_timeout: Optional[float] = None):
+        """Stop a specific consumer (join_timeout: chờ consumer thread commit offsets và close)"""
+        if consumer_key in self.consumers:
+            self.consumers[consumer_key]['active'] = False
+            thread = self.consumers[consumer_key].get('thread')
+            if join_timeout and thread and thread is not threading.current_thread():
+                thread.join(timeout=join_timeout)
+            logger.info(f"Stopped consumer {consumer_key}")
     
     def close(self):
         """Close all connections"""
         # Stop all consumers
-        for group_id in self.consumers:
-            self.stop_consumer(group_id)
+        for consumer_key in self.consumers:
+            self.stop_consumer(consumer_key)
         
         if self.producer:
             self.producer.flush()
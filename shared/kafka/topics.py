@@ -10,8 +10,14 @@ class Topics:
     
     API_TEST_REQUESTS = 'api-test-requests'
     DEVICE_COMMANDS = 'device-commands'
+    # Priority lanes của device command execution (lane normal là DEVICE_COMMANDS);
+    # phải có cùng số partitions với DEVICE_COMMANDS
+    DEVICE_COMMANDS_HIGH = 'device-commands-high'
+    DEVICE_COMMANDS_LOW = 'device-commands-low'
     DEVICE_STATUS = 'device-status'
     COMMAND_RESULTS = 'command-results'
+    # Outcomes không persist được (dead-letter của CommandResultConsumer)
+    COMMAND_RESULTS_DLQ = 'command-results-dlq'
 
 class EventTypes:
     """Event type constants"""
@@ -54,19 +60,28 @@ class EventTypes:
     # Device Command events
     DEVICE_COMMAND_REQUESTED = 'device_command_requested'
     DEVICE_COMMAND_EXECUTING = 'device_command_executing'
+    DEVICE_COMMAND_STARTED = 'device_command_started'
     DEVICE_COMMAND_COMPLETED = 'device_command_completed'
     DEVICE_COMMAND_FAILED = 'device_command_failed'
     DEVICE_COMMAND_TIMEOUT = 'device_command_timeout'
+    DEVICE_COMMAND_RETRY_SCHEDULED = 'device_command_retry_scheduled'
+    DEVICE_COMMAND_SUPERSEDED = 'device_command_superseded'
+    DEVICE_COMMAND_PREWARM = 'device_command_prewarm'
+    DEVICE_COMMAND_BATCH_EXECUTING = 'device_command_batch_executing'
     
     # Command Template events
     COMMAND_TEMPLATE_DELETED = 'command_template_deleted'
     COMMAND_TEMPLATE_TYPE_CHANGED = 'command_template_type_changed'
+    COMMAND_TEMPLATE_UPDATED = 'command_template_updated'
     
     # Device events
     DEVICE_ONLINE = 'device_online'
     DEVICE_OFFLINE = 'device_offline'
     DEVICE_STATUS_CHANGED = 'device_status_changed'
     DEVICE_COMMANDS_DISCONNECTED = 'device_commands_disconnected'
+    DEVICE_UPDATED = 'device_updated'
+    DEVICE_DELETED = 'device_deleted'
+    DEVICE_COMMAND_UPDATED = 'device_command_updated'
     
     # Command Result events
     COMMAND_RESULT_SUCCESS = 'command_result_success'
@@ -80,6 +95,9 @@ class EventTypes:
     SERVICE_STOPPED = 'service_stopped'
     HEALTH_CHECK = 'health_check'
     
+    # Metrics events
+    METRICS_SUMMARY = 'metrics_summary'
+    
     # Audit events
     AUDIT_LOG = 'audit_log'
     SECURITY_EVENT = 'security_event'
@@ -180,6 +198,26 @@ TOPIC_CONFIGS = {
             'max.message.bytes': '10485760'
         }
     },
+    Topics.DEVICE_COMMANDS_HIGH: {
+        'partitions': 3,
+        'replication_factor': 1,
+        'config': {
+            'retention.ms': str(7 * 24 * 60 * 60 * 1000),  # 7 days
+            'cleanup.policy': 'delete',
+            'compression.type': 'snappy',
+            'max.message.bytes': '10485760'
+        }
+    },
+    Topics.DEVICE_COMMANDS_LOW: {
+        'partitions': 3,
+        'replication_factor': 1,
+        'config': {
+            'retention.ms': str(7 * 24 * 60 * 60 * 1000),  # 7 days
+            'cleanup.policy': 'delete',
+            'compression.type': 'snappy',
+            'max.message.bytes': '10485760'
+        }
+    },
     Topics.DEVICE_STATUS: {
         'partitions': 6,
         'replication_factor': 1,
@@ -198,4 +236,13 @@ TOPIC_CONFIGS = {
             'compression.type': 'snappy'
         }
     },
+    Topics.COMMAND_RESULTS_DLQ: {
+        'partitions': 1,
+        'replication_factor': 1,
+        'config': {
+            'retention.ms': str(30 * 24 * 60 * 60 * 1000),  # 30 days
+            'cleanup.policy': 'delete',
+            'compression.type': 'snappy'
+        }
+    },
 }
\ No newline at end of file
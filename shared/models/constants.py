@@ -12,3 +12,10 @@ HTTP_METHOD_CHOICES = [
     ('DELETE', 'DELETE'),
     ('PATCH', 'PATCH'),
 ]
+
+# Priority lanes của device command dispatch (thứ tự từ cao xuống thấp)
+COMMAND_PRIORITY_CHOICES = [
+    ('high', 'High'),
+    ('normal', 'Normal'),
+    ('low', 'Low'),
+]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.21 on 2026-10-19 02:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_config', '0013_alter_apiconfiguration_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commandtemplate',
+            name='coalesce',
+            field=models.BooleanField(default=False),
+        ),
+    ]
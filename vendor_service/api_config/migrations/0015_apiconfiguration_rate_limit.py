@@ -0,0 +1,23 @@
+# Generated by Django 4.2.21 on 2026-10-19 02:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_config', '0014_commandtemplate_coalesce'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apiconfiguration',
+            name='rate_limit',
+            field=models.FloatField(blank=True, help_text='Requests per second', null=True),
+        ),
+        migrations.AddField(
+            model_name='apiconfiguration',
+            name='rate_limit_burst',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.21 on 2026-10-19 02:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_config', '0015_apiconfiguration_rate_limit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commandtemplate',
+            name='priority',
+            field=models.CharField(blank=True, choices=[('high', 'High'), ('normal', 'Normal'), ('low', 'Low')], default='', max_length=10),
+        ),
+    ]
@@ -1,6 +1,6 @@
 from django.db import models
 import uuid
-from shared.models.constants import AUTH_CHOICES, HTTP_METHOD_CHOICES
+from shared.models.constants import AUTH_CHOICES, HTTP_METHOD_CHOICES, COMMAND_PRIORITY_CHOICES
 from shared.models.base_config import BaseConfigurationMixin, BaseAuthMixin
 from shared.models.soft_delete import SoftDeleteMixin, SoftDeleteManager
 
@@ -11,6 +11,12 @@ class APIConfiguration(SoftDeleteMixin, BaseAuthMixin, BaseConfigurationMixin):
     description = models.TextField(blank=True)
     
     is_active = models.BooleanField(default=True)
+    
+    # Token bucket cho outbound requests tới vendor (theo api_config + host),
+    # dùng chung giữa các command agents. Trống = không giới hạn
+    rate_limit = models.FloatField(null=True, blank=True, help_text='Requests per second')
+    rate_limit_burst = models.PositiveIntegerField(null=True, blank=True)
+    
     created_by = models.CharField(max_length=100)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -26,6 +32,26 @@ class APIConfiguration(SoftDeleteMixin, BaseAuthMixin, BaseConfigurationMixin):
     def __str__(self):
         return f"{self.vendor.name} - {self.name} {self.version}"
     
+    def save(self, *args, **kwargs):
+        """Override to publish update event (invalidates cached command contexts)"""
+        is_update = not self._state.adding
+        super().save(*args, **kwargs)
+        
+        if is_update:
+            from shared.kafka.publisher import EventPublisher
+            from shared.kafka.topics import Topics, EventTypes
+            
+            EventPublisher.publish_event(
+                Topics.VENDOR_EVENTS,
+                EventTypes.API_CONFIG_UPDATED,
+                {
+                    'api_config_id': str(self.id),
+                    'vendor_id': str(self.vendor_id) if self.vendor_id else None,
+                    'updated_at': self.updated_at.isoformat()
+                },
+                key=str(self.id)
+            )
+    
     def soft_delete(self, user_id=None, reason=""):
         """Override to publish event"""
         super().soft_delete(user_id, reason)
@@ -62,6 +88,13 @@ class CommandTemplate(SoftDeleteMixin, BaseConfigurationMixin):
     required_params = models.JSONField(default=list)
     optional_params = models.JSONField(default=list)
     
+    # Command mới cùng loại thay thế các commands đang chờ cho cùng device
+    # (ví dụ set_brightness: chỉ giá trị cuối cùng có ý nghĩa)
+    coalesce = models.BooleanField(default=False)
+    
+    # Priority lane mặc định của command_type (rỗng = normal); DeviceCommand.priority khác 1 override
+    priority = models.CharField(max_length=10, choices=COMMAND_PRIORITY_CHOICES, blank=True, default='')
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -75,6 +108,27 @@ class CommandTemplate(SoftDeleteMixin, BaseConfigurationMixin):
     def __str__(self):
         return f"{self.api_config.name} - {self.command_type}"
     
+    def save(self, *args, **kwargs):
+        """Override to publish update event (invalidates cached command contexts)"""
+        is_update = not self._state.adding
+        super().save(*args, **kwargs)
+        
+        if is_update:
+            from shared.kafka.publisher import EventPublisher
+            from shared.kafka.topics import Topics, EventTypes
+            
+            EventPublisher.publish_event(
+                Topics.VENDOR_EVENTS,
+                EventTypes.COMMAND_TEMPLATE_UPDATED,
+                {
+                    'template_id': str(self.id),
+                    'command_type': self.command_type,
+                    'api_config_id': str(self.api_config_id) if self.api_config_id else None,
+                    'updated_at': self.updated_at.isoformat()
+                },
+                key=str(self.id)
+            )
+    
     def soft_delete(self, user_id=None, reason=""):
         """Override to collect DeviceCommand data and publish event"""
         
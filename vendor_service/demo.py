@@ -4,7 +4,6 @@ Demo script for API Management System with multiple vendor types
 """
 import requests
 import json
-import time
 import uuid
 
 BASE_URL = "http://localhost:8000/api"  # API Gateway URL
@@ -572,14 +571,16 @@ def execute_command(device_id, command_type, params=None):
     print(f"Command {command_type} initiated with ID: {command_id}")
     return command_id
 
-def check_command_status(command_id, max_retries=10, retry_delay=1):
-    """Check command execution status"""
+def check_command_status(command_id, max_retries=10, wait=10):
+    """Check command execution status (long-poll: server giữ request tới khi status đổi)"""
     retries = 0
     
     while retries < max_retries:
         response = requests.get(
             f"{BASE_URL}/commands/{command_id}/status/",
-            headers=get_headers()
+            params={'wait': wait},
+            headers=get_headers(),
+            timeout=wait + 5
         )
         
         if response.status_code != 200:
@@ -593,12 +594,11 @@ def check_command_status(command_id, max_retries=10, retry_delay=1):
         
         if status in ['completed', 'failed']:
             if 'execution' in result:
-                execution_result = result['execution']['result']
+                execution_result = result['execution']['response_data']
                 print(f"Result: {json.dumps(execution_result, indent=2)}")
             return result
         
         retries += 1
-        time.sleep(retry_delay)
     
     print("Command status check timed out")
     return None
@@ -22,6 +22,25 @@ class Device(SoftDeleteMixin, BaseAuthMixin, BaseConfigurationMixin):
     
     def __str__(self):
         return f"{self.name} ({self.serial_number or 'No Serial'})"
+    
+    def save(self, *args, **kwargs):
+        """Override to publish update event (invalidates cached command contexts)"""
+        is_update = not self._state.adding
+        super().save(*args, **kwargs)
+        
+        if is_update:
+            from shared.kafka.publisher import EventPublisher
+            from shared.kafka.topics import Topics, EventTypes
+            
+            EventPublisher.publish_event(
+                Topics.VENDOR_EVENTS,
+                EventTypes.DEVICE_DELETED if self.is_deleted else EventTypes.DEVICE_UPDATED,
+                {
+                    'device_id': str(self.id),
+                    'updated_at': self.updated_at.isoformat()
+                },
+                key=str(self.id)
+            )
 
     class Meta:
         db_table = 'devices'
@@ -72,6 +91,23 @@ class DeviceCommand(SoftDeleteMixin, BaseConfigurationMixin):
 
         super().save(*args, **kwargs)
         
+        # Primary/active/params thay đổi làm cached command contexts hết hiệu lực
+        from shared.kafka.publisher import EventPublisher
+        from shared.kafka.topics import Topics, EventTypes
+        
+        EventPublisher.publish_event(
+            Topics.VENDOR_EVENTS,
+            EventTypes.DEVICE_COMMAND_UPDATED,
+            {
+                'device_command_id': str(self.id),
+                'device_id': str(self.device_id),
+                'command_type': self.command_type,
+                'command_template_id': str(self.command_id) if self.command_id else None,
+                'updated_at': self.updated_at.isoformat()
+            },
+            key=str(self.device_id)
+        )
+        
     @classmethod
     def get_primary_command(cls, device_id, command_type):
         """Get primary command for execution"""
@@ -38,6 +38,8 @@ class VendorServiceServicer(vendor_service_pb2_grpc.VendorServiceServicer):
                 created_by=str(api_config.created_by or ''),
                 created_at=api_config.created_at.isoformat() if api_config.created_at else '',
                 updated_at=api_config.updated_at.isoformat() if api_config.updated_at else '',
+                rate_limit=float(api_config.rate_limit or 0),
+                rate_limit_burst=int(api_config.rate_limit_burst or 0),
             )
             
             response = vendor_service_pb2.GetApiConfigByIDResponse(api_config=response_config)
@@ -79,6 +81,8 @@ class VendorServiceServicer(vendor_service_pb2_grpc.VendorServiceServicer):
                 api_config_id=str(command_template.api_config.id) if command_template.api_config else '',
                 created_at=command_template.created_at.isoformat() if command_template.created_at else '',
                 updated_at=command_template.updated_at.isoformat() if command_template.updated_at else '',
+                coalesce=bool(command_template.coalesce),
+                priority=str(command_template.priority or ''),
             )
             
             response = vendor_service_pb2.GetCommandTemplateResponse(command_template=response_template)
@@ -139,6 +143,37 @@ class VendorServiceServicer(vendor_service_pb2_grpc.VendorServiceServicer):
             context.set_details(f"An error occurred: {str(e)}")
             return vendor_service_pb2.GetDeviceResponse()
 
+    def ListDeviceIds(self, request, context):
+        """List IDs của devices có primary command active cho command_type (dùng cho bulk commands)"""
+        try:
+            device_commands = DeviceCommand.objects.filter(
+                command_type=request.command_type,
+                is_primary=True,
+                is_active=True,
+                device__is_deleted=False,
+                command__isnull=False
+            )
+            if request.vendor_id:
+                device_commands = device_commands.filter(device__vendor_id=request.vendor_id)
+            if request.model:
+                device_commands = device_commands.filter(device__model=request.model)
+            if request.api_config_id:
+                device_commands = device_commands.filter(command__api_config_id=request.api_config_id)
+            
+            device_ids = device_commands.order_by('device_id').values_list('device_id', flat=True)
+            if request.limit:
+                device_ids = device_ids[:request.limit]
+            
+            return vendor_service_pb2.ListDeviceIdsResponse(
+                device_ids=[str(device_id) for device_id in device_ids]
+            )
+            
+        except Exception as e:
+            print(f"ListDeviceIds error: {e}")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(f"An error occurred: {str(e)}")
+            return vendor_service_pb2.ListDeviceIdsResponse()
+
     def GetCommandContext(self, request, context):
         """Get command context for device"""
         try:
@@ -203,6 +238,8 @@ class VendorServiceServicer(vendor_service_pb2_grpc.VendorServiceServicer):
                 created_by=str(api_config.created_by or ''),
                 created_at=api_config.created_at.isoformat() if api_config.created_at else '',
                 updated_at=api_config.updated_at.isoformat() if api_config.updated_at else '',
+                rate_limit=float(api_config.rate_limit or 0),
+                rate_limit_burst=int(api_config.rate_limit_burst or 0),
             )
             
             # Create CommandTemplate message
@@ -224,6 +261,8 @@ class VendorServiceServicer(vendor_service_pb2_grpc.VendorServiceServicer):
                 api_config_id=str(command_template.api_config.id) if command_template.api_config else '',
                 created_at=command_template.created_at.isoformat() if command_template.created_at else '',
                 updated_at=command_template.updated_at.isoformat() if command_template.updated_at else '',
+                coalesce=bool(command_template.coalesce),
+                priority=str(command_template.priority or ''),
             )
             
             # Create DeviceCommand message